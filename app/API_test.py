@@ -1,6 +1,23 @@
 import os
-import requests
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime
 from dotenv import load_dotenv
+import Http_client
+from Service_health import OPEN, registry, service_key
+
+"""__summary__
+This script checks that the APIs of the media stack (Plex, Overseerr, Sonarr, Radarr, Redfish) are reachable.
+All endpoints are probed at the same time under one overall deadline, so a dead service costs at most the
+deadline instead of a timeout per service. Each endpoint can be probed several times (--repeat) to get latency
+percentiles (p50/p95/p99). Every run is appended to a history file, which the Flask app also serves, and the
+results are shared with the other scripts through Service_health.
+The endpoint table is read from api_endpoints.json in CONFIG_PATH when it exists, so more services can be added
+without code changes; otherwise the endpoints below, configured through the .env file, are used.
+"""
 
 load_dotenv()
 
@@ -29,102 +46,250 @@ SONARR_API_KEY= os.getenv('SONARR_API_KEY')
 API_ENDPOINTS = {
     "plex": {
         "url": os.getenv("PLEX_API_URL", "http://localhost:32400/status"),
+        "auth": "header",
+        "header": "X-Plex-Token",
         "token": os.getenv("PLEX_API_TOKEN")
     },
     "overseer": {
         "url": os.getenv("OVERSEER_API_URL", "http://localhost:5055/api/v1/status"),
+        "auth": "bearer",
         "token": os.getenv("OVERSEER_TOKEN")
     },
     "sonarr": {
         "url": os.getenv("SONARR_API_URL", "http://localhost:8989/api/system/status"),
+        "auth": "apikey",
         "token": os.getenv("SONARR_API_KEY")
     },
     "radarr": {
         "url": os.getenv("RADARR_API_URL", "http://localhost:7878/api/system/status"),
+        "auth": "apikey",
         "token": os.getenv("RADARR_API_KEY")
     },
     "redfish": {
         "url": os.getenv("REDFISH_URL", "http://localhost/redfish/v1"),
+        "auth": "basic",
         "username": os.getenv("REDFISH_USERNAME"),
         "password": os.getenv("REDFISH_PASSWORD")
     }
 }
 
-def check_api_status():
-    results = {}
+# Endpoint table that replaces API_ENDPOINTS when present
+ENDPOINTS_FILE = os.getenv("API_ENDPOINTS_FILE", os.path.join(os.getenv("CONFIG_PATH", ""), "api_endpoints.json"))
 
-    # Check Plex API
-    plex = API_ENDPOINTS.get("plex")
-    if plex:
-        headers = {"X-Plex-Token": plex["token"]}
-        try:
-            response = requests.get(plex["url"], headers=headers, timeout=10)
-            results["plex"] = {
-                "status_code": response.status_code,
-                "response": response.json() if response.headers.get("Content-Type") == "application/json" else response.text
-            }
-        except Exception as e:
-            results["plex"] = {"error": str(e)}
-
-    # Check Overseerr API
-    overseer = API_ENDPOINTS.get("overseer")
-    if overseer:
-        headers = {"Authorization": f"Bearer {overseer['token']}"}
-        try:
-            response = requests.get(overseer["url"], headers=headers, timeout=10)
-            results["overseer"] = {
-                "status_code": response.status_code,
-                "response": response.json() if response.headers.get("Content-Type") == "application/json" else response.text
-            }
-        except Exception as e:
-            results["overseer"] = {"error": str(e)}
-
-    # Check Sonarr API
-    sonarr = API_ENDPOINTS.get("sonarr")
-    if sonarr:
-        params = {"apikey": sonarr["token"]}
-        try:
-            response = requests.get(sonarr["url"], params=params, timeout=10)
-            results["sonarr"] = {
-                "status_code": response.status_code,
-                "response": response.json() if response.headers.get("Content-Type") == "application/json" else response.text
-            }
-        except Exception as e:
-            results["sonarr"] = {"error": str(e)}
-
-    # Check Radarr API
-    radarr = API_ENDPOINTS.get("radarr")
-    if radarr:
-        params = {"apikey": radarr["token"]}
-        try:
-            response = requests.get(radarr["url"], params=params, timeout=10)
-            results["radarr"] = {
-                "status_code": response.status_code,
-                "response": response.json() if response.headers.get("Content-Type") == "application/json" else response.text
-            }
-        except Exception as e:
-            results["radarr"] = {"error": str(e)}
-
-    # Check Redfish API
-    redfish = API_ENDPOINTS.get("redfish")
-    if redfish:
+# Timeout per request and overall deadline for a run, in seconds
+PROBE_TIMEOUT = float(os.getenv("API_TEST_TIMEOUT", 10))
+PROBE_DEADLINE = float(os.getenv("API_TEST_DEADLINE", 15))
+
+# Results of every run, one JSON object per line, trimmed to the newest HISTORY_MAX_ENTRIES runs
+STATE_PATH = os.getenv("STATE_PATH") or os.getenv("CONFIG_PATH") or "."
+HISTORY_FILE = os.getenv("API_TEST_HISTORY_FILE", os.path.join(STATE_PATH, "api_test_history.jsonl"))
+HISTORY_MAX_ENTRIES = int(os.getenv("API_TEST_HISTORY_MAX_ENTRIES", 2000))
+
+_history_lock = threading.Lock()
+
+def load_endpoints(endpoints_file=None):
+    """Return the endpoint table, from the JSON endpoints file if it exists, otherwise API_ENDPOINTS.
+
+    The file maps names to {"url", "auth", ...} like API_ENDPOINTS; "${VAR}" in a value is replaced with
+    the environment variable, so credentials can stay in the .env file.
+    """
+    endpoints_file = endpoints_file or ENDPOINTS_FILE
+    if not os.path.isfile(endpoints_file):
+        return API_ENDPOINTS
+    with open(endpoints_file, "r") as file:
+        endpoints = json.load(file)
+    return {
+        name: {key: os.path.expandvars(value) if isinstance(value, str) else value for key, value in endpoint.items()}
+        for name, endpoint in endpoints.items()
+        if endpoint.get("enabled", True)
+    }
+
+def _request_options(endpoint):
+    """Headers, query parameters and auth for an endpoint's "auth" type: header, bearer, apikey, basic or none."""
+    auth = endpoint.get("auth", "none")
+    options = {"headers": {}, "params": {}}
+    if auth == "header":
+        options["headers"][endpoint.get("header", "X-Api-Key")] = endpoint.get("token")
+    elif auth == "bearer":
+        options["headers"]["Authorization"] = f"Bearer {endpoint.get('token')}"
+    elif auth == "apikey":
+        options["params"][endpoint.get("param", "apikey")] = endpoint.get("token")
+    elif auth == "basic":
+        options["auth"] = (endpoint.get("username"), endpoint.get("password"))
+    if "verify" in endpoint:
+        options["verify"] = endpoint["verify"]
+    return options
+
+def probe(endpoint, timeout):
+    """Make one request to an endpoint, without retries. Returns the status code (or error), the response and the latency."""
+    started = time.monotonic()
+    try:
+        # The outcome is recorded by record_health, so the request does not go through the circuit breaker
+        response = Http_client.get(endpoint["url"], timeout=timeout, retries=0, breaker=False, **_request_options(endpoint))
+        return {
+            "status_code": response.status_code,
+            "response": response.json() if response.headers.get("Content-Type") == "application/json" else response.text,
+            "latency_ms": (time.monotonic() - started) * 1000
+        }
+    except Exception as e:
+        return {"error": str(e), "latency_ms": (time.monotonic() - started) * 1000}
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+def _probe_endpoint(endpoint, samples, repeat, timeout, deadline, stop):
+    """Probe one endpoint up to repeat times, one request after the other, until the deadline."""
+    for _ in range(repeat):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or stop.is_set():
+            break
+        sample = probe(endpoint, min(timeout, remaining))
+        samples.append(sample)
+        record_health(endpoint, sample)
+
+def record_health(endpoint, sample):
+    """Share a probe result with the other scripts through the service health store."""
+    name = service_key(endpoint["url"])
+    if "error" in sample or sample["status_code"] >= 500:
+        registry().record_failure(name, sample.get("error") or f"HTTP {sample['status_code']}", sample["latency_ms"])
+    else:
+        registry().record_success(name, sample["latency_ms"])
+
+def cached_result(endpoint, max_age):
+    """Return the stored health of an endpoint if it was checked within max_age seconds (or is down), else None."""
+    health = registry().status(service_key(endpoint["url"]))
+    if health["state"] != OPEN and (health["checked_at"] is None or time.time() - health["checked_at"] > max_age):
+        return None
+    result = {
+        "cached": True,
+        "state": health["state"],
+        "checked_at": health["checked_at"],
+        "latency_ms": health["latency_ms"],
+        "samples": 0
+    }
+    if health["state"] == OPEN or health["failures"]:
+        result["error"] = health["last_error"] or "Service is marked as down"
+    return result
+
+def summarize(samples):
+    """Combine the samples of one endpoint into the last result plus latency statistics."""
+    if not samples:
+        return {"error": "Deadline exceeded", "samples": 0}
+    result = dict(samples[-1])
+    latencies = [sample["latency_ms"] for sample in samples if "status_code" in sample]
+    result.update({
+        "samples": len(samples),
+        "failures": sum(1 for sample in samples if "error" in sample or sample["status_code"] >= 400),
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+        "max_ms": max(latencies) if latencies else None
+    })
+    return result
+
+def check_api_status(endpoints=None, repeat=1, deadline=None, timeout=None, max_age=None):
+    """Probe all endpoints at the same time and return a result per endpoint.
+
+    Each endpoint is requested repeat times. Probes still running when the deadline (seconds from now) passes are
+    abandoned, and endpoints without any completed probe are reported with a "Deadline exceeded" error.
+    With max_age, endpoints whose health another script recorded within max_age seconds, or that are marked as
+    down, are answered from the service health store instead of being probed again.
+    """
+    endpoints = load_endpoints() if endpoints is None else endpoints
+    cached = {}
+    if max_age is not None:
+        cached = {name: cached_result(endpoint, max_age) for name, endpoint in endpoints.items()}
+        cached = {name: result for name, result in cached.items() if result}
+        endpoints = {name: endpoint for name, endpoint in endpoints.items() if name not in cached}
+    timeout = PROBE_TIMEOUT if timeout is None else timeout
+    deadline_at = time.monotonic() + (PROBE_DEADLINE if deadline is None else deadline)
+    stop = threading.Event()
+
+    # Samples are collected as they complete, so probes cut off by the deadline keep their earlier results
+    samples = {name: [] for name in endpoints}
+    executor = ThreadPoolExecutor(max_workers=max(1, len(endpoints)))
+    futures = [
+        executor.submit(_probe_endpoint, endpoint, samples[name], repeat, timeout, deadline_at, stop)
+        for name, endpoint in endpoints.items()
+    ]
+    wait(futures, timeout=max(0, deadline_at - time.monotonic()))
+    stop.set()
+    executor.shutdown(wait=False, cancel_futures=True)
+    results = {name: summarize(list(endpoint_samples)) for name, endpoint_samples in samples.items()}
+    return {**cached, **results}
+
+def record_history(results, history_file=None):
+    """Append a run to the history file, dropping the oldest runs beyond HISTORY_MAX_ENTRIES."""
+    history_file = history_file or HISTORY_FILE
+    entry = {
+        "time": datetime.now().isoformat(timespec="seconds"),
+        "results": {
+            name: {key: value for key, value in result.items() if key != "response"}
+            for name, result in results.items()
+        }
+    }
+    with _history_lock:
+        with open(history_file, "a") as file:
+            file.write(json.dumps(entry) + "\n")
+        with open(history_file, "r") as file:
+            lines = file.readlines()
+        if len(lines) > HISTORY_MAX_ENTRIES * 1.1:
+            tmp_file = f"{history_file}.tmp"
+            with open(tmp_file, "w") as file:
+                file.writelines(lines[-HISTORY_MAX_ENTRIES:])
+            os.replace(tmp_file, history_file)
+
+def read_history(limit=100, service=None, history_file=None):
+    """Return the newest runs from the history file, oldest first, optionally only for one service."""
+    history_file = history_file or HISTORY_FILE
+    try:
+        with open(history_file, "r") as file:
+            lines = file.readlines()
+    except FileNotFoundError:
+        return []
+    entries = []
+    for line in lines[-limit:]:
         try:
-            response = requests.get(redfish["url"], auth=(redfish["username"], redfish["password"]), timeout=10)
-            results["redfish"] = {
-                "status_code": response.status_code,
-                "response": response.json() if response.headers.get("Content-Type") == "application/json" else response.text
-            }
-        except Exception as e:
-            results["redfish"] = {"error": str(e)}
+            entry = json.loads(line)
+        except ValueError:
+            continue
+        if service:
+            if service not in entry["results"]:
+                continue
+            entry["results"] = {service: entry["results"][service]}
+        entries.append(entry)
+    return entries
 
-    return results
+def _format_ms(value):
+    return f"{value:.0f} ms" if value is not None else "-"
 
 if __name__ == "__main__":
-    api_statuses = check_api_status()
+    parser = argparse.ArgumentParser(description="Check that the configured APIs respond")
+    parser.add_argument('--repeat', type=int, default=1, help='Requests per endpoint, for latency percentiles')
+    parser.add_argument('--deadline', type=float, default=PROBE_DEADLINE, help='Seconds the whole check may take')
+    parser.add_argument('--no-history', action='store_true', help='Do not append the results to the history file')
+    parser.add_argument('--max-age', type=float, help='Reuse health recorded by other scripts within this many seconds')
+    args = parser.parse_args()
+
+    api_statuses = check_api_status(repeat=args.repeat, deadline=args.deadline, max_age=args.max_age)
+    if not args.no_history:
+        record_history(api_statuses)
     for api, result in api_statuses.items():
         print(f"\n{api.upper()} API:")
+        if result.get("cached"):
+            print(f"  Cached: {result['state']}, checked {time.ctime(result['checked_at']) if result['checked_at'] else 'never'}")
         if "error" in result:
             print(f"  Error: {result['error']}")
-        else:
+        elif not result.get("cached"):
             print(f"  Status Code: {result['status_code']}")
             print(f"  Response: {result['response']}")
+        if result["samples"]:
+            print(
+                f"  Latency: p50 {_format_ms(result['p50_ms'])}, p95 {_format_ms(result['p95_ms'])}, "
+                f"p99 {_format_ms(result['p99_ms'])} ({result['samples']} requests, {result['failures']} failed)"
+            )
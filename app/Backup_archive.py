@@ -0,0 +1,483 @@
+import os
+import json
+import zlib
+import bisect
+import hashlib
+import shutil
+import logging
+import tarfile
+
+"""__summary__
+This module implements the seekable "indexed" archive format used by Docker_config_backup.
+The archive is an ordinary .tar.gz, but the gzip stream is written as a series of independently decodable members (frames).
+A sidecar index next to the archive maps every member path to its offset in the tar stream and the frame that contains it.
+Listing an archive only reads the index, and restoring a single file only decompresses the frames that hold it.
+Any standard tool (tar, gzip, 7-Zip) can still read the archive as a normal .tar.gz.
+"""
+
+# Sidecar index file written next to each indexed archive
+INDEX_SUFFIX = ".idx.json"
+INDEX_VERSION = 1
+
+# Amount of uncompressed tar data per gzip frame
+DEFAULT_FRAME_SIZE = 4 * 1024 * 1024
+
+# Supported archive formats for the ARCHIVE_FORMAT config key
+ARCHIVE_FORMATS = ("tar.gz", "indexed")
+
+# Column layout of each member row in the index
+MEMBER_FIELDS = ["name", "type", "size", "mode", "mtime", "offset", "offset_data", "sha256", "linkname"]
+
+READ_CHUNK_SIZE = 1024 * 1024
+
+
+def index_path_for(archive_path):
+    """Return the sidecar index path for an archive."""
+    return archive_path + INDEX_SUFFIX
+
+
+class GzipFrameWriter:
+    """Binary file-like object that writes a gzip stream as a series of independent gzip members."""
+
+    def __init__(self, fileobj, frame_size=DEFAULT_FRAME_SIZE, level=6):
+        self.fileobj = fileobj
+        self.frame_size = frame_size
+        self.level = level
+        self.frames = []  # [compressed_offset, uncompressed_offset] for each frame
+        self._position = 0
+        self._compressed = 0
+        self._frame_bytes = 0
+        self._compressor = None
+
+    def _start_frame(self):
+        self.frames.append([self._compressed, self._position])
+        self._compressor = zlib.compressobj(self.level, zlib.DEFLATED, 31)
+        self._frame_bytes = 0
+
+    def _emit(self, data):
+        if data:
+            self.fileobj.write(data)
+            self._compressed += len(data)
+
+    def end_frame(self):
+        """Finish the current frame so the next write starts a new one."""
+        if self._compressor is not None:
+            self._emit(self._compressor.flush(zlib.Z_FINISH))
+            self._compressor = None
+
+    def write(self, data):
+        view = memoryview(data).cast("B")
+        written = len(view)
+        while view:
+            if self._compressor is None:
+                self._start_frame()
+            take = min(len(view), self.frame_size - self._frame_bytes)
+            self._emit(self._compressor.compress(view[:take]))
+            self._position += take
+            self._frame_bytes += take
+            view = view[take:]
+            if self._frame_bytes >= self.frame_size:
+                self.end_frame()
+        return written
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        self.fileobj.flush()
+
+    def close(self):
+        self.end_frame()
+
+
+class _HashingWriter:
+    """Wrap a binary file and compute a SHA-256 digest of everything written to it."""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.hasher = hashlib.sha256()
+        self.bytes_written = 0
+
+    def write(self, data):
+        self.hasher.update(data)
+        self.bytes_written += len(data)
+        return self.fileobj.write(data)
+
+    def flush(self):
+        self.fileobj.flush()
+
+    def hexdigest(self):
+        return self.hasher.hexdigest()
+
+
+class _HashingReader:
+    """Wrap a binary file and compute a SHA-256 digest of everything read from it."""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.hasher = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.hasher.update(data)
+        return data
+
+    def hexdigest(self):
+        return self.hasher.hexdigest()
+
+
+def _member_type(tarinfo):
+    if tarinfo.isreg():
+        return "file"
+    if tarinfo.isdir():
+        return "dir"
+    if tarinfo.issym():
+        return "symlink"
+    if tarinfo.islnk():
+        return "hardlink"
+    return "other"
+
+
+class PlainTarWriter:
+    """Write a regular single stream .tar.gz archive."""
+
+    archive_format = "tar.gz"
+
+    def __init__(self, archive_path):
+        self.archive_path = archive_path
+        self.member_count = 0
+        self._file = open(archive_path, "wb")
+        self._output = _HashingWriter(self._file)
+        self._tar = tarfile.open(fileobj=self._output, mode="w:gz")
+
+    def add(self, name, arcname=None):
+        self._tar.add(name, arcname=arcname, recursive=False)
+        self.member_count += 1
+
+    @property
+    def sha256(self):
+        return self._output.hexdigest()
+
+    @property
+    def size(self):
+        return self._output.bytes_written
+
+    def close(self):
+        self._tar.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class IndexedTarWriter:
+    """Write a framed .tar.gz archive together with its sidecar member index."""
+
+    archive_format = "indexed"
+
+    def __init__(self, archive_path, frame_size=DEFAULT_FRAME_SIZE, level=6):
+        self.archive_path = archive_path
+        self.members = []
+        self._file = open(archive_path, "wb")
+        self._output = _HashingWriter(self._file)
+        self._frames = GzipFrameWriter(self._output, frame_size=frame_size, level=level)
+        self._tar = tarfile.open(fileobj=self._frames, mode="w", format=tarfile.PAX_FORMAT)
+
+    @property
+    def member_count(self):
+        return len(self.members)
+
+    @property
+    def sha256(self):
+        return self._output.hexdigest()
+
+    @property
+    def size(self):
+        return self._output.bytes_written
+
+    def add(self, name, arcname=None):
+        """Add a single file system entry to the archive (directories are not recursed)."""
+        tarinfo = self._tar.gettarinfo(name, arcname)
+        if tarinfo is None:
+            logging.warning(f"Skipping unsupported file type: {name}")
+            return
+
+        header_offset = self._tar.offset
+        digest = None
+        if tarinfo.isreg():
+            with open(name, "rb") as source:
+                reader = _HashingReader(source)
+                self._tar.addfile(tarinfo, reader)
+            digest = reader.hexdigest()
+        else:
+            self._tar.addfile(tarinfo)
+
+        padded_size = -(-tarinfo.size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE if tarinfo.isreg() else 0
+        data_offset = self._tar.offset - padded_size
+        self.members.append([
+            tarinfo.name, _member_type(tarinfo), tarinfo.size, tarinfo.mode,
+            int(tarinfo.mtime), header_offset, data_offset, digest, tarinfo.linkname or None
+        ])
+
+    def close(self):
+        self._tar.close()
+        self._frames.close()
+        self._file.close()
+        self._write_index()
+
+    def _write_index(self):
+        index = {
+            "version": INDEX_VERSION,
+            "archive": os.path.basename(self.archive_path),
+            "frame_size": self._frames.frame_size,
+            "frames": self._frames.frames,
+            "fields": MEMBER_FIELDS,
+            "members": self.members,
+        }
+        index_path = index_path_for(self.archive_path)
+        tmp_path = f"{index_path}.tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(index, file, separators=(",", ":"))
+        os.replace(tmp_path, index_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def open_archive_writer(archive_path, archive_format="tar.gz", frame_size=DEFAULT_FRAME_SIZE):
+    """Open an archive for writing in the requested format. Both writers expose add(name, arcname), sha256 and member_count."""
+    if archive_format == "indexed":
+        return IndexedTarWriter(archive_path, frame_size=frame_size)
+    if archive_format == "tar.gz":
+        return PlainTarWriter(archive_path)
+    raise ValueError(f"Unsupported archive format: {archive_format}. Expected one of {', '.join(ARCHIVE_FORMATS)}")
+
+
+def load_index(archive_path):
+    """Load the sidecar index of an archive, or return None if the archive has no index."""
+    index_path = index_path_for(archive_path)
+    if not os.path.exists(index_path):
+        return None
+    with open(index_path, "r") as file:
+        index = json.load(file)
+    if index.get("version") != INDEX_VERSION:
+        raise ValueError(f"Unsupported index version in {index_path}: {index.get('version')}")
+    fields = index["fields"]
+    index["members"] = [dict(zip(fields, row)) for row in index["members"]]
+    return index
+
+
+def _matches(name, selectors):
+    if not selectors:
+        return True
+    for selector in selectors:
+        selector = selector.strip("/")
+        if name == selector or name.startswith(selector + "/"):
+            return True
+    return False
+
+
+def _safe_destination(dest_dir, name):
+    """Resolve a member name under dest_dir, refusing absolute paths and parent traversal."""
+    dest_root = os.path.realpath(dest_dir)
+    target = os.path.realpath(os.path.join(dest_root, name))
+    if os.path.isabs(name) or os.path.commonpath([dest_root, target]) != dest_root:
+        raise ValueError(f"Refusing to extract member outside of destination: {name}")
+    return target
+
+
+class IndexedArchiveReader:
+    """Random access reader for archives written by IndexedTarWriter."""
+
+    def __init__(self, archive_path, index=None):
+        self.archive_path = archive_path
+        self.index = index or load_index(archive_path)
+        if self.index is None:
+            raise FileNotFoundError(f"No index found for archive: {archive_path}")
+        self.members = self.index["members"]
+        self._frames = self.index["frames"]
+        self._frame_starts = [frame[1] for frame in self._frames]
+        self._file = None
+        self._decompressor = None
+        self._position = None
+        self._pending = b""
+
+    def __enter__(self):
+        self._file = open(self.archive_path, "rb")
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def _frame_for(self, offset):
+        return max(0, bisect.bisect_right(self._frame_starts, offset) - 1)
+
+    def _seek(self, offset):
+        """Position the decompression cursor at an uncompressed tar offset."""
+        target_frame = self._frame_for(offset)
+        if self._position is not None and self._position <= offset:
+            # Keep streaming when the target is in the current or next frame instead of re-seeking
+            if target_frame - self._frame_for(self._position) <= 1:
+                self._skip(offset - self._position)
+                return
+        compressed_offset, uncompressed_offset = self._frames[target_frame]
+        self._file.seek(compressed_offset)
+        self._decompressor = zlib.decompressobj(31)
+        self._pending = b""
+        self._position = uncompressed_offset
+        self._skip(offset - uncompressed_offset)
+
+    def _fill(self):
+        """Decompress the next chunk of data, moving to the next gzip member when one ends."""
+        while True:
+            if self._decompressor.eof:
+                leftover = self._decompressor.unused_data
+                self._decompressor = zlib.decompressobj(31)
+                if leftover:
+                    data = self._decompressor.decompress(leftover)
+                    if data:
+                        return data
+                    continue
+            raw = self._file.read(READ_CHUNK_SIZE)
+            if not raw:
+                raise EOFError(f"Unexpected end of archive: {self.archive_path}")
+            data = self._decompressor.decompress(raw)
+            if data:
+                return data
+
+    def _read(self, size):
+        while len(self._pending) < size:
+            self._pending += self._fill()
+        data, self._pending = self._pending[:size], self._pending[size:]
+        self._position += size
+        return data
+
+    def _skip(self, size):
+        while size > 0:
+            if not self._pending:
+                self._pending = self._fill()
+            step = min(size, len(self._pending))
+            self._pending = self._pending[step:]
+            self._position += step
+            size -= step
+
+    def iter_member_data(self, member):
+        """Yield the data of a regular file member in chunks."""
+        self._seek(member["offset_data"])
+        remaining = member["size"]
+        while remaining > 0:
+            chunk = self._read(min(remaining, READ_CHUNK_SIZE))
+            remaining -= len(chunk)
+            yield chunk
+
+    def read_member(self, name):
+        """Return the full contents of a regular file member."""
+        for member in self.members:
+            if member["name"] == name and member["type"] == "file":
+                return b"".join(self.iter_member_data(member))
+        raise KeyError(f"Member not found in archive: {name}")
+
+    def extract(self, dest_dir, selectors=None):
+        """Extract members matching the selectors (exact paths or subtree prefixes). Returns the number of members extracted."""
+        selected = [member for member in self.members if _matches(member["name"], selectors)]
+        # Read in archive order so neighbouring members share one decompression pass
+        selected.sort(key=lambda member: member["offset"])
+        files = {member["name"]: member for member in self.members if member["type"] == "file"}
+        extracted = 0
+        for member in selected:
+            target = _safe_destination(dest_dir, member["name"])
+            if member["type"] == "hardlink":
+                if not self._extract_hardlink(dest_dir, member, target, files):
+                    continue
+            elif member["type"] == "dir":
+                os.makedirs(target, exist_ok=True)
+            elif member["type"] == "file":
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                with open(target, "wb") as file:
+                    for chunk in self.iter_member_data(member):
+                        file.write(chunk)
+            elif member["type"] == "symlink":
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                if os.path.lexists(target):
+                    os.remove(target)
+                os.symlink(member["linkname"], target)
+                extracted += 1
+                continue
+            else:
+                logging.warning(f"Skipping unsupported member type {member['type']}: {member['name']}")
+                continue
+            os.chmod(target, member["mode"])
+            os.utime(target, (member["mtime"], member["mtime"]))
+            extracted += 1
+        return extracted
+
+    def _extract_hardlink(self, dest_dir, member, target, files):
+        """Restore a hardlink member as a link to its target, extracted earlier or already under dest_dir, or else
+        as a copy of the target's data. Returns False if the target is neither on disk nor in the archive."""
+        source = _safe_destination(dest_dir, member["linkname"])
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if os.path.lexists(target):
+            os.remove(target)
+        if os.path.isfile(source):
+            try:
+                os.link(source, target)
+                return True
+            except OSError as e:
+                logging.debug(f"Could not hardlink {member['name']}, copying it instead: {e}")
+        original = files.get(member["linkname"])
+        if original is None:
+            if not os.path.isfile(source):
+                logging.warning(f"Skipping hardlink to a file missing from the archive: {member['name']}")
+                return False
+            shutil.copyfile(source, target)
+            return True
+        with open(target, "wb") as file:
+            for chunk in self.iter_member_data(original):
+                file.write(chunk)
+        return True
+
+
+def list_members(archive_path):
+    """List the members of an archive, using the sidecar index when present."""
+    index = load_index(archive_path)
+    if index is not None:
+        return index["members"]
+
+    logging.warning(f"No index for {archive_path}, falling back to a full archive scan.")
+    members = []
+    with tarfile.open(archive_path, "r:*") as tar:
+        for tarinfo in tar:
+            members.append({
+                "name": tarinfo.name, "type": _member_type(tarinfo), "size": tarinfo.size,
+                "mode": tarinfo.mode, "mtime": int(tarinfo.mtime)
+            })
+    return members
+
+
+def extract_members(archive_path, dest_dir, selectors=None):
+    """Extract files or subtrees from an archive, seeking through the index when present."""
+    index = load_index(archive_path)
+    if index is not None:
+        with IndexedArchiveReader(archive_path, index=index) as reader:
+            return reader.extract(dest_dir, selectors)
+
+    logging.warning(f"No index for {archive_path}, falling back to a full archive scan.")
+    extracted = 0
+    with tarfile.open(archive_path, "r:*") as tar:
+        for tarinfo in tar:
+            if _matches(tarinfo.name, selectors):
+                _safe_destination(dest_dir, tarinfo.name)
+                tar.extract(tarinfo, dest_dir)
+                extracted += 1
+    return extracted
@@ -0,0 +1,227 @@
+import os
+import re
+import sqlite3
+import hashlib
+import logging
+from datetime import datetime, timedelta
+
+from Backup_archive import index_path_for, load_index
+
+"""__summary__
+This module keeps a local SQLite catalog of the archives written by Docker_config_backup.
+Each backup is recorded with its container, timestamp, size, digest, member count and format when it is created,
+so retention, listing and restore selection never have to scan BACKUP_LOCATION (which is usually a remote SMB share).
+If the catalog and the share drift apart, reconcile() rebuilds the catalog from what is actually on disk.
+"""
+
+# Backup filenames look like sonarr_backup_20250101_030000.tar.gz
+BACKUP_FILENAME_PATTERN = re.compile(r"^(?P<container>.+)_backup_(?P<timestamp>\d{8}_\d{6})\.tar\.gz$")
+TIMESTAMP_FORMAT = "%Y%m%d_%H%M%S"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS backups (
+    path TEXT PRIMARY KEY,
+    container TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    size INTEGER,
+    sha256 TEXT,
+    member_count INTEGER,
+    format TEXT,
+    verified_at REAL,
+    verify_ok INTEGER,
+    verify_error TEXT,
+    verified_size INTEGER,
+    verified_mtime REAL
+);
+CREATE INDEX IF NOT EXISTS backups_container ON backups (container, created_at);
+CREATE TABLE IF NOT EXISTS reconciled_locations (
+    location TEXT PRIMARY KEY,
+    reconciled_at REAL NOT NULL
+);
+"""
+
+# Columns added after the first catalog version, created on open for older catalogs
+ADDED_COLUMNS = {
+    "verified_at": "REAL",
+    "verify_ok": "INTEGER",
+    "verify_error": "TEXT",
+    "verified_size": "INTEGER",
+    "verified_mtime": "REAL",
+}
+
+
+def parse_backup_filename(filename):
+    """Return (container, created_at) for a backup filename, or None if it is not a backup archive."""
+    match = BACKUP_FILENAME_PATTERN.match(filename)
+    if not match:
+        return None
+    created_at = datetime.strptime(match.group("timestamp"), TIMESTAMP_FORMAT)
+    return match.group("container"), created_at.timestamp()
+
+
+def hash_archive(path):
+    """Compute the SHA-256 digest of an archive file."""
+    hasher = hashlib.sha256()
+    with open(path, "rb") as file:
+        while chunk := file.read(1024 * 1024):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+class BackupCatalog:
+    """SQLite catalog of backup archives."""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(SCHEMA)
+        self._add_missing_columns()
+
+    def _add_missing_columns(self):
+        existing = {row["name"] for row in self.conn.execute("PRAGMA table_info(backups)")}
+        with self.conn:
+            for column, column_type in ADDED_COLUMNS.items():
+                if column not in existing:
+                    self.conn.execute(f"ALTER TABLE backups ADD COLUMN {column} {column_type}")
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def record(self, path, container, created_at, size, sha256=None, member_count=None, archive_format=None):
+        """Insert or update a backup entry."""
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO backups (path, container, created_at, size, sha256, member_count, format) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (path, container, created_at, size, sha256, member_count, archive_format)
+            )
+
+    def record_verification(self, result):
+        """Store the outcome of Backup_verify.verify_archive for an archive."""
+        with self.conn:
+            self.conn.execute(
+                "UPDATE backups SET verified_at = ?, verify_ok = ?, verify_error = ?, verified_size = ?, verified_mtime = ? "
+                "WHERE path = ?",
+                (datetime.now().timestamp(), int(result["ok"]), result["error"],
+                 result.get("size"), result.get("mtime"), result["path"])
+            )
+
+    def get_backup(self, path):
+        row = self.conn.execute("SELECT * FROM backups WHERE path = ?", (path,)).fetchone()
+        return dict(row) if row else None
+
+    def remove(self, path):
+        with self.conn:
+            self.conn.execute("DELETE FROM backups WHERE path = ?", (path,))
+
+    def list_backups(self, container=None, backup_location=None):
+        """Return backups as dicts, newest first, optionally filtered by container and location."""
+        query = "SELECT * FROM backups"
+        params = []
+        if container:
+            query += " WHERE container = ?"
+            params.append(container)
+        query += " ORDER BY created_at DESC"
+        backups = [dict(row) for row in self.conn.execute(query, params)]
+        if backup_location:
+            prefix = os.path.join(backup_location, "")
+            backups = [backup for backup in backups if backup["path"].startswith(prefix)]
+        return backups
+
+    def find_backup(self, container, before=None):
+        """Return the newest backup for a container, optionally created at or before a datetime."""
+        for backup in self.list_backups(container):
+            if before is None or backup["created_at"] <= before.timestamp():
+                return backup
+        return None
+
+    def is_reconciled(self, backup_location):
+        """Return True if the catalog has been rebuilt from backup_location at least once."""
+        row = self.conn.execute("SELECT 1 FROM reconciled_locations WHERE location = ?", (backup_location,)).fetchone()
+        return row is not None
+
+    def reconcile(self, backup_location, compute_digest=False):
+        """Rebuild the catalog entries for backup_location from the archives on disk. Returns (added, removed)."""
+        known = {backup["path"]: backup for backup in self.list_backups(backup_location=backup_location)}
+        seen = set()
+        added = 0
+
+        for entry in os.scandir(backup_location):
+            parsed = parse_backup_filename(entry.name)
+            if not parsed or not entry.is_file():
+                continue
+            container, created_at = parsed
+            seen.add(entry.path)
+            size = entry.stat().st_size
+            existing = known.get(entry.path)
+            if existing and existing["size"] == size and (existing["sha256"] or not compute_digest):
+                continue
+
+            index = load_index(entry.path) if os.path.exists(index_path_for(entry.path)) else None
+            self.record(
+                entry.path, container, created_at, size,
+                sha256=hash_archive(entry.path) if compute_digest else None,
+                member_count=len(index["members"]) if index else None,
+                archive_format="indexed" if index else "tar.gz"
+            )
+            added += 1
+
+        removed = 0
+        for path in set(known) - seen:
+            self.remove(path)
+            removed += 1
+
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO reconciled_locations (location, reconciled_at) VALUES (?, ?)",
+                (backup_location, datetime.now().timestamp())
+            )
+
+        logging.info(f"Catalog reconciled for {backup_location}: {added} added or updated, {removed} removed")
+        return added, removed
+
+
+def select_expired(backups, retention_days, policy=None, now=None):
+    """Return the backups that fall outside the retention rules.
+
+    Anything newer than retention_days is kept. A grandfather-father-son policy such as
+    {"daily": 7, "weekly": 4, "monthly": 6} additionally keeps the newest backup of each of the
+    last N days, ISO weeks and months, evaluated per container.
+    """
+    now = now or datetime.now()
+    cutoff = (now - timedelta(days=retention_days)).timestamp()
+    keep = {backup["path"] for backup in backups if backup["created_at"] >= cutoff}
+
+    if policy:
+        periods = {
+            "daily": lambda moment: moment.strftime("%Y-%m-%d"),
+            "weekly": lambda moment: "%d-W%02d" % moment.isocalendar()[:2],
+            "monthly": lambda moment: moment.strftime("%Y-%m"),
+            "yearly": lambda moment: moment.strftime("%Y"),
+        }
+        by_container = {}
+        for backup in sorted(backups, key=lambda backup: backup["created_at"], reverse=True):
+            by_container.setdefault(backup["container"], []).append(backup)
+
+        for container_backups in by_container.values():
+            for period, count in policy.items():
+                if period not in periods:
+                    raise ValueError(f"Unknown retention period: {period}")
+                buckets = []
+                for backup in container_backups:
+                    bucket = periods[period](datetime.fromtimestamp(backup["created_at"]))
+                    if bucket in buckets:
+                        continue
+                    if len(buckets) >= count:
+                        break
+                    buckets.append(bucket)
+                    keep.add(backup["path"])
+
+    return [backup for backup in backups if backup["path"] not in keep]
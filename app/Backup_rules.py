@@ -0,0 +1,166 @@
+import os
+import re
+import time
+import logging
+
+"""__summary__
+This module compiles the include/exclude rules used by Docker_config_backup into a single matcher.
+Exclude patterns are matched against directories while walking, so excluded subtrees (Plex caches, codecs, transcodes)
+are pruned before they are descended into. Size and age limits are applied to the remaining files.
+Every skipped file or directory is counted against the rule that skipped it so the backup can report what was left out.
+
+Patterns use gitignore style globs on paths relative to the container's appdata_path:
+    "Cache"              matches a file or directory named Cache at any depth
+    "Cache/"             matches only directories named Cache
+    "Library/Logs/**"    matches the Library/Logs directory, anchored at the appdata root because it contains a slash
+    "**/*.jpg"           matches jpg files at any depth
+"""
+
+
+def _glob_to_regex(pattern):
+    """Translate a glob pattern into a regular expression body matching a relative path."""
+    dir_only = pattern.endswith("/")
+    if pattern.endswith("/**"):
+        # "Cache/**" excludes everything below Cache, so prune the directory itself
+        pattern, dir_only = pattern[:-3], True
+    pattern = pattern.strip("/")
+    anchored = "/" in pattern
+
+    parts = []
+    segments = pattern.split("/")
+    for position, segment in enumerate(segments):
+        if segment == "**":
+            parts.append("(?:[^/]+/)*" if position < len(segments) - 1 else ".*")
+            continue
+        regex = ""
+        i = 0
+        while i < len(segment):
+            char = segment[i]
+            if char == "*":
+                regex += "[^/]*"
+            elif char == "?":
+                regex += "[^/]"
+            elif char == "[":
+                end = segment.find("]", i + 1)
+                if end == -1:
+                    regex += re.escape(char)
+                else:
+                    body = segment[i + 1:end]
+                    if body.startswith("!"):
+                        body = "^" + body[1:]
+                    regex += f"[{body}]"
+                    i = end
+            else:
+                regex += re.escape(char)
+            i += 1
+        parts.append(regex + ("/" if position < len(segments) - 1 else ""))
+
+    body = "".join(parts)
+    if not anchored:
+        body = "(?:.*/)?" + body
+    return body, dir_only
+
+
+class _CompiledPatterns:
+    """A list of glob patterns compiled into one alternation that reports which pattern matched."""
+
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+        file_groups, dir_groups = [], []
+        for number, pattern in enumerate(self.patterns):
+            body, dir_only = _glob_to_regex(pattern)
+            group = f"(?P<r{number}>{body})"
+            dir_groups.append(group)
+            if not dir_only:
+                file_groups.append(group)
+        self._files = re.compile(f"(?:{'|'.join(file_groups)})\\Z") if file_groups else None
+        self._dirs = re.compile(f"(?:{'|'.join(dir_groups)})\\Z") if dir_groups else None
+
+    def match(self, rel_path, is_dir=False):
+        regex = self._dirs if is_dir else self._files
+        if regex is None:
+            return None
+        found = regex.match(rel_path)
+        if found is None:
+            return None
+        return self.patterns[int(found.lastgroup[1:])]
+
+
+class BackupFilter:
+    """Decide which directories to prune and which files to skip while walking an appdata directory."""
+
+    def __init__(self, exclude=(), include=(), max_file_size_mb=None, max_file_age_days=None, now=None):
+        self._exclude = _CompiledPatterns(exclude)
+        self._include = _CompiledPatterns(include) if include else None
+        self.max_file_size = int(max_file_size_mb * 1024 * 1024) if max_file_size_mb else None
+        self.min_mtime = (now or time.time()) - max_file_age_days * 86400 if max_file_age_days else None
+        self.stats = {}
+
+    @classmethod
+    def from_config(cls, container, config):
+        """Build a filter from the global EXCLUDE list and a container's own rules."""
+        return cls(
+            exclude=list(config.get("EXCLUDE", [])) + list(container.get("exclude", [])),
+            include=container.get("include", []),
+            max_file_size_mb=container.get("max_file_size_mb", config.get("MAX_FILE_SIZE_MB")),
+            max_file_age_days=container.get("max_file_age_days", config.get("MAX_FILE_AGE_DAYS")),
+        )
+
+    @property
+    def needs_stat(self):
+        return self.max_file_size is not None or self.min_mtime is not None
+
+    def _record(self, rule, files=0, size=0, dirs=0):
+        entry = self.stats.setdefault(rule, {"files": 0, "bytes": 0, "dirs": 0})
+        entry["files"] += files
+        entry["bytes"] += size
+        entry["dirs"] += dirs
+
+    def prune_dirs(self, rel_root, dirs):
+        """Remove excluded directories from an os.walk dirs list in place."""
+        kept = []
+        for name in dirs:
+            rel_path = name if rel_root in ("", ".") else f"{rel_root}/{name}"
+            rule = self._exclude.match(rel_path, is_dir=True)
+            if rule is None:
+                kept.append(name)
+            else:
+                self._record(f"exclude:{rule}", dirs=1)
+        dirs[:] = kept
+
+    def skip_file(self, rel_path, full_path):
+        """Return True if a file should be left out of the backup."""
+        rule = self._exclude.match(rel_path)
+        if rule is not None:
+            rule = f"exclude:{rule}"
+        elif self._include is not None and self._include.match(rel_path) is None:
+            rule = "include"
+
+        stat = None
+        if rule is None and self.needs_stat:
+            stat = os.lstat(full_path)
+            if self.max_file_size is not None and stat.st_size > self.max_file_size:
+                rule = "max_file_size"
+            elif self.min_mtime is not None and stat.st_mtime < self.min_mtime:
+                rule = "max_file_age"
+
+        if rule is None:
+            return False
+        if stat is None:
+            try:
+                stat = os.lstat(full_path)
+            except OSError:
+                stat = None
+        self._record(rule, files=1, size=stat.st_size if stat else 0)
+        return True
+
+    def log_summary(self, container_name):
+        """Log how many files, bytes and directories each rule skipped."""
+        if not self.stats:
+            logging.info(f"No files skipped by backup rules for {container_name}")
+            return
+        for rule, entry in sorted(self.stats.items()):
+            logging.info(
+                f"Backup rule {rule} for {container_name}: skipped {entry['files']} files "
+                f"({entry['bytes'] / (1024 ** 2):.2f} MB) and pruned {entry['dirs']} directories"
+            )
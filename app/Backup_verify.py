@@ -0,0 +1,147 @@
+import os
+import gzip
+import zlib
+import time
+import hashlib
+import logging
+import tarfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from Backup_archive import load_index
+
+"""__summary__
+This module checks that backup archives written by Docker_config_backup can actually be restored.
+Each archive is streamed exactly once: gzip CRCs are checked while decompressing, every tar header is parsed,
+and every member is read in full. When the archive has a sidecar index, each member's size and SHA-256 digest
+are compared with the index and any member missing from the archive is reported. The raw archive file is hashed
+in the same pass and compared with the SHA-256 digest the catalog recorded when the backup was written, which
+is the only content check for plain tar.gz archives.
+Archives are verified in parallel worker processes, since decompression and hashing are CPU bound.
+"""
+
+READ_CHUNK_SIZE = 1024 * 1024
+
+
+class _DigestReader:
+    """Wrap the raw archive file and hash everything read from it."""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.hasher = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.hasher.update(data)
+        return data
+
+
+def expected_digest(catalog, archive_path):
+    """Return the SHA-256 digest the catalog recorded for an archive, or None."""
+    if catalog is None:
+        return None
+    backup = catalog.get_backup(archive_path)
+    return backup.get("sha256") if backup else None
+
+
+def verify_archive(archive_path, expected_sha256=None):
+    """Stream an archive once and check compression integrity, tar structure and member digests.
+
+    When expected_sha256 is given, the digest of the whole archive file must match it as well.
+    Returns a dict with the path, ok flag, error message, member count, uncompressed bytes,
+    the archive size and mtime that were verified, and the elapsed time.
+    """
+    started = time.monotonic()
+    result = {"path": archive_path, "ok": False, "error": None, "members": 0, "bytes": 0}
+    try:
+        stat = os.stat(archive_path)
+        result["size"] = stat.st_size
+        result["mtime"] = stat.st_mtime
+
+        index = load_index(archive_path)
+        manifest = {member["name"]: member for member in index["members"]} if index else None
+
+        errors = []
+        with open(archive_path, "rb") as raw:
+            raw_reader = _DigestReader(raw)
+            with gzip.GzipFile(fileobj=raw_reader, mode="rb") as stream, tarfile.open(fileobj=stream, mode="r|") as tar:
+                for tarinfo in tar:
+                    result["members"] += 1
+                    hasher = hashlib.sha256()
+                    if tarinfo.isreg():
+                        member_file = tar.extractfile(tarinfo)
+                        while chunk := member_file.read(READ_CHUNK_SIZE):
+                            hasher.update(chunk)
+                            result["bytes"] += len(chunk)
+
+                    if manifest is None:
+                        continue
+                    expected = manifest.pop(tarinfo.name, None)
+                    if expected is None:
+                        errors.append(f"member not in index: {tarinfo.name}")
+                    elif expected["size"] != tarinfo.size:
+                        errors.append(f"size mismatch for {tarinfo.name}: {tarinfo.size} != {expected['size']}")
+                    elif expected.get("sha256") and expected["sha256"] != hasher.hexdigest():
+                        errors.append(f"digest mismatch for {tarinfo.name}")
+
+            # The tar stream ends at its end-of-archive blocks; hash whatever follows too
+            while raw_reader.read(READ_CHUNK_SIZE):
+                pass
+        if expected_sha256 and raw_reader.hasher.hexdigest() != expected_sha256:
+            errors.append("archive digest does not match the catalog")
+
+        if manifest:
+            errors.append(f"{len(manifest)} indexed members missing from archive, e.g. {next(iter(manifest))}")
+        if errors:
+            result["error"] = "; ".join(errors[:5]) + (f" (+{len(errors) - 5} more)" if len(errors) > 5 else "")
+        else:
+            result["ok"] = True
+    except (OSError, EOFError, zlib.error, tarfile.TarError, ValueError) as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+
+    result["elapsed"] = time.monotonic() - started
+    return result
+
+
+def needs_verification(backup, force=False):
+    """Return True unless the catalog shows this exact file (same size and mtime) already verified OK."""
+    if force or not backup.get("verify_ok"):
+        return True
+    try:
+        stat = os.stat(backup["path"])
+    except OSError:
+        return True
+    return stat.st_size != backup.get("verified_size") or stat.st_mtime != backup.get("verified_mtime")
+
+
+def log_result(result):
+    """Log the outcome of a single archive verification."""
+    if result["ok"]:
+        logging.info(
+            f"[VERIFIED] {result['path']}: {result['members']} members, "
+            f"{result['bytes'] / (1024 ** 2):.2f} MB in {result['elapsed']:.2f}s"
+        )
+    else:
+        logging.error(f"[CORRUPT] {result['path']}: {result['error']}")
+
+
+def verify_archives(archive_paths, catalog=None, max_workers=None):
+    """Verify several archives in parallel and record the results in the catalog. Returns the list of results."""
+    archive_paths = list(archive_paths)
+    if not archive_paths:
+        return []
+
+    max_workers = max(1, min(len(archive_paths), max_workers or os.cpu_count() or 1))
+    logging.info(f"Verifying {len(archive_paths)} archives with {max_workers} workers")
+
+    results = []
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(verify_archive, path, expected_digest(catalog, path)) for path in archive_paths
+        ]
+        for future in as_completed(futures):
+            result = future.result()
+            log_result(result)
+            if catalog is not None:
+                catalog.record_verification(result)
+            results.append(result)
+    return results
@@ -1,13 +1,25 @@
 import os
 import time
+import json
 import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+from Log_setup import setup_logging
 
-# Media file extensions
-MEDIA_EXTENSIONS = {'.mkv', '.mp4', '.mp3', '.wav', '.flac', '.avi', '.mov'}
+from Media_classifier import MediaClassifier, MEDIA, SIDECAR, PARTIAL
 
 """__summary__
 This script is used to clean up specified directories, removing empty directories and non-media files. 
+Files are classified by Media_classifier: media and partial downloads are kept, sidecars (subtitles, artwork, nfo)
+are kept only in directories that hold media, and everything else is deleted.
+It runs in two phases: a fast scan that writes a plan (files to delete, directories to prune, bytes reclaimed and media
+directories found) as JSON lines, and an apply phase that carries the plan out in parallel batches.
+A dry run stops after the plan, and a saved plan can be reviewed and applied later.
+Directory state is cached between runs, so directories that were clean last time and whose mtime has not changed
+are not listed again; only new and changed directories (typically fresh downloads) are read. A full scan is forced
+periodically.
 It logs the process and the directories containing media files. 
 This is useful for use cases like cleaning up download directories on media servers and removing orphaned media directories and files within established media directories.
 """
@@ -27,16 +39,6 @@ directories = [
 LOG_PATH = os.getenv("LOG_PATH")
 LOG_LEVEL = os.getenv("LOG_LEVEL", "DEBUG").upper()
 
-# Map the log level string to actual logging levels
-LOG_LEVEL_MAPPING = {
-    'CRITICAL': logging.CRITICAL,
-    'ERROR': logging.ERROR,
-    'WARNING': logging.WARNING,
-    'INFO': logging.INFO,
-    'DEBUG': logging.DEBUG,
-    'NOTSET': logging.NOTSET
-}
-
 required_env_vars = ["CLEANUP_DIRECTORY_1", "LOG_LEVEL", "LOG_PATH"]
 missing_vars = [var for var in required_env_vars if not os.getenv(var)]
 
@@ -47,83 +49,471 @@ if missing_vars:
 if not LOG_PATH or not os.path.isdir(LOG_PATH):
     raise ValueError(f"Invalid LOG_PATH: {LOG_PATH}. Please set a valid path in your .env file.")
 
-# Default to DEBUG if the provided LOG_LEVEL isn't valid
-log_level = LOG_LEVEL_MAPPING.get(LOG_LEVEL, logging.DEBUG)
+# Setup Logging, through a queue to this script's own log file
+setup_logging("dir_cleanup", LOG_PATH, LOG_LEVEL)
 
-# Setup Logging
-logging.basicConfig(
-    filename=f"{LOG_PATH}/directory_cleanup_log_{time.strftime('%Y-%m-%d_%H-%M-%S')}.log",
-    level=log_level,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
+# Directory scans are bound by stat latency on network shares, so use more threads than cores
+MAX_WORKERS = int(os.getenv("CLEANUP_MAX_WORKERS", 16))
 
-def process_directory(directory, media_dirs, deleted_count, depth=0, max_depth=10):
-    """Process a directory to identify media and clean non-media files."""
-    if depth > max_depth:
-        logging.warning(f"Max recursion depth reached at: {directory}")
-        return False
-    
-    has_media = False
-    is_empty = True
-    
-    try:
-        for entry in os.scandir(directory):
-            full_path = entry.path
-            if entry.is_file():
-                _, ext = os.path.splitext(entry.name)
-                if ext.lower() in MEDIA_EXTENSIONS:
-                    has_media = True
-                    is_empty = False
-                else:
-                    try:
-                        os.remove(full_path)
-                        logging.info(f"Deleted file: {full_path}")
-                    except OSError as e:
-                        logging.error(f"Failed to delete file {full_path}: {e}")
-                        is_empty = False
-            elif entry.is_dir():
-                if not process_directory(full_path, media_dirs, deleted_count, depth=depth+1, max_depth=max_depth):
-                    is_empty = False
-        
-        if has_media:
-            media_dirs.append(directory)
-        
-        if is_empty and depth > 0:
-            os.rmdir(directory)
-            logging.info(f"Removed directory: {directory}")
-            deleted_count[0] += 1
+# Number of deletions handed to a worker at a time in the apply phase
+DELETE_BATCH_SIZE = int(os.getenv("CLEANUP_DELETE_BATCH_SIZE", 256))
+
+# Where cleanup plans are written
+PLAN_PATH = os.getenv("CLEANUP_PLAN_PATH", LOG_PATH)
+
+# Directory state cache, kept out of LOG_PATH so log cleanup does not discard it
+STATE_PATH = os.getenv("STATE_PATH") or os.getenv("CONFIG_PATH") or "."
+CACHE_FILE = os.getenv("CLEANUP_CACHE_FILE", os.path.join(STATE_PATH, "dir_cleanup_cache.json"))
+CACHE_VERSION = 1
+
+CLASSIFIER_CACHE_FILE = os.getenv("CLEANUP_CLASSIFIER_CACHE_FILE", os.path.join(STATE_PATH, "media_classifier_cache.json"))
+
+# Extension rules come from CLEANUP_MEDIA_EXTENSIONS, CLEANUP_SIDECAR_EXTENSIONS, CLEANUP_PARTIAL_EXTENSIONS,
+# CLEANUP_JUNK_EXTENSIONS and CLEANUP_SNIFF_EXTENSIONS (comma separated)
+classifier = MediaClassifier.from_env(CLASSIFIER_CACHE_FILE)
+
+# Ignore the cache and list every directory when the last full scan is older than this
+FULL_SCAN_DAYS = float(os.getenv("CLEANUP_FULL_SCAN_DAYS", 7))
+
+# Directory mtimes this close to the scan may still change within the same timestamp tick, so they are not trusted
+MTIME_GRACE_SECONDS = 2
+
+class DirectoryNode:
+    """State of one directory in the scan, finalized once it and all of its subdirectories are done."""
+    __slots__ = ("path", "parent", "is_root", "pending", "has_media", "is_empty", "mtime", "subdirs", "keeps", "dirty", "sidecars")
+
+    def __init__(self, path, parent=None, is_root=False):
+        self.path = path
+        self.parent = parent
+        self.is_root = is_root
+        self.pending = 1  # The directory's own scan, plus one per subdirectory once it is listed
+        self.has_media = False
+        self.is_empty = True  # Empty once the planned file deletions and directory prunes are applied
+        self.mtime = None  # st_mtime_ns, or None when it cannot be trusted for caching
+        self.subdirs = []  # Names of subdirectories
+        self.keeps = False  # Has files or other entries of its own that stay
+        self.dirty = False  # Has planned deletions directly inside it
+        self.sidecars = []  # (path, size) of sidecar files, kept only if the directory holds media
+
+class DirectoryCache:
+    """Persistent per-directory state from the last scan: mtime, subdirectories and whether it held media.
+
+    Only directories that were clean (nothing to delete or prune directly inside them) are stored. A directory's
+    mtime changes whenever an entry is added, removed or renamed in it, so a clean directory with an unchanged
+    mtime still has the same entries and does not need to be listed. Its subdirectories are still visited, since
+    changes deeper in the tree do not touch the parent's mtime.
+    """
+
+    def __init__(self, cache_file=CACHE_FILE, full_scan_days=FULL_SCAN_DAYS):
+        self.cache_file = cache_file
+        self.full_scan_days = full_scan_days
+        self.entries = {}
+        self.last_full_scan = None
+        self.updated = {}
+        self.full_scan = True
+        self._lock = threading.Lock()
+
+    def load(self, force_full_scan=False):
+        """Load the previous state. Returns True when cached state will be used, False for a full scan."""
+        try:
+            with open(self.cache_file, "r") as file:
+                data = json.load(file)
+            if data.get("version") == CACHE_VERSION:
+                self.entries = data.get("dirs", {})
+                self.last_full_scan = data.get("last_full_scan")
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable cleanup cache {self.cache_file}: {e}")
+
+        if force_full_scan:
+            reason = "requested"
+        elif self.last_full_scan is None:
+            reason = "no previous full scan"
+        elif time.time() - self.last_full_scan > self.full_scan_days * 86400:
+            reason = f"last full scan older than {self.full_scan_days:g} days"
+        else:
+            self.full_scan = False
             return True
-        
-    except OSError as e:
-        logging.error(f"Failed to process directory {directory}: {e}")
-    
-    return False
+        logging.info(f"Running a full scan ({reason})")
+        return False
+
+    def lookup(self, path, mtime):
+        """Return the cached state of a clean directory if its mtime is unchanged, else None."""
+        if self.full_scan or mtime is None:
+            return None
+        entry = self.entries.get(path)
+        if entry is not None and entry["mtime"] == mtime:
+            return entry
+        return None
+
+    def update(self, node):
+        """Remember a finalized directory if it was clean and its mtime can be trusted."""
+        if node.dirty or node.mtime is None:
+            return
+        with self._lock:
+            self.updated[node.path] = {
+                "mtime": node.mtime,
+                "subdirs": node.subdirs,
+                "has_media": node.has_media,
+                "keeps": node.keeps
+            }
+
+    def save(self, started):
+        """Write the state from this run. Directories not visited in this run are dropped."""
+        data = {
+            "version": CACHE_VERSION,
+            "last_full_scan": started if self.full_scan else self.last_full_scan,
+            "dirs": self.updated
+        }
+        tmp_file = f"{self.cache_file}.tmp"
+        try:
+            with open(tmp_file, "w") as file:
+                json.dump(data, file)
+            os.replace(tmp_file, self.cache_file)
+        except OSError as e:
+            logging.error(f"Failed to write cleanup cache {self.cache_file}: {e}")
+
+class CleanupPlan:
+    """Everything the apply phase will do, produced by CleanupScanner and stored as JSON lines."""
+
+    def __init__(self, roots=()):
+        self.roots = list(roots)
+        self.files = []  # (path, size)
+        self.dirs = []  # Directories to prune, children before parents
+        self.media_dirs = []
+
+    @property
+    def bytes_reclaimed(self):
+        return sum(size for _, size in self.files)
+
+    def summary(self):
+        return {
+            "files": len(self.files),
+            "dirs": len(self.dirs),
+            "bytes": self.bytes_reclaimed,
+            "media_dirs": len(self.media_dirs)
+        }
+
+    def save(self, plan_file):
+        with open(plan_file, "w") as file:
+            file.write(json.dumps({"type": "plan", "created": time.time(), "roots": self.roots}) + "\n")
+            for path, size in self.files:
+                file.write(json.dumps({"type": "file", "path": path, "size": size}) + "\n")
+            for path in self.dirs:
+                file.write(json.dumps({"type": "dir", "path": path}) + "\n")
+            for path in self.media_dirs:
+                file.write(json.dumps({"type": "media_dir", "path": path}) + "\n")
+            file.write(json.dumps({"type": "summary", **self.summary()}) + "\n")
+
+    @classmethod
+    def load(cls, plan_file):
+        plan = cls()
+        with open(plan_file, "r") as file:
+            for line in file:
+                record = json.loads(line)
+                if record["type"] == "plan":
+                    plan.roots = record["roots"]
+                elif record["type"] == "file":
+                    plan.files.append((record["path"], record["size"]))
+                elif record["type"] == "dir":
+                    plan.dirs.append(record["path"])
+                elif record["type"] == "media_dir":
+                    plan.media_dirs.append(record["path"])
+        return plan
+
+class CleanupScanner:
+    """Iterative traversal that scans directories concurrently on a shared thread pool and builds a CleanupPlan.
+
+    Every directory is a task on the pool's shared queue, so idle workers pick up whichever directory is
+    next regardless of which root or branch it belongs to. A directory is finalized bottom-up, after all of
+    its subdirectories: it is planned for pruning when it holds no media and everything below it is either
+    a planned deletion or a directory that is itself pruned. Symlinked directories are not followed and
+    directories already visited (same device and inode) are skipped, so there is no depth limit and no
+    risk of looping. Nothing is modified on disk during the scan.
 
+    With a DirectoryCache, clean directories whose mtime is unchanged are not listed; their cached
+    subdirectories are visited directly.
+    """
 
-def check_and_clean_directories(directories):
-    """Main function to check and clean directories."""
-    total_dirs_processed = 0
-    deleted_count = [0]
-    media_dirs = []
+    def __init__(self, max_workers=MAX_WORKERS, cache=None, classifier=classifier):
+        self.max_workers = max_workers
+        self.cache = cache
+        self.classifier = classifier
+        self.plan = None
+        self.dirs_listed = 0
+        self.dirs_cached = 0
+        self._started = None
+        self._visited = set()
+        self._lock = threading.Lock()
+        self._roots_remaining = 0
+        self._done = threading.Event()
+        self._executor = None
 
+    def run(self, roots):
+        """Scan all roots in parallel and return the resulting plan."""
+        self.plan = CleanupPlan(roots)
+        self._started = time.time()
+        if not roots:
+            return self.plan
+        self._roots_remaining = len(roots)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            self._executor = executor
+            for root in roots:
+                executor.submit(self._scan, DirectoryNode(root, is_root=True))
+            self._done.wait()
+        return self.plan
+
+    def _scan(self, node):
+        subdirs = []
+        try:
+            stat = os.stat(node.path)
+            with self._lock:
+                key = (stat.st_dev, stat.st_ino)
+                already_visited = key in self._visited
+                self._visited.add(key)
+            if already_visited:
+                logging.warning(f"Skipping already visited directory: {node.path}")
+                node.is_empty = False
+                return
+
+            if stat.st_mtime < self._started - MTIME_GRACE_SECONDS:
+                node.mtime = stat.st_mtime_ns
+            cached = self.cache.lookup(node.path, node.mtime) if self.cache else None
+            if cached is not None:
+                with self._lock:
+                    self.dirs_cached += 1
+                node.has_media = cached["has_media"]
+                node.keeps = cached["keeps"]
+                node.is_empty = not node.keeps
+                node.subdirs = cached["subdirs"]
+                subdirs = [DirectoryNode(os.path.join(node.path, name), node) for name in node.subdirs]
+                return
+
+            with self._lock:
+                self.dirs_listed += 1
+            with os.scandir(node.path) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(DirectoryNode(entry.path, node))
+                        node.subdirs.append(entry.name)
+                    elif entry.is_file():
+                        self._process_file(node, entry)
+                    else:
+                        # Symlinked directories and special files are left alone
+                        node.keeps = True
+                        node.is_empty = False
+            self._settle_sidecars(node)
+        except OSError as e:
+            logging.error(f"Failed to process directory {node.path}: {e}")
+            node.is_empty = False
+        finally:
+            with self._lock:
+                node.pending += len(subdirs)
+            for subdir in subdirs:
+                self._executor.submit(self._scan, subdir)
+            self._complete(node)
+
+    def _process_file(self, node, entry):
+        try:
+            stat = entry.stat(follow_symlinks=False)
+        except OSError:
+            stat = None
+        kind = self.classifier.classify(entry.path, stat)
+        if kind == MEDIA:
+            node.has_media = True
+        if kind in (MEDIA, PARTIAL):
+            node.keeps = True
+            node.is_empty = False
+            return
+
+        size = stat.st_size if stat else 0
+        if kind == SIDECAR:
+            node.sidecars.append((entry.path, size))
+            return
+        node.dirty = True
+        with self._lock:
+            self.plan.files.append((entry.path, size))
+
+    def _settle_sidecars(self, node):
+        """Keep sidecars next to media, plan the rest for deletion once the whole directory has been listed."""
+        if not node.sidecars:
+            return
+        if node.has_media:
+            node.keeps = True
+            node.is_empty = False
+        else:
+            node.dirty = True
+            with self._lock:
+                self.plan.files.extend(node.sidecars)
+        node.sidecars = []
+
+    def _complete(self, node):
+        """Mark one unit of a directory's work done and finalize it, and its ancestors, when nothing is pending."""
+        while node is not None:
+            with self._lock:
+                node.pending -= 1
+                if node.pending > 0:
+                    return
+                if node.has_media:
+                    self.plan.media_dirs.append(node.path)
+                prune = node.is_empty and not node.is_root
+                if prune:
+                    self.plan.dirs.append(node.path)
+            if self.cache and not prune:
+                self.cache.update(node)
+
+            if node.is_root:
+                with self._lock:
+                    self._roots_remaining -= 1
+                    if self._roots_remaining == 0:
+                        self._done.set()
+                return
+
+            if prune:
+                node.parent.dirty = True
+            else:
+                node.parent.is_empty = False
+            node = node.parent
+
+def _delete_files(batch):
+    """Delete a batch of files. Returns (deleted, bytes, failed)."""
+    deleted, reclaimed, failed = 0, 0, 0
+    for path, size in batch:
+        if classifier.is_media_extension(path):
+            logging.warning(f"Refusing to delete media file listed in plan: {path}")
+            failed += 1
+            continue
+        try:
+            os.remove(path)
+            deleted += 1
+            reclaimed += size
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logging.error(f"Failed to delete file {path}: {e}")
+            failed += 1
+    return deleted, reclaimed, failed
+
+def _remove_dirs(batch):
+    """Remove a batch of directories. Directories that are no longer empty are left in place. Returns (removed, failed)."""
+    removed, failed = 0, 0
+    for path in batch:
+        try:
+            os.rmdir(path)
+            removed += 1
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logging.warning(f"Failed to remove directory {path}: {e}")
+            failed += 1
+    return removed, failed
+
+def _batches(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def apply_plan(plan, max_workers=MAX_WORKERS, batch_size=DELETE_BATCH_SIZE):
+    """Carry out a plan: delete files in parallel batches, then prune directories deepest first."""
+    result = {"files_deleted": 0, "bytes_reclaimed": 0, "files_failed": 0, "dirs_removed": 0, "dirs_failed": 0}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for deleted, reclaimed, failed in executor.map(_delete_files, _batches(plan.files, batch_size)):
+            result["files_deleted"] += deleted
+            result["bytes_reclaimed"] += reclaimed
+            result["files_failed"] += failed
+
+        # Directories at the same depth are independent, parents are only removed after their children
+        by_depth = {}
+        for path in plan.dirs:
+            by_depth.setdefault(path.rstrip(os.sep).count(os.sep), []).append(path)
+        for depth in sorted(by_depth, reverse=True):
+            for removed, failed in executor.map(_remove_dirs, _batches(by_depth[depth], batch_size)):
+                result["dirs_removed"] += removed
+                result["dirs_failed"] += failed
+    return result
+
+def log_plan(plan):
+    summary = plan.summary()
+    logging.info(
+        f"Cleanup plan: {summary['files']} files to delete ({summary['bytes'] / (1024 ** 2):.2f} MB), "
+        f"{summary['dirs']} directories to prune, {summary['media_dirs']} directories with media"
+    )
+    logging.info("Directories containing media files:")
+    for media_dir in sorted(plan.media_dirs):
+        logging.info(media_dir)
+
+def check_and_clean_directories(directories, dry_run=False, plan_file=None, cache_file=CACHE_FILE, full_scan=False):
+    """Scan the directories, write the plan and, unless this is a dry run, apply it. Returns the plan.
+    Pass cache_file=None to scan without the directory cache."""
+    roots = []
     for directory in directories:
         if directory and os.path.exists(directory):
             logging.info(f"Checking directory: {directory}")
-            process_directory(directory, media_dirs, deleted_count)
-            total_dirs_processed += 1
+            roots.append(directory)
         else:
             logging.warning(f"Invalid or non-existent directory: {directory}")
 
-    logging.info(f"Total directories processed: {total_dirs_processed}")
-    logging.info(f"Total directories deleted: {deleted_count[0]}")
-    logging.info("Directories containing media files:")
-    for media_dir in media_dirs:
-        logging.info(media_dir)
+    cache = None
+    if cache_file:
+        cache = DirectoryCache(cache_file)
+        cache.load(force_full_scan=full_scan)
+
+    started = time.monotonic()
+    scan_started = time.time()
+    classifier.load_cache()
+    scanner = CleanupScanner(cache=cache)
+    plan = scanner.run(roots)
+    logging.info(
+        f"Scanned {len(roots)} directories in {time.monotonic() - started:.2f}s: "
+        f"{scanner.dirs_listed} listed, {scanner.dirs_cached} unchanged since the last run"
+    )
+    if cache:
+        cache.save(scan_started)
+    classifier.save_cache(prune=cache is None or cache.full_scan)
+    classifier.log_summary()
+    log_plan(plan)
+
+    plan_file = plan_file or os.path.join(PLAN_PATH, f"dir_cleanup_plan_{time.strftime('%Y-%m-%d_%H-%M-%S')}.jsonl")
+    plan.save(plan_file)
+    logging.info(f"Cleanup plan written to {plan_file}")
+
+    if dry_run:
+        logging.info("[DRY-RUN] Stopping after the plan, nothing was deleted.")
+        return plan
+
+    run_apply(plan)
+    return plan
+
+def run_apply(plan):
+    """Apply a plan and log the outcome."""
+    started = time.monotonic()
+    result = apply_plan(plan)
+    logging.info(
+        f"Deleted {result['files_deleted']} files ({result['bytes_reclaimed'] / (1024 ** 2):.2f} MB), "
+        f"{result['files_failed']} failed, in {time.monotonic() - started:.2f}s"
+    )
+    logging.info(f"Total directories deleted: {result['dirs_removed']} ({result['dirs_failed']} failed)")
+    return result
 
 def main():
     """Entry point for the script."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dry-run', action='store_true', help='Scan and write the plan without deleting anything')
+    parser.add_argument('--plan-file', help='Where to write the plan (default: a timestamped file in CLEANUP_PLAN_PATH)')
+    parser.add_argument('--apply-plan', help='Apply a previously saved plan instead of scanning')
+    parser.add_argument('--full-scan', action='store_true', help='List every directory, ignoring the cached state')
+    parser.add_argument('--no-cache', action='store_true', help='Do not read or write the directory cache')
+    args = parser.parse_args()
+
     logging.info("Starting directory cleanup process...")
-    check_and_clean_directories(directories)
+    if args.apply_plan:
+        plan = CleanupPlan.load(args.apply_plan)
+        logging.info(f"Applying saved plan {args.apply_plan}")
+        log_plan(plan)
+        run_apply(plan)
+    else:
+        cache_file = None if args.no_cache else CACHE_FILE
+        check_and_clean_directories(directories, args.dry_run, args.plan_file, cache_file, args.full_scan)
     logging.info("Directory cleanup process completed.")
 
 if __name__ == "__main__":
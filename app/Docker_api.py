@@ -0,0 +1,224 @@
+import os
+import json
+import time
+import queue
+import socket
+import logging
+import threading
+import http.client
+from urllib.parse import quote, urlencode
+from concurrent.futures import ThreadPoolExecutor
+
+"""__summary__
+This module is a small client for the Docker Engine API over the local unix socket.
+It replaces shelling out to the docker CLI: connections to the socket are kept alive in a small pool,
+containers can be stopped, started, paused and unpaused in parallel batches, health status can be awaited,
+and a container's appdata directory can be discovered from its mounts instead of being hard-coded.
+"""
+
+DOCKER_SOCKET = os.getenv("DOCKER_SOCKET", "/var/run/docker.sock")
+
+# Container mount destinations that usually hold appdata, in order of preference
+APPDATA_DESTINATIONS = ("/config", "/data", "/app/config")
+
+# Container actions that map directly to POST /containers/{name}/{action}
+CONTAINER_ACTIONS = ("start", "stop", "restart", "pause", "unpause")
+
+
+class DockerAPIError(Exception):
+    """Raised when the Docker Engine API returns an error response."""
+
+    def __init__(self, status, message):
+        super().__init__(f"Docker API error {status}: {message}")
+        self.status = status
+        self.message = message
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTP connection over a unix domain socket."""
+
+    def __init__(self, socket_path, timeout):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+
+class DockerClient:
+    """Pooled keep-alive client for the Docker Engine API."""
+
+    def __init__(self, socket_path=DOCKER_SOCKET, pool_size=4, timeout=60):
+        self.socket_path = socket_path
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+        self.connections_opened = 0
+        self._lock = threading.Lock()
+
+    def _get_connection(self):
+        try:
+            return self._pool.get_nowait(), True
+        except queue.Empty:
+            with self._lock:
+                self.connections_opened += 1
+            return _UnixHTTPConnection(self.socket_path, self.timeout), False
+
+    def _release_connection(self, conn):
+        try:
+            self._pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close(self):
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def request(self, method, path, params=None, body=None, timeout=None):
+        """Send a request and return the decoded JSON body (or None). Raises DockerAPIError for error statuses."""
+        _, data = self.request_with_status(method, path, params, body, timeout)
+        return data
+
+    def request_with_status(self, method, path, params=None, body=None, timeout=None):
+        """Send a request and return (status, decoded body). Raises DockerAPIError for error statuses."""
+        url = path + (f"?{urlencode(params)}" if params else "")
+        payload = json.dumps(body).encode() if body is not None else None
+        headers = {"Content-Type": "application/json"} if payload is not None else {}
+
+        for attempt in range(2):
+            conn, reused = self._get_connection()
+            conn.timeout = timeout or self.timeout
+            if conn.sock:
+                conn.sock.settimeout(conn.timeout)
+            try:
+                conn.request(method, url, body=payload, headers=headers)
+                response = conn.getresponse()
+                data = response.read()
+            except (http.client.HTTPException, ConnectionError) as e:
+                conn.close()
+                # A pooled connection may have been closed by the daemon while idle, retry once on a new one
+                if reused and attempt == 0:
+                    logging.debug(f"Retrying Docker API request on a new connection after: {e}")
+                    continue
+                raise
+            except OSError:
+                conn.close()
+                raise
+
+            if response.will_close:
+                conn.close()
+            else:
+                self._release_connection(conn)
+            break
+
+        if response.status >= 400:
+            try:
+                message = json.loads(data).get("message", data.decode(errors="replace"))
+            except ValueError:
+                message = data.decode(errors="replace")
+            raise DockerAPIError(response.status, message)
+        if not data:
+            return response.status, None
+        try:
+            return response.status, json.loads(data)
+        except ValueError:
+            return response.status, data.decode(errors="replace")
+
+    def inspect(self, name):
+        return self.request("GET", f"/containers/{quote(name)}/json")
+
+    def container_action(self, name, action, stop_timeout=30):
+        """Run start/stop/restart/pause/unpause on a container. Returns True if the state changed,
+        False if the container was already in the requested state."""
+        if action not in CONTAINER_ACTIONS:
+            raise ValueError(f"Unsupported container action: {action}")
+        params = {"t": stop_timeout} if action in ("stop", "restart") else None
+        request_timeout = self.timeout + stop_timeout if params else None
+        try:
+            status, _ = self.request_with_status("POST", f"/containers/{quote(name)}/{action}", params=params, timeout=request_timeout)
+        except DockerAPIError as e:
+            # 409 is returned when pausing a paused container or unpausing a running one
+            if e.status == 409 and action in ("pause", "unpause"):
+                return False
+            raise
+        # 304 means the container was already started or stopped
+        return status != 304
+
+    def start(self, name):
+        return self.container_action(name, "start")
+
+    def stop(self, name, stop_timeout=30):
+        return self.container_action(name, "stop", stop_timeout)
+
+    def pause(self, name):
+        return self.container_action(name, "pause")
+
+    def unpause(self, name):
+        return self.container_action(name, "unpause")
+
+    def batch(self, action, names, max_workers=None, **kwargs):
+        """Run an action (or wait_healthy) on several containers in parallel.
+        Returns {name: None} on success or {name: exception} on failure."""
+        names = list(names)
+        if not names:
+            return {}
+
+        def run(name):
+            if action == "wait_healthy":
+                if not self.wait_healthy(name, **kwargs):
+                    raise TimeoutError(f"Container {name} did not become healthy")
+            else:
+                self.container_action(name, action, **kwargs)
+
+        results = {}
+        with ThreadPoolExecutor(max_workers=max_workers or min(len(names), self.pool_size)) as executor:
+            futures = {name: executor.submit(run, name) for name in names}
+            for name, future in futures.items():
+                try:
+                    future.result()
+                    results[name] = None
+                except Exception as e:
+                    results[name] = e
+        return results
+
+    def wait_healthy(self, name, timeout=120, interval=1.0):
+        """Wait until a container reports healthy (or running, when it has no healthcheck). Returns True when ready."""
+        deadline = time.monotonic() + timeout
+        while True:
+            state = self.inspect(name).get("State", {})
+            health = state.get("Health")
+            if health is not None:
+                if health.get("Status") == "healthy":
+                    return True
+                if health.get("Status") == "unhealthy":
+                    logging.warning(f"Container {name} reported unhealthy")
+            elif state.get("Running") and not state.get("Paused"):
+                return True
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(interval)
+
+    def appdata_mounts(self, name):
+        """Return the host paths of a container's bind mounts as (destination, source) pairs."""
+        mounts = self.inspect(name).get("Mounts", [])
+        return [(mount.get("Destination"), mount.get("Source")) for mount in mounts if mount.get("Type") == "bind"]
+
+    def find_appdata_path(self, name, appdata_root=None):
+        """Pick the bind mount that holds a container's appdata, or None if none matches."""
+        mounts = self.appdata_mounts(name)
+        if appdata_root:
+            root = appdata_root.rstrip("/") + "/"
+            for _, source in mounts:
+                if source and source.startswith(root):
+                    return source
+        for destination in APPDATA_DESTINATIONS:
+            for mount_destination, source in mounts:
+                if mount_destination == destination:
+                    return source
+        return None
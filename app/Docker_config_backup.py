@@ -1,11 +1,16 @@
 import os
-import tarfile
 import json
 import logging
-from datetime import datetime, timedelta
+from datetime import datetime
 import argparse
+from Log_setup import RateLimitedLog, setup_logging
 import time
-import subprocess
+from Backup_rules import BackupFilter
+from Backup_catalog import BackupCatalog, select_expired
+from Backup_verify import expected_digest, log_result, needs_verification, verify_archive, verify_archives
+from Docker_api import DockerAPIError, DockerClient
+from concurrent.futures import ProcessPoolExecutor
+from Backup_archive import ARCHIVE_FORMATS, index_path_for, open_archive_writer, list_members, extract_members
 
 """__summary__
 This script is used to backup Docker appdata directories to a specified location.
@@ -20,16 +25,6 @@ CONFIG_FILE = os.path.join(os.getenv("CONFIG_PATH", ""), "backup_config.json")
 LOG_PATH = os.getenv("LOG_PATH")
 LOG_LEVEL = os.getenv("LOG_LEVEL", "DEBUG").upper()
 
-# Map the log level string to actual logging levels
-LOG_LEVEL_MAPPING = {
-    'CRITICAL': logging.CRITICAL,
-    'ERROR': logging.ERROR,
-    'WARNING': logging.WARNING,
-    'INFO': logging.INFO,
-    'DEBUG': logging.DEBUG,
-    'NOTSET': logging.NOTSET
-}
-
 required_env_vars = ["CONFIG_PATH", "LOG_LEVEL", "LOG_PATH"]
 missing_vars = [var for var in required_env_vars if not os.getenv(var)]
 
@@ -40,20 +35,18 @@ if missing_vars:
 if not LOG_PATH or not os.path.isdir(LOG_PATH):
     raise ValueError(f"Invalid LOG_PATH: {LOG_PATH}. Please set a valid path in your .env file.")
 
-# Default to DEBUG if the provided LOG_LEVEL isn't valid
-log_level = LOG_LEVEL_MAPPING.get(LOG_LEVEL, logging.DEBUG)
-
-# Setup Logging
-logging.basicConfig(
-    filename=f"{LOG_PATH}/directory_cleanup_log_{time.strftime('%Y-%m-%d_%H-%M-%S')}.log",
-    level=log_level,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
-)
+# Setup Logging, through a queue to this script's own log file
+setup_logging("docker_config_backup", LOG_PATH, LOG_LEVEL)
 
 # Toggle for pausing containers during backup
 PAUSE_CONTAINERS = False
 
+# Action used to quiesce a container during its backup ("stop" or "pause") and the action that resumes it
+RESUME_ACTIONS = {"stop": "start", "pause": "unpause"}
+
+# Docker Engine API client, connections are only opened when a container is managed
+docker_client = DockerClient()
+
 def load_config(config_file):
     """Load and validate configuration from a JSON file."""
     try:
@@ -65,21 +58,75 @@ def load_config(config_file):
             if key not in config:
                 raise KeyError(f"Missing required key: {key}")
         
+        if config.get("PAUSE_ACTION", "stop") not in RESUME_ACTIONS:
+            raise KeyError(f"Invalid PAUSE_ACTION: {config['PAUSE_ACTION']}. Expected one of {', '.join(RESUME_ACTIONS)}")
+
+        archive_format = config.get("ARCHIVE_FORMAT", "tar.gz")
+        if archive_format not in ARCHIVE_FORMATS:
+            raise KeyError(f"Invalid ARCHIVE_FORMAT: {archive_format}. Expected one of {', '.join(ARCHIVE_FORMATS)}")
+
         return config
     except (FileNotFoundError, KeyError, json.JSONDecodeError) as e:
         logging.critical(f"Failed to load or validate config: {e}")
         exit(1)
 
 def manage_container(container_name, action):
-    """Pause or start a Docker container."""
+    """Stop, start, pause or unpause a Docker container through the Docker Engine API."""
     try:
-        subprocess.run(["docker", action, container_name], check=True)
-        logging.info(f"Container {container_name} {action} successfully.")
-    except subprocess.CalledProcessError as e:
+        if docker_client.container_action(container_name, action):
+            logging.info(f"Container {container_name} {action} successfully.")
+        else:
+            logging.info(f"Container {container_name} was already in the requested state ({action}).")
+        return True
+    except (DockerAPIError, OSError) as e:
         logging.error(f"Failed to {action} container {container_name}: {e}")
+        return False
+
+def manage_containers(container_names, action):
+    """Run the same action on several containers in parallel."""
+    for name, error in docker_client.batch(action, container_names).items():
+        if error is None:
+            logging.info(f"Container {name} {action} successfully.")
+        else:
+            logging.error(f"Failed to {action} container {name}: {error}")
+
+def wait_for_containers(container_names, timeout):
+    """Wait for restarted containers to report healthy (or running when they have no healthcheck)."""
+    started = time.monotonic()
+    for name, error in docker_client.batch("wait_healthy", container_names, timeout=timeout).items():
+        if error is None:
+            logging.info(f"Container {name} is healthy after {time.monotonic() - started:.1f}s")
+        else:
+            logging.warning(f"Container {name} not healthy after restart: {error}")
 
-def create_backup(source_path, backup_location, container_name, dry_run=False):
-    """Create a compressed backup for a container."""
+def resolve_appdata_path(container, config):
+    """Return a container's appdata path from the config, or discover it from the container's mounts."""
+    if container.get("appdata_path"):
+        return container["appdata_path"]
+    try:
+        source = docker_client.find_appdata_path(container["name"], config.get("APPDATA_ROOT"))
+    except (DockerAPIError, OSError) as e:
+        logging.error(f"Failed to inspect container {container['name']}: {e}")
+        return None
+    if source is None:
+        logging.error(f"Could not discover an appdata mount for container {container['name']}")
+        return None
+    # Map host paths to the paths this script sees them under (for example an SMB share)
+    for host_prefix, local_prefix in config.get("APPDATA_PATH_MAP", {}).items():
+        if source.startswith(host_prefix):
+            source = local_prefix + source[len(host_prefix):]
+            break
+    logging.info(f"Discovered appdata path for {container['name']}: {source}")
+    return source
+
+def open_catalog(config):
+    """Open the local backup catalog. It lives next to the config file, not on the backup share."""
+    catalog_path = config.get("CATALOG_PATH") or os.path.join(os.getenv("CONFIG_PATH", ""), "backup_catalog.db")
+    return BackupCatalog(catalog_path)
+
+def create_backup(source_path, backup_location, container_name, dry_run=False, archive_format="tar.gz", backup_filter=None, catalog=None):
+    """Create a compressed backup for a container, skipping anything excluded by backup_filter.
+    Returns the backup path, or None if no backup was written."""
     logging.info(f"Starting backup for container: {container_name}")
     if not os.path.exists(source_path):
         logging.error(f"Appdata path for {container_name} does not exist: {source_path}")
@@ -97,65 +144,242 @@ def create_backup(source_path, backup_location, container_name, dry_run=False):
 
     try:
         logging.info(f"Creating backup archive: {backup_path}")
-        with tarfile.open(backup_path, "w:gz") as tar:
+        backup_filter = backup_filter or BackupFilter()
+        files_added = 0
+        file_log = RateLimitedLog(f"Backup of {container_name}")
+        with open_archive_writer(backup_path, archive_format) as tar:
             for root, dirs, files in os.walk(source_path):
+                rel_root = os.path.relpath(root, start=source_path).replace(os.sep, "/")
+                # Prune excluded directories before os.walk descends into them
+                backup_filter.prune_dirs(rel_root, dirs)
                 for file in files:
                     full_path = os.path.join(root, file)
-                    arcname = os.path.relpath(full_path, start=source_path)
-                    logging.debug(f"Adding file: {full_path} as {arcname}")
+                    arcname = file if rel_root == "." else f"{rel_root}/{file}"
                     try:
+                        if backup_filter.skip_file(arcname, full_path):
+                            continue
                         tar.add(full_path, arcname=arcname)
+                        files_added += 1
                     except (PermissionError, FileNotFoundError) as e:
-                        logging.warning(f"Skipping file due to error: {full_path}. Reason: {e}")
-        logging.info(f"[SUCCESS] Backup created: {backup_path}")
+                        file_log.event("unreadable", f"Skipping file due to error: {full_path}. Reason: {e}", logging.WARNING)
+        backup_filter.log_summary(container_name)
+        if file_log.counts:
+            file_log.summary()
+        if catalog is not None:
+            catalog.record(
+                backup_path, container_name, datetime.strptime(timestamp, "%Y%m%d_%H%M%S").timestamp(),
+                tar.size, sha256=tar.sha256, member_count=tar.member_count, archive_format=tar.archive_format
+            )
+        logging.info(f"[SUCCESS] Backup created: {backup_path} ({files_added} files)")
+        return backup_path
     except PermissionError as e:
         logging.error(f"Permission denied: {e}")
     except Exception as e:
         logging.error(f"Failed to create backup for {container_name}: {e}")
 
-def cleanup_old_backups(backup_location, retention_days, dry_run=False):
-    """Remove backups older than the retention period."""
+def delete_backup(file_path, catalog=None):
+    """Delete a backup archive, its index and its catalog entry."""
+    try:
+        os.remove(file_path)
+        if os.path.exists(index_path_for(file_path)):
+            os.remove(index_path_for(file_path))
+        if catalog is not None:
+            catalog.remove(file_path)
+        logging.info(f"Deleted old backup: {file_path}")
+    except FileNotFoundError:
+        if catalog is not None:
+            catalog.remove(file_path)
+        logging.warning(f"Backup already missing, removed from catalog: {file_path}")
+    except Exception as e:
+        logging.error(f"Failed to delete {file_path}: {e}")
+
+def cleanup_old_backups(backup_location, retention_days, dry_run=False, catalog=None, retention_policy=None):
+    """Remove backups outside the retention period (and optional grandfather-father-son policy).
+    Uses the catalog when one is available so the backup share is only touched for deletions."""
     logging.info(f"Cleaning up backups older than {retention_days} days in {backup_location}")
-    cutoff_date = datetime.now() - timedelta(days=retention_days)
 
+    if catalog is None:
+        backups = scan_backups(backup_location)
+    else:
+        if not catalog.is_reconciled(backup_location):
+            logging.info("Catalog has not been built for this location yet, rebuilding it from disk.")
+            catalog.reconcile(backup_location)
+        backups = catalog.list_backups(backup_location=backup_location)
+
+    for backup in select_expired(backups, retention_days, retention_policy):
+        if dry_run:
+            logging.info(f"[DRY-RUN] Would delete old backup: {backup['path']}")
+        else:
+            delete_backup(backup["path"], catalog)
+
+def scan_backups(backup_location):
+    """List backups by scanning the backup location, for use without a catalog."""
+    backups = []
     for filename in os.listdir(backup_location):
         file_path = os.path.join(backup_location, filename)
         if os.path.isfile(file_path) and filename.endswith(".tar.gz"):
-            file_time = datetime.fromtimestamp(os.path.getmtime(file_path))
-            if file_time < cutoff_date:
-                if dry_run:
-                    logging.info(f"[DRY-RUN] Would delete old backup: {file_path}")
-                else:
-                    try:
-                        os.remove(file_path)
-                        logging.info(f"Deleted old backup: {file_path}")
-                    except Exception as e:
-                        logging.error(f"Failed to delete {file_path}: {e}")
+            backups.append({
+                "path": file_path,
+                "container": filename.split("_backup_")[0],
+                "created_at": os.path.getmtime(file_path)
+            })
+    return backups
+
+def list_catalog(catalog, container=None):
+    """Print the backups recorded in the catalog."""
+    for backup in catalog.list_backups(container):
+        created = datetime.fromtimestamp(backup["created_at"])
+        size_mb = (backup["size"] or 0) / (1024 ** 2)
+        members = backup["member_count"] if backup["member_count"] is not None else "?"
+        print(f"{backup['container']:20} {created:%Y-%m-%d %H:%M:%S} {size_mb:>10.2f} MB {members:>8} members {backup['format'] or '?':8} {backup['path']}")
+
+def list_backup(archive_path):
+    """Print the members of a backup archive."""
+    for member in list_members(archive_path):
+        print(f"{member['type']:8} {member['size']:>14} {datetime.fromtimestamp(member['mtime']):%Y-%m-%d %H:%M:%S} {member['name']}")
+
+def restore_backup(archive_path, dest_dir, paths):
+    """Restore individual files or subtrees from a backup archive."""
+    logging.info(f"Restoring {', '.join(paths) if paths else 'all members'} from {archive_path} to {dest_dir}")
+    os.makedirs(dest_dir, exist_ok=True)
+    extracted = extract_members(archive_path, dest_dir, paths)
+    logging.info(f"[SUCCESS] Restored {extracted} members from {archive_path}")
+    print(f"Restored {extracted} members to {dest_dir}")
+
+def verify_backups(catalog, backup_location, archives=None, container=None, force=False, max_workers=None):
+    """Verify the given archives, or every cataloged backup that has not been verified since it last changed."""
+    if not archives:
+        backups = catalog.list_backups(container, backup_location=backup_location)
+        archives = [backup["path"] for backup in backups if needs_verification(backup, force)]
+        logging.info(f"{len(backups) - len(archives)} cataloged backups are unchanged since their last successful verification")
+    results = verify_archives(archives, catalog, max_workers)
+    failed = [result for result in results if not result["ok"]]
+    print(f"Verified {len(results)} archives, {len(failed)} failed")
+    for result in failed:
+        print(f"FAILED {result['path']}: {result['error']}")
+    return not failed
+
+def resolve_archive(args, config):
+    """Return the archive to list or restore, looking it up in the catalog when --container is used."""
+    targets = list(args.targets)
+    if not args.container:
+        if not targets:
+            logging.critical("An archive path or --container is required.")
+            exit(1)
+        return targets[0], targets[1:]
+
+    before = datetime.strptime(args.before, "%Y%m%d_%H%M%S") if args.before else None
+    with open_catalog(config) as catalog:
+        backup = catalog.find_backup(args.container, before)
+    if backup is None:
+        logging.critical(f"No backup found in the catalog for container {args.container}")
+        exit(1)
+    return backup["path"], targets
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--dry-run', action='store_true', help='Simulate backup process without changes')
+    parser.add_argument('--verify', action='store_true', help='Verify each archive in the background right after it is created')
+    subparsers = parser.add_subparsers(dest='command')
+
+    list_parser = subparsers.add_parser('list', help='List the contents of a backup archive')
+    restore_parser = subparsers.add_parser('restore', help='Restore files or directories from a backup archive')
+    for archive_parser in (list_parser, restore_parser):
+        archive_parser.add_argument('targets', nargs='*', help='Archive path followed by member paths, or only member paths with --container')
+        archive_parser.add_argument('--container', help='Use the newest cataloged backup of this container instead of an archive path')
+        archive_parser.add_argument('--before', help='With --container, use the newest backup at or before this time (YYYYMMDD_HHMMSS)')
+    restore_parser.add_argument('--dest', required=True, help='Directory to restore into')
+
+    backups_parser = subparsers.add_parser('backups', help='List cataloged backups')
+    backups_parser.add_argument('--container', help='Only list backups of this container')
+
+    reconcile_parser = subparsers.add_parser('reconcile', help='Rebuild the backup catalog from the backup location')
+    reconcile_parser.add_argument('--digest', action='store_true', help='Also compute archive digests (reads every archive)')
+
+    verify_parser = subparsers.add_parser('verify', help='Check that backup archives are complete and readable')
+    verify_parser.add_argument('archives', nargs='*', help='Archives to verify (default: cataloged backups not yet verified)')
+    verify_parser.add_argument('--container', help='Only verify backups of this container')
+    verify_parser.add_argument('--force', action='store_true', help='Re-verify archives that already passed')
+    verify_parser.add_argument('--workers', type=int, help='Number of parallel verification processes (default: CPU count)')
     args = parser.parse_args()
 
+    if args.command in ('list', 'restore'):
+        config = load_config(CONFIG_FILE) if args.container else {}
+        archive_path, paths = resolve_archive(args, config)
+        if args.command == 'list':
+            list_backup(archive_path)
+        else:
+            restore_backup(archive_path, args.dest, paths)
+        return
+
     logging.info("Loading configuration...")
     config = load_config(CONFIG_FILE)
     backup_location = config["BACKUP_LOCATION"]
     retention_days = config["RETENTION_DAYS"]
+    retention_policy = config.get("RETENTION_POLICY")
     containers = config["CONTAINERS"]
+    archive_format = config.get("ARCHIVE_FORMAT", "tar.gz")
 
-    # Create backups for each container
-    for container in containers:
-        if PAUSE_CONTAINERS:
-            manage_container(container["name"], "stop")
-            create_backup(container["appdata_path"], backup_location, container["name"], args.dry_run)
-            manage_container(container["name"], "start")
-        else:
-            create_backup(container["appdata_path"], backup_location, container["name"], args.dry_run)
+    with open_catalog(config) as catalog:
+        if args.command == 'backups':
+            list_catalog(catalog, args.container)
+            return
+        if args.command == 'reconcile':
+            catalog.reconcile(backup_location, compute_digest=args.digest)
+            return
+        if args.command == 'verify':
+            if not verify_backups(catalog, backup_location, args.archives, args.container, args.force, args.workers):
+                exit(1)
+            return
+
+        # Verification runs in other processes while the next container is backed up, so each archive
+        # is read back while it is still in the page cache
+        verifier = ProcessPoolExecutor() if args.verify and not args.dry_run else None
+        verifications = []
+
+        pause_containers = config.get("PAUSE_CONTAINERS", PAUSE_CONTAINERS) and not args.dry_run
+        pause_action = config.get("PAUSE_ACTION", "stop")
+        resume_action = RESUME_ACTIONS[pause_action]
+        health_timeout = config.get("HEALTH_TIMEOUT", 120)
+        # "all" quiesces every container at once for a consistent point in time, "per_container" minimises downtime
+        pause_all = pause_containers and config.get("PAUSE_MODE", "per_container") == "all"
+        container_names = [container["name"] for container in containers]
+
+        if pause_all:
+            manage_containers(container_names, pause_action)
+
+        # Create backups for each container
+        for container in containers:
+            appdata_path = resolve_appdata_path(container, config)
+            if appdata_path is None:
+                continue
+            backup_filter = BackupFilter.from_config(container, config)
+            if pause_containers and not pause_all:
+                manage_container(container["name"], pause_action)
+                backup_path = create_backup(appdata_path, backup_location, container["name"], args.dry_run, archive_format, backup_filter, catalog)
+                manage_container(container["name"], resume_action)
+                if resume_action == "start":
+                    wait_for_containers([container["name"]], health_timeout)
+            else:
+                backup_path = create_backup(appdata_path, backup_location, container["name"], args.dry_run, archive_format, backup_filter, catalog)
+            if verifier and backup_path:
+                verifications.append(verifier.submit(verify_archive, backup_path, expected_digest(catalog, backup_path)))
+
+        if pause_all:
+            manage_containers(container_names, resume_action)
+            if resume_action == "start":
+                wait_for_containers(container_names, health_timeout)
 
+        if verifier:
+            for future in verifications:
+                result = future.result()
+                log_result(result)
+                catalog.record_verification(result)
+            verifier.shutdown()
 
-    # Cleanup old backups
-    logging.info("Starting cleanup process...")
-    cleanup_old_backups(backup_location, retention_days, args.dry_run)
+        # Cleanup old backups
+        logging.info("Starting cleanup process...")
+        cleanup_old_backups(backup_location, retention_days, args.dry_run, catalog, retention_policy)
     logging.info("Backup process completed!")
 
 if __name__ == "__main__":
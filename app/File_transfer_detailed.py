@@ -1,14 +1,11 @@
 import os
-import time
 import psutil
 import logging
 import shutil
-import requests
-import re
-import socket
-import platform
 from tqdm import tqdm
 from dotenv import load_dotenv
+from Log_setup import RateLimitedLog, setup_logging
+from Power_manager import power_lease
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
 """_summary_
@@ -49,116 +46,14 @@ if ENABLE_WOL == "TRUE" and not all([TARGET_MAC, TARGET_IP, TARGET_PORT]):
 LOG_PATH = os.getenv("LOG_PATH")
 LOG_LEVEL = os.getenv("LOG_LEVEL", "DEBUG").upper()
 
-# Map the log level string to actual logging levels
-LOG_LEVEL_MAPPING = {
-    'CRITICAL': logging.CRITICAL,
-    'ERROR': logging.ERROR,
-    'WARNING': logging.WARNING,
-    'INFO': logging.INFO,
-    'DEBUG': logging.DEBUG,
-    'NOTSET': logging.NOTSET
-}
-
 required_env_vars = ["DIRECTORY_1", "DIRECTORY_2", "LOG_PATH", "LOG_LEVEL"]
 missing_vars = [var for var in required_env_vars if not os.getenv(var)]
 
 if missing_vars:
     raise EnvironmentError(f"Missing required environment variables: {', '.join(missing_vars)}")
 
-# Default to DEBUG if the provided LOG_LEVEL isn't valid
-log_level = LOG_LEVEL_MAPPING.get(LOG_LEVEL, logging.INFO)
-
-# Setup Logging
-logging.basicConfig(
-    filename=f"{LOG_PATH}/directory_cleanup_log_{time.strftime('%Y-%m-%d_%H-%M-%S')}.log",
-    level=log_level,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
-)
-
-def send_wol_packet(mac_address):
-    """Send a Wake-On-LAN magic packet to a specific MAC address."""
-    if not mac_address:
-        logging.error("No MAC address provided for WOL. Skipping WOL.")
-        return
-    
-    if not re.match(r"([0-9A-Fa-f]{2}[:-]){5}([0-9A-Fa-f]{2})", mac_address):
-        raise ValueError("Invalid MAC address format. Must be in the format 'XX:XX:XX:XX:XX:XX' or 'XX-XX-XX-XX-XX-XX'")
-
-    mac_address = mac_address.replace(":", "").replace("-", "").upper()
-    if len(mac_address) != 12:
-        raise ValueError("Invalid MAC address format")
-
-    # Create the magic packet
-    data = b"FF" * 6 + (mac_address * 16).encode()
-    magic_packet = bytes.fromhex(data.decode())
-
-    # Send the packet
-    try:
-        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
-            sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-            sock.sendto(magic_packet, (TARGET_IP, TARGET_PORT))
-        logging.debug(f"Magic packet sent to {TARGET_IP}:{TARGET_PORT}")
-    except Exception as e:
-        logging.error(f"Failed to send WOL packet: {e}")
-
-def shutdown_machine():
-    system = platform.system()
-    if system == "Windows":
-        os.system("shutdown /s /t 0")
-    elif system in ("Linux", "Darwin"):  # Linux or macOS
-        os.system("sudo shutdown now")
-    else:
-        logging.info(f"Unsupported OS: {system}")
-
-# Function to power on the Dell server
-def power_on_server():
-    url = f"{IDRAC_HOST}/redfish/v1/Systems/System.Embedded.1/Actions/ComputerSystem.Reset"
-    payload = {"ResetType": "On"}
-    max_retries = 12 # 12 retries * 5 seconds = 60 seconds
-    retry_count = 0
-    
-    while retry_count < max_retries:
-        try:
-            response = requests.post(url, json=payload, auth=(IDRAC_USER, IDRAC_PASS), verify=False)
-            
-            if response.status_code == 204:
-                logging.debug("Power-on command sent successfully.")
-                print("Giving time for the server to boot!")
-                time.sleep(360)
-                return
-            elif response.status_code == 409:
-                logging.debug("Server is already powered on.")
-                break
-            else:
-                logging.warning(f"Unexpected response: {response.status_code}, {response.text}")
-            
-            # Wait for a short duration before sending the next request
-            retry_count += 1
-            time.sleep(5)
-        except requests.RequestException as e:
-            logging.error(f"Error while sending power-on request: {e}")
-            retry_count += 1
-            time.sleep(5)  # Retry after a delay
-    logging.error("Failed to power on Dell server. Exiting script.")
-    
-# Function to power off the Dell server
-def power_off_server():
-    url = f"{IDRAC_HOST}/redfish/v1/Systems/System.Embedded.1/Actions/ComputerSystem.Reset"
-    payload = {"ResetType": "ForceOff"}
-    max_retries = 5
-    
-    for attempt in range(max_retries):
-        try:
-            response = requests.post(url, json=payload, auth=(IDRAC_USER, IDRAC_PASS), verify=False)
-            if response.status_code == 204:
-                logging.debug("Dell server powered off successfully.")
-                return
-            logging.warning(f"Attempt {attempt + 1}: Unexpected response - {response.status_code}, {response.text}")
-        except requests.RequestException as e:
-            logging.error(f"Attempt {attempt + 1}: Error while powering off server: {e}")
-        time.sleep(5)
-    logging.error("Failed to power off Dell server after retries.")
+# Setup Logging, through a queue to this script's own log file
+setup_logging("file_transfer", LOG_PATH, LOG_LEVEL, default_level=logging.INFO)
 
 # Function to determine system resources and set max_workers
 def get_max_workers():
@@ -214,18 +109,21 @@ def files_are_equal(file1, file2):
         logging.error(f"Error comparing files {file1} and {file2}: {e}")
         return False
 
+# Per-file messages are rate limited, the counts of every copy, skip and error are logged as periodic totals
+sync_log = RateLimitedLog("Sync progress")
+
 def sync_file(src_file, dest_file, files_copied):
     """Compare and copy a single file if necessary."""
     try:
         # Compare files and log actions
         if os.path.exists(dest_file) and files_are_equal(src_file, dest_file):
-            logging.debug(f"Skipping identical file: {src_file}")
+            sync_log.event("skipped", f"Skipping identical file: {src_file}", logging.DEBUG)
         else:
-            logging.info(f"Copying {src_file} to {dest_file}")
+            sync_log.event("copied", f"Copying {src_file} to {dest_file}")
             shutil.copy2(src_file, dest_file)
             files_copied[0] += 1  # Increment the copied files counter
     except Exception as file_error:
-        logging.error(f"Error copying {src_file}: {file_error}")
+        sync_log.event("failed", f"Error copying {src_file}: {file_error}", logging.ERROR)
 
 def sync_directories():
     """Synchronize contents of two directories. Copies missing or updated files from src_dir to dest_dir."""
@@ -275,51 +173,27 @@ def sync_directories():
             finally:
                 executor.shutdown(wait=True)
 
+    sync_log.summary()
     logging.info(f"Directory synchronization complete. Files copied: {files_copied[0]}")
 
 def main():
     logging.debug("Starting the script...")
 
-    # Step 1: Handle WOL if enabled
-    if ENABLE_WOL == "TRUE":
-        try:
-            logging.info("WOL mode enabled. Attempting to power on the Dell server.")
-            send_wol_packet(TARGET_MAC)
-            logging.info("WOL packet sent successfully. Waiting for the server to boot.")
-            time.sleep(30)  # Wait for the server to power on (adjust as needed)
-        except Exception as e:
-            logging.error(f"Error during WOL execution: {e}")
-            return  # Exit script if WOL fails
-
-    # Step 2: Handle iDRAC if enabled
-    if ENABLE_IDRAC == "TRUE":
-        try:
-            logging.info("IDRAC mode enabled. Powering on the Dell server.")
-            power_on_server()
-        except Exception as e:
-            logging.error(f"Error during iDRAC power-on: {e}")
-            return  # Exit script if iDRAC fails
-
-    # Step 3: Perform synchronization
+    # Step 1: Hold a power lease, so the Dell server is woken (WOL and/or iDRAC) if needed and is not powered off
+    # until this and every other job using it are done, see Power_manager
     try:
-        logging.info("Starting directory synchronization.")
-        sync_directories()
-        logging.info("Directory synchronization completed successfully.")
+        with power_lease("file_transfer") as ready:
+            if not ready:
+                logging.warning("The server did not report ready, trying the synchronization anyway.")
+
+            # Step 2: Perform synchronization
+            logging.info("Starting directory synchronization.")
+            sync_directories()
+            logging.info("Directory synchronization completed successfully.")
     except Exception as e:
         logging.error(f"An error occurred during synchronization: {e}")
         return  # Exit script if synchronization fails
 
-    # Step 4: Handle shutdown if WOL or iDRAC was used
-    try:
-        if ENABLE_WOL == "TRUE":
-            logging.info("WOL mode enabled. Sending shutdown magic packet.")
-            shutdown_machine()
-        if ENABLE_IDRAC == "TRUE":
-            logging.info("IDRAC mode enabled. Powering off the Dell server.")
-            power_off_server()
-    except Exception as e:
-        logging.error(f"Error during server shutdown: {e}")
-
     logging.info("File transfer script completed successfully.")
 
 # Run the script
@@ -0,0 +1,125 @@
+import os
+import time
+import socket
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import requests
+
+import Http_client
+
+"""__summary__
+This module waits for a host that is being powered on to become usable, instead of sleeping a fixed time.
+It first polls the Redfish PowerState (when a way to read it is given) until the server reports "On", then probes
+the services the jobs need (by default the SMB share, SSH and Plex) until each of them answers, all under one
+overall deadline. It returns as soon as everything answers and logs how long the boot took.
+A check is written as:
+    smb, ssh, plex           the well-known port of READY_HOST (445, 22, and http://READY_HOST:32400/identity)
+    tcp://host:port          a TCP connection is accepted
+    http://host:port/path    an HTTP answer below 500 (https works too)
+"""
+
+# Host that is woken, and the checks that must pass before it counts as ready
+READY_HOST = os.getenv("READY_HOST")
+READY_CHECKS = os.getenv("READY_CHECKS", "smb,ssh,plex")
+
+# Longest wait for the host, and seconds between rounds of checks
+READY_TIMEOUT = float(os.getenv("READY_TIMEOUT", 600))
+READY_POLL_INTERVAL = float(os.getenv("READY_POLL_INTERVAL", 2))
+
+# Longest wait for a single check
+CHECK_TIMEOUT = 3.0
+
+NAMED_CHECKS = {
+    "smb": "tcp://{host}:445",
+    "ssh": "tcp://{host}:22",
+    "plex": "http://{host}:32400/identity"
+}
+
+
+def parse_checks(spec=None, host=None):
+    """Turn a comma separated list of checks into URLs. Named checks need a host and are skipped without one."""
+    spec = READY_CHECKS if spec is None else spec
+    host = READY_HOST if host is None else host
+    checks = []
+    for item in (part.strip() for part in spec.split(",")):
+        if not item:
+            continue
+        if item.lower() in NAMED_CHECKS:
+            if host:
+                checks.append(NAMED_CHECKS[item.lower()].format(host=host))
+            continue
+        if urlsplit(item).scheme not in ("tcp", "http", "https"):
+            raise ValueError(f"Unsupported readiness check: {item}")
+        checks.append(item)
+    return checks
+
+
+def check(target, timeout=CHECK_TIMEOUT):
+    """Return True if a tcp:// target accepts a connection or an http(s):// target answers below 500."""
+    parts = urlsplit(target)
+    if parts.scheme == "tcp":
+        try:
+            with socket.create_connection((parts.hostname, parts.port), timeout=timeout):
+                return True
+        except OSError:
+            return False
+    try:
+        response = Http_client.get(target, timeout=timeout, retries=0, breaker=False, verify=False)
+    except requests.RequestException:
+        return False
+    return response.status_code < 500
+
+
+def wait_until_ready(checks, deadline=READY_TIMEOUT, interval=READY_POLL_INTERVAL, power_state=None,
+                     clock=time.monotonic, sleep=time.sleep):
+    """Wait until the host is on and every check passes, or the deadline (seconds) has passed.
+
+    power_state, when given, returns the Redfish PowerState; checks start once it is "On". Returns a dict with
+    ready, elapsed (seconds), powered_on (seconds until PowerState was "On", or None) and the seconds after
+    which each check first passed (None for checks that never did).
+    """
+    started = clock()
+    give_up_at = started + deadline
+    result = {"ready": False, "elapsed": None, "powered_on": None, "checks": {target: None for target in checks}}
+
+    if power_state is not None:
+        while True:
+            try:
+                state = power_state()
+            except Exception as e:
+                logging.debug(f"Could not read the power state: {e}")
+                state = None
+            if state == "On":
+                result["powered_on"] = clock() - started
+                break
+            if clock() + interval > give_up_at:
+                result["elapsed"] = clock() - started
+                logging.warning(f"Server did not report PowerState On within {deadline:.0f} seconds (last: {state}).")
+                return result
+            sleep(interval)
+
+    pending = list(checks)
+    with ThreadPoolExecutor(max_workers=max(1, len(pending))) as executor:
+        while pending:
+            round_started = clock()
+            timeout = max(0.1, min(CHECK_TIMEOUT, give_up_at - round_started))
+            passed = list(executor.map(lambda target: check(target, timeout), pending))
+            for target, ok in zip(list(pending), passed):
+                if ok:
+                    result["checks"][target] = clock() - started
+                    pending.remove(target)
+            if not pending:
+                break
+            wait = interval - (clock() - round_started)
+            if clock() + max(wait, 0) >= give_up_at:
+                result["elapsed"] = clock() - started
+                logging.warning(f"Host not ready after {result['elapsed']:.0f} seconds, still waiting on: {', '.join(pending)}")
+                return result
+            if wait > 0:
+                sleep(wait)
+
+    result["ready"] = True
+    result["elapsed"] = clock() - started
+    return result
@@ -0,0 +1,215 @@
+import os
+import time
+import random
+import threading
+from collections import deque
+from email.utils import parsedate_to_datetime
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+from dotenv import load_dotenv
+
+from Service_health import ServiceUnavailable, registry, service_key
+
+"""__summary__
+This module is the HTTP client used by every script that talks to a service (Radarr, Sonarr, Plex, Overseerr,
+the iDRAC Redfish API).
+    - one keep-alive requests.Session per host, with a bounded connection pool, so repeated calls reuse connections
+    - default connect and read timeouts on every request
+    - retries with jittered exponential backoff for connection errors, timeouts, 429 and 5xx responses, waiting as
+      long as a Retry-After header asks; POST is only retried when the call is idempotent or was never sent
+    - every attempt goes through the service's circuit breaker (see Service_health)
+    - per-host timing metrics: requests, attempts, retries, errors and latency percentiles
+"""
+
+load_dotenv()
+
+CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", 5))
+READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", 30))
+
+# Connections kept open per host
+POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", 10))
+
+# Retries after the first attempt, and the backoff: a random wait of up to BACKOFF * 2^n seconds, at most MAX_BACKOFF
+MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", 3))
+BACKOFF = float(os.getenv("HTTP_BACKOFF", 0.5))
+MAX_BACKOFF = float(os.getenv("HTTP_MAX_BACKOFF", 30))
+
+RETRY_STATUS = frozenset({429, 500, 502, 503, 504})
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+
+# Latency samples kept per host for the percentiles
+LATENCY_SAMPLES = 1000
+
+_sessions = {}
+_metrics = {}
+_lock = threading.Lock()
+
+
+def session_for(url):
+    """Return the keep-alive session for a URL's host, creating it on first use."""
+    key = service_key(url)
+    with _lock:
+        session = _sessions.get(key)
+        if session is None:
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE, max_retries=0)
+            session = _sessions[key] = requests.Session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+        return session
+
+
+def close_sessions():
+    with _lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+
+def retry_after(response):
+    """Seconds a Retry-After header asks to wait (either delay-seconds or an HTTP date), or None."""
+    value = response.headers.get("Retry-After") if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt, backoff=BACKOFF, max_backoff=MAX_BACKOFF, response=None):
+    """Wait before retry number attempt (0 based): full jitter over the exponential backoff, or Retry-After."""
+    requested = retry_after(response)
+    if requested is not None:
+        return min(requested, max_backoff)
+    return random.uniform(0, min(max_backoff, backoff * 2 ** attempt))
+
+
+def _never_sent(error):
+    """True when a connection error happened before the request reached the server, so it is safe to resend."""
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+def _record(key, latency_ms=None, retry=False, error=False, new_request=False):
+    with _lock:
+        stats = _metrics.get(key)
+        if stats is None:
+            stats = _metrics[key] = {
+                "requests": 0, "attempts": 0, "retries": 0, "errors": 0, "total_ms": 0.0,
+                "latencies": deque(maxlen=LATENCY_SAMPLES)
+            }
+        stats["requests"] += new_request
+        stats["retries"] += retry
+        stats["errors"] += error
+        if latency_ms is not None:
+            stats["attempts"] += 1
+            stats["total_ms"] += latency_ms
+            stats["latencies"].append(latency_ms)
+
+
+def _percentile(ordered, pct):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def metrics(url=None):
+    """Timing metrics for the host of url, or for every host (keyed by host) when url is None."""
+    with _lock:
+        keys = [service_key(url)] if url else list(_metrics)
+        result = {}
+        for key in keys:
+            stats = _metrics.get(key)
+            if stats is None:
+                result[key] = {"requests": 0, "attempts": 0, "retries": 0, "errors": 0, "mean_ms": None,
+                               "p50_ms": None, "p95_ms": None, "p99_ms": None}
+                continue
+            ordered = sorted(stats["latencies"])
+            result[key] = {
+                "requests": stats["requests"],
+                "attempts": stats["attempts"],
+                "retries": stats["retries"],
+                "errors": stats["errors"],
+                "mean_ms": stats["total_ms"] / stats["attempts"] if stats["attempts"] else None,
+                "p50_ms": _percentile(ordered, 50),
+                "p95_ms": _percentile(ordered, 95),
+                "p99_ms": _percentile(ordered, 99)
+            }
+    return result[keys[0]] if url else result
+
+
+def reset_metrics():
+    with _lock:
+        _metrics.clear()
+
+
+def request(method, url, timeout=None, retries=None, backoff=None, idempotent=None, breaker=True, **kwargs):
+    """Send a request over the host's pooled session, retrying failures with jittered exponential backoff.
+
+    Returns the final response, which may still be an error status once the retries are used up; connection
+    errors are raised after the last attempt. idempotent defaults to True for every method except POST and
+    PATCH, which are then only retried on a 429 or when the request never reached the server. With breaker,
+    every attempt goes through the service's circuit breaker and ServiceUnavailable is raised when it is open.
+    """
+    method = method.upper()
+    key = service_key(url)
+    timeout = (CONNECT_TIMEOUT, READ_TIMEOUT) if timeout is None else timeout
+    retries = MAX_RETRIES if retries is None else retries
+    backoff = BACKOFF if backoff is None else backoff
+    idempotent = method in IDEMPOTENT_METHODS if idempotent is None else idempotent
+    session = session_for(url)
+    health = registry() if breaker else None
+    _record(key, new_request=True)
+
+    attempt = 0
+    while True:
+        if health is not None and not health.allow(key):
+            raise ServiceUnavailable(key, health.retry_at(key))
+        started = time.monotonic()
+        response = error = None
+        try:
+            response = session.request(method, url, timeout=timeout, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            error = e
+        latency_ms = (time.monotonic() - started) * 1000
+        failed = error is not None or response.status_code >= 500
+        _record(key, latency_ms, error=failed or response.status_code >= 400)
+        if health is not None:
+            if failed:
+                health.record_failure(key, error or f"HTTP {response.status_code}", latency_ms)
+            else:
+                health.record_success(key, latency_ms)
+
+        retryable = (
+            (error is not None and (idempotent or _never_sent(error)))
+            or (response is not None and response.status_code in RETRY_STATUS and (idempotent or response.status_code == 429))
+        )
+        if not retryable or attempt >= retries:
+            if error is not None:
+                raise error
+            return response
+        delay = backoff_delay(attempt, backoff, response=response)
+        if response is not None:
+            response.close()
+        attempt += 1
+        _record(key, retry=True)
+        time.sleep(delay)
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
+
+
+def delete(url, **kwargs):
+    return request("DELETE", url, **kwargs)
@@ -1,10 +1,14 @@
 import os
-import time
 import logging
 from dotenv import load_dotenv
+from Log_setup import LOG_COMPRESSION, LOG_MAX_AGE_HOURS, setup_logging
+from Log_rotation import apply_retention
 
 """__summary__
-This script is used to clean up the log files in a specified directory, keeping only the current log file.
+This script applies the log retention policy to the log files in LOG_PATH.
+Finished log segments left uncompressed by earlier runs are compressed, then the oldest segments of each script
+are deleted once the script's logs exceed LOG_RETENTION_MB in total or LOG_RETENTION_FILES segments, or are
+older than LOG_RETENTION_DAYS. Segments that are still being written are left alone.
 It logs the process and the files that are deleted.
 """
 
@@ -15,16 +19,6 @@ load_dotenv()
 LOG_PATH = os.getenv("LOG_PATH")
 LOG_LEVEL = os.getenv("LOG_LEVEL", "DEBUG").upper()
 
-# Map the log level string to actual logging levels
-LOG_LEVEL_MAPPING = {
-    'CRITICAL': logging.CRITICAL,
-    'ERROR': logging.ERROR,
-    'WARNING': logging.WARNING,
-    'INFO': logging.INFO,
-    'DEBUG': logging.DEBUG,
-    'NOTSET': logging.NOTSET
-}
-
 required_env_vars = ["LOG_LEVEL", "LOG_PATH"]
 missing_vars = [var for var in required_env_vars if not os.getenv(var)]
 
@@ -35,32 +29,33 @@ if missing_vars:
 if not LOG_PATH or not os.path.isdir(LOG_PATH):
     raise ValueError(f"Invalid LOG_PATH: {LOG_PATH}. Please set a valid path in your .env file.")
 
-# Default to DEBUG if the provided LOG_LEVEL isn't valid
-log_level = LOG_LEVEL_MAPPING.get(LOG_LEVEL, logging.DEBUG)
+# Setup Logging, through a queue to this script's own log file
+current_log_file = os.path.basename(setup_logging("log_clear", LOG_PATH, LOG_LEVEL))
 
-# Setup Logging
-logging.basicConfig(
-    filename=f"{LOG_PATH}/directory_cleanup_log_{time.strftime('%Y-%m-%d_%H-%M-%S')}.log",
-    level=log_level,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
-)
+# Retention limits per script, 0 disables a limit
+LOG_RETENTION_MB = float(os.getenv("LOG_RETENTION_MB", 500))
+LOG_RETENTION_FILES = int(os.getenv("LOG_RETENTION_FILES", 30))
+LOG_RETENTION_DAYS = float(os.getenv("LOG_RETENTION_DAYS", 0))
 
 # Log the start of the cleanup process
 logging.info("Starting log cleanup process...")
 
-# Function to clean up old log files except the current one
+# Function to compress and expire old log segments, never touching the current log file
 def cleanup_logs():
-    for filename in os.listdir(LOG_PATH):
-        file_path = os.path.join(LOG_PATH, filename)
-        
-        # Check if it's a file and not the current log file
-        if os.path.isfile(file_path) and filename != current_log_file:
-            try:
-                os.remove(file_path)
-                logging.info(f"Deleted old log file: {filename}")
-            except Exception as e:
-                logging.error(f"Failed to delete {filename}: {e}")
+    result = apply_retention(
+        LOG_PATH,
+        max_bytes=int(LOG_RETENTION_MB * 1024 * 1024),
+        max_files=LOG_RETENTION_FILES,
+        max_age_days=LOG_RETENTION_DAYS,
+        compression=LOG_COMPRESSION,
+        max_age=LOG_MAX_AGE_HOURS * 3600,
+        exclude={current_log_file}
+    )
+    logging.info(
+        f"Compressed {result['compressed']} log segments, deleted {result['deleted']} "
+        f"({result['bytes_freed'] / (1024 ** 2):.2f} MB freed)"
+    )
+    return result
 
 def main():
     # Perform the log cleanup
@@ -0,0 +1,430 @@
+import os
+import re
+import gzip
+import json
+import time
+import shutil
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+"""__summary__
+This module rotates, compresses and expires the log files written through Log_setup.
+A script's log is split into segments named {script}_log_{timestamp}.log. The handler starts a new segment when the
+current one reaches a size or age limit; the finished segment is compressed (gzip, or zstd when the zstandard
+package is installed) by a background thread, so the thread writing log records only ever closes and opens a file.
+Every finished segment is recorded in log_index.jsonl in LOG_PATH with the time range it covers, which lets log
+search skip segments outside a query without opening them. Segments are compressed in independent frames of about
+1 MiB and the index lists the first timestamp of each frame, so a search can start decompressing near the time it
+is looking for. apply_retention, run by Log_clear, compresses segments
+left behind by earlier runs and deletes the oldest segments of each script beyond a total size or count.
+"""
+
+INDEX_FILE = "log_index.jsonl"
+
+SEGMENT_PATTERN = re.compile(
+    r"^(?P<script>.+?)_log_(?P<ts>\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2})(?:_(?P<seq>\d+))?\.log(?:\.(?P<compression>gz|zst))?$"
+)
+TIMESTAMP_FORMAT = "%Y-%m-%d_%H-%M-%S"
+
+# Line timestamps: Log_setup text format, Log_setup JSON lines format, rclone's own log format
+LINE_TIME_PATTERN = re.compile(
+    rb'^(?:(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}) - |\{"ts": "(\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2})|(\d{4}/\d{2}/\d{2} \d{2}:\d{2}:\d{2}) )'
+)
+
+# Raw bytes per independently compressed frame of a rotated segment
+COMPRESSION_FRAME_SIZE = 1024 * 1024
+COMPRESSION_SUFFIXES = {"gzip": ".gz", "zstd": ".zst"}
+
+# Uncompressed segments that are not marked closed are only treated as finished once they are this much older
+# than the rotation age, so a segment that is still being written is never compressed underneath its writer.
+# Without age rotation a writer may keep one segment open for any length of time, so unclosed segments are then
+# never treated as finished (a segment left by a killed process stays uncompressed).
+ACTIVE_GRACE_SECONDS = 300
+
+_index_lock = threading.Lock()
+_compressor = None
+_compressor_lock = threading.Lock()
+_pending = []
+
+
+def parse_segment_name(name):
+    """Return {"script", "start", "compression"} for a log segment file name, or None if it is not one."""
+    match = SEGMENT_PATTERN.match(name)
+    if not match:
+        return None
+    return {
+        "script": match.group("script"),
+        "start": time.mktime(time.strptime(match.group("ts"), TIMESTAMP_FORMAT)),
+        "compression": match.group("compression")
+    }
+
+
+def new_segment_path(script_name, log_path):
+    """Path for a new segment, with a sequence suffix if a segment was already started in the same second."""
+    base = f"{script_name}_log_{time.strftime(TIMESTAMP_FORMAT)}"
+    path = os.path.join(log_path, f"{base}.log")
+    seq = 1
+    while any(os.path.exists(path + suffix) for suffix in ("", ".gz", ".zst")):
+        path = os.path.join(log_path, f"{base}_{seq}.log")
+        seq += 1
+    return path
+
+
+def compression_method(method):
+    """Resolve the configured compression, falling back to gzip when zstandard is not installed."""
+    method = (method or "gzip").lower()
+    if method == "zstd" and zstandard is None:
+        logging.warning("LOG_COMPRESSION=zstd but the zstandard package is not installed, using gzip")
+        return "gzip"
+    if method not in COMPRESSION_SUFFIXES and method != "none":
+        logging.warning(f"Unknown LOG_COMPRESSION {method}, using gzip")
+        return "gzip"
+    return method
+
+
+class _GzipSegment(gzip.GzipFile):
+    """GzipFile that also closes the underlying file, which GzipFile leaves open when given a fileobj."""
+
+    def __init__(self, raw):
+        super().__init__(fileobj=raw, mode="rb")
+        self._raw = raw
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            self._raw.close()
+
+
+def open_segment(path, offset=0):
+    """Open a log segment for reading as binary, decompressing transparently.
+    For compressed segments offset must be the start of a frame."""
+    raw = open(path, "rb")
+    raw.seek(offset)
+    if path.endswith(".gz"):
+        return _GzipSegment(raw)
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raw.close()
+            raise RuntimeError(f"Cannot read {path}: the zstandard package is not installed")
+        return zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True, closefd=True)
+    return raw
+
+
+def line_time_key(line):
+    """Return the timestamp of a log line as b"YYYY-mm-dd HH:MM:SS" (local time), or None for continuation lines.
+
+    The keys of the text, JSON lines and rclone formats compare in time order as plain bytes.
+    """
+    match = LINE_TIME_PATTERN.match(line)
+    if not match:
+        return None
+    key = match.group(1) or match.group(2) or match.group(3)
+    return key.replace(b"/", b"-").replace(b"T", b" ")
+
+
+def _frame_key(chunk, previous_key):
+    for line in chunk.split(b"\n", 16)[:16]:
+        key = line_time_key(line)
+        if key:
+            return key
+    return previous_key
+
+
+def compress_file(path, method):
+    """Compress a file next to itself in independent frames and remove the original.
+
+    Each frame holds about COMPRESSION_FRAME_SIZE bytes of whole lines, so a reader can start decompressing at any
+    frame. Returns the compressed path and the frames as [first timestamp key, compressed offset] pairs.
+    """
+    target = path + COMPRESSION_SUFFIXES[method]
+    tmp_target = target + ".tmp"
+    frames = []
+    key = None
+    compressor = zstandard.ZstdCompressor(level=3) if method == "zstd" else None
+    with open(path, "rb") as source, open(tmp_target, "wb") as destination:
+        remainder = b""
+        while True:
+            block = source.read(COMPRESSION_FRAME_SIZE)
+            data = remainder + block
+            if not data:
+                break
+            cut = data.rfind(b"\n") + 1 if block else len(data)
+            if cut == 0:
+                # A single line longer than a frame, keep reading until it ends
+                remainder = data
+                continue
+            chunk, remainder = data[:cut], data[cut:]
+            key = _frame_key(chunk, key)
+            frames.append([key.decode() if key else None, destination.tell()])
+            destination.write(compressor.compress(chunk) if compressor else gzip.compress(chunk, compresslevel=6))
+    shutil.copystat(path, tmp_target)
+    os.replace(tmp_target, target)
+    os.remove(path)
+    return target, frames
+
+
+def append_index(log_path, entry):
+    """Record a segment in the index. The latest record for a file wins."""
+    with _index_lock, open(os.path.join(log_path, INDEX_FILE), "a") as index:
+        index.write(json.dumps(entry) + "\n")
+
+
+def read_index(log_path):
+    """Return {file name: entry} for the segments recorded in the index."""
+    entries = {}
+    try:
+        with open(os.path.join(log_path, INDEX_FILE), "r") as index:
+            for line in index:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                entries[entry["file"]] = entry
+    except FileNotFoundError:
+        pass
+    return entries
+
+
+def _segment_entry(path, closed, start=None):
+    info = parse_segment_name(os.path.basename(path))
+    stat = os.stat(path)
+    return {
+        "file": os.path.basename(path),
+        "script": info["script"],
+        "start": start if start is not None else info["start"],
+        "end": stat.st_mtime,
+        "size": stat.st_size,
+        "compression": info["compression"],
+        "closed": closed
+    }
+
+
+def record_finished_segment(path, start=None):
+    """Mark a segment that its writer has closed as finished, so retention may compress it."""
+    append_index(os.path.dirname(path), _segment_entry(path, True, start))
+
+
+def _compress_segment(path, log_path, method, start):
+    try:
+        raw_size = os.path.getsize(path)
+        compressed, frames = compress_file(path, method)
+        entry = _segment_entry(compressed, True, start)
+        entry["raw_size"] = raw_size
+        entry["frames"] = frames
+        append_index(log_path, entry)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logging.getLogger(__name__).error(f"Failed to compress log segment {path}: {e}")
+
+
+def schedule_compression(path, log_path, method, start=None):
+    """Compress a finished segment on the background compressor thread."""
+    global _compressor
+    with _compressor_lock:
+        if _compressor is None:
+            _compressor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="log-compress")
+        _pending[:] = [future for future in _pending if not future.done()]
+        _pending.append(_compressor.submit(_compress_segment, path, log_path, method, start))
+
+
+def wait_for_compression():
+    """Block until all scheduled compressions have finished."""
+    with _compressor_lock:
+        pending = _pending[:]
+        _pending.clear()
+    for future in pending:
+        future.result()
+
+
+class RotatingLogHandler(logging.FileHandler):
+    """File handler that starts a new segment by size or age and compresses finished segments in the background."""
+
+    def __init__(self, script_name, log_path, max_bytes=0, max_age=0, compression="gzip"):
+        self.script_name = script_name
+        self.log_path = log_path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.compression = compression_method(compression)
+        self.opened_at = time.time()
+        super().__init__(new_segment_path(script_name, log_path))
+        self.bytes_written = 0
+
+    def _open(self):
+        stream = super()._open()
+        stat = os.fstat(stream.fileno())
+        self._file_id = (stat.st_dev, stat.st_ino)
+        return stream
+
+    def _segment_removed(self):
+        """True if the open segment was removed or replaced on disk, e.g. compressed by Log_clear."""
+        try:
+            stat = os.stat(self.baseFilename)
+        except FileNotFoundError:
+            return True
+        return (stat.st_dev, stat.st_ino) != self._file_id
+
+    def emit(self, record):
+        try:
+            message = self.format(record) + self.terminator
+            if self.stream is None:
+                self.stream = self._open()
+            if self._segment_removed():
+                # Keep writing to a file that exists instead of an unlinked inode
+                self.stream.close()
+                self.opened_at = time.time()
+                self.baseFilename = new_segment_path(self.script_name, self.log_path)
+                self.stream = self._open()
+                self.bytes_written = 0
+            elif self._should_rollover():
+                self.rollover()
+            self.stream.write(message)
+            self.flush()
+            self.bytes_written += len(message)
+        except Exception:
+            self.handleError(record)
+
+    def _should_rollover(self):
+        if self.max_bytes and self.bytes_written >= self.max_bytes:
+            return True
+        return bool(self.max_age) and time.time() - self.opened_at >= self.max_age
+
+    def rollover(self):
+        """Close the current segment, hand it to the compressor and continue in a new one."""
+        finished, started = self.baseFilename, self.opened_at
+        self.stream.close()
+        self.opened_at = time.time()
+        self.baseFilename = new_segment_path(self.script_name, self.log_path)
+        self.stream = self._open()
+        self.bytes_written = 0
+        if self.compression == "none":
+            record_finished_segment(finished, started)
+        else:
+            schedule_compression(finished, self.log_path, self.compression, started)
+
+    def close(self):
+        """Close the last segment and mark it finished in the index; Log_clear compresses it later."""
+        self.acquire()
+        try:
+            stream_was_open = self.stream is not None
+            super().close()
+            if stream_was_open and os.path.exists(self.baseFilename):
+                record_finished_segment(self.baseFilename, self.opened_at)
+        finally:
+            self.release()
+
+
+def list_segments(log_path, script=None, start=None, end=None):
+    """Return the segments in log_path, oldest first, optionally for one script and overlapping [start, end].
+
+    Time ranges come from the index; segments not in the index (still being written, or written by
+    something other than Log_setup) cover their name's timestamp up to their modification time.
+    """
+    index = read_index(log_path)
+    segments = []
+    for name in os.listdir(log_path):
+        info = parse_segment_name(name)
+        if info is None or (script and info["script"] != script):
+            continue
+        path = os.path.join(log_path, name)
+        entry = index.get(name)
+        if entry is None:
+            try:
+                entry = _segment_entry(path, False)
+            except OSError:
+                continue
+        if start is not None and entry["end"] < start:
+            continue
+        if end is not None and entry["start"] > end:
+            continue
+        segments.append(dict(entry, path=path))
+    segments.sort(key=lambda segment: (segment["start"], segment["file"]))
+    return segments
+
+
+def _is_finished(segment, max_age, now):
+    if segment["compression"] or segment.get("closed"):
+        return True
+    # Not closed by its writer: either still being written, or left behind by a process that was killed
+    if not max_age or now - segment["end"] < ACTIVE_GRACE_SECONDS:
+        return False
+    return now - segment["start"] > max_age + ACTIVE_GRACE_SECONDS
+
+
+def apply_retention(log_path, max_bytes=0, max_files=0, max_age_days=0, compression="gzip", max_age=0,
+                    exclude=(), now=None):
+    """Compress finished segments, then delete the oldest segments of each script past the retention limits.
+
+    max_bytes and max_files apply per script to finished segments, max_age_days to all of them; 0 disables a
+    limit. max_age is the rotation age, used to recognise segments abandoned by killed processes. Files in
+    exclude (names) are never touched. Returns {"compressed", "deleted", "bytes_freed"} counts.
+    """
+    now = now or time.time()
+    compression = compression_method(compression)
+    result = {"compressed": 0, "deleted": 0, "bytes_freed": 0}
+
+    by_script = {}
+    for segment in list_segments(log_path):
+        if segment["file"] in exclude or not _is_finished(segment, max_age, now):
+            continue
+        if not segment["compression"] and compression != "none":
+            try:
+                raw_size = os.path.getsize(segment["path"])
+                compressed, frames = compress_file(segment["path"], compression)
+            except OSError as e:
+                logging.error(f"Failed to compress log segment {segment['path']}: {e}")
+            else:
+                segment = dict(
+                    _segment_entry(compressed, True, segment["start"]), path=compressed, raw_size=raw_size, frames=frames
+                )
+                result["compressed"] += 1
+        by_script.setdefault(segment["script"], []).append(segment)
+
+    kept = []
+    for script, segments in by_script.items():
+        total = 0
+        # Newest first, so the most recent history is what stays within the limits
+        for position, segment in enumerate(sorted(segments, key=lambda s: s["start"], reverse=True)):
+            total += segment["size"]
+            expired = (
+                (max_files and position >= max_files)
+                or (max_bytes and total > max_bytes)
+                or (max_age_days and now - segment["end"] > max_age_days * 86400)
+            )
+            if not expired:
+                kept.append(segment)
+                continue
+            try:
+                os.remove(segment["path"])
+                result["deleted"] += 1
+                result["bytes_freed"] += segment["size"]
+                logging.info(f"Deleted old log segment: {segment['file']}")
+            except OSError as e:
+                logging.error(f"Failed to delete {segment['file']}: {e}")
+                kept.append(segment)
+
+    _rewrite_index(log_path, kept)
+    return result
+
+
+def _rewrite_index(log_path, finished):
+    """Compact the index to the finished segments that still exist, keeping entries appended meanwhile."""
+    with _index_lock:
+        current = read_index(log_path)
+        entries = {segment["file"]: {k: v for k, v in segment.items() if k != "path"} for segment in finished}
+        for name, entry in current.items():
+            if name not in entries and os.path.exists(os.path.join(log_path, name)):
+                entries[name] = entry
+        index_path = os.path.join(log_path, INDEX_FILE)
+        tmp_path = index_path + ".tmp"
+        with open(tmp_path, "w") as index:
+            for entry in sorted(entries.values(), key=lambda e: e["start"]):
+                index.write(json.dumps(entry) + "\n")
+        os.replace(tmp_path, index_path)
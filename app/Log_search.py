@@ -0,0 +1,268 @@
+import os
+import json
+import time
+import threading
+from datetime import datetime
+
+from Log_rotation import line_time_key, list_segments, open_segment
+
+"""__summary__
+This module searches and tails the log segments written through Log_setup and Log_rotation, for the Flask app.
+Searches are narrowed in three steps so that only the part of the logs inside the requested time range is read:
+    1. segments whose time range (from log_index.jsonl) does not overlap the query are skipped without opening them
+    2. compressed segments are entered at the frame whose first timestamp precedes the query start
+    3. uncompressed segments are entered by binary search on byte offsets, since lines are written in time order;
+       the offsets found are kept as a sparse timestamp -> offset index per file
+Matching records are filtered by level and text, and multi-line records (tracebacks) are returned whole.
+tail() follows the newest segment of a script and moves on to the next segment when the log is rotated.
+"""
+
+LEVELS = {"DEBUG": 10, "INFO": 20, "NOTICE": 25, "WARNING": 30, "ERROR": 40, "CRITICAL": 50}
+
+# Binary search stops once the window is this small, the rest is scanned
+SEEK_WINDOW = 64 * 1024
+
+DEFAULT_LIMIT = 500
+
+_sparse_index = {}
+_sparse_index_lock = threading.Lock()
+
+
+def time_key(value):
+    """Convert an epoch timestamp, an ISO 8601 string or a datetime into a timestamp key (b"YYYY-mm-dd HH:MM:SS")."""
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        value = datetime.fromtimestamp(value)
+    elif isinstance(value, str):
+        try:
+            value = datetime.fromtimestamp(float(value))
+        except ValueError:
+            value = datetime.fromisoformat(value)
+        if value.tzinfo is not None:
+            value = value.astimezone().replace(tzinfo=None)
+    return value.strftime("%Y-%m-%d %H:%M:%S").encode()
+
+
+def _epoch(key):
+    return time.mktime(time.strptime(key.decode(), "%Y-%m-%d %H:%M:%S"))
+
+
+def parse_record(line):
+    """Return (timestamp key, level, message) for the first line of a record, or None for a continuation line."""
+    key = line_time_key(line)
+    if key is None:
+        return None
+    text = line.decode("utf-8", errors="replace").rstrip("\r\n")
+    if text.startswith("{"):
+        try:
+            entry = json.loads(text)
+            return key, entry.get("level", ""), entry.get("msg", "")
+        except ValueError:
+            return key, "", text
+    if text[19:22] == " - ":
+        # 2024-01-01 12:00:00 - INFO - message
+        level, _, message = text[22:].partition(" - ")
+        return key, level, message
+    # rclone: 2024/01/01 12:00:00 INFO  : message
+    level, _, message = text[20:].partition(":")
+    return key, level.strip(), message.strip()
+
+
+def _first_key_after(file, offset):
+    """Timestamp key of the first complete record at or after offset in an uncompressed file."""
+    file.seek(offset)
+    if offset:
+        file.readline()
+    for _ in range(64):
+        line = file.readline()
+        if not line:
+            return None
+        key = line_time_key(line)
+        if key:
+            return key
+    return None
+
+
+def _seek_plain(path, file, start_key):
+    """Return an offset in an uncompressed segment at or before the first record with a key >= start_key."""
+    size = os.fstat(file.fileno()).st_size
+    with _sparse_index_lock:
+        cached = _sparse_index.get(path)
+        # Offsets stay valid while the file only grows, a smaller file means it was replaced
+        probes = cached[1] if cached and cached[0] <= size else {}
+        _sparse_index[path] = (size, probes)
+
+    lo, hi = 0, size
+    for offset in sorted(probes):
+        if probes[offset] is not None and probes[offset] < start_key:
+            lo = max(lo, offset)
+        elif offset > lo:
+            hi = min(hi, offset)
+    while hi - lo > SEEK_WINDOW:
+        mid = (lo + hi) // 2
+        key = probes.get(mid) if mid in probes else _first_key_after(file, mid)
+        probes[mid] = key
+        if key is not None and key < start_key:
+            lo = mid
+        else:
+            hi = mid
+    return lo
+
+
+def _seek_frames(frames, start_key):
+    """Return the compressed offset of the last frame that starts before start_key."""
+    offset = 0
+    for key, frame_offset in frames:
+        if key is not None and key.encode() >= start_key:
+            break
+        offset = frame_offset
+    return offset
+
+
+def _records(stream, skip_partial):
+    """Yield (key, level, lines) records from a binary stream, joining continuation lines to their record."""
+    record = None
+    if skip_partial:
+        stream.readline()
+    for line in stream:
+        parsed = parse_record(line)
+        if parsed is None:
+            if record is not None:
+                record[2].append(line.decode("utf-8", errors="replace").rstrip("\r\n"))
+            continue
+        if record is not None:
+            yield record
+        record = (parsed[0], parsed[1], [line.decode("utf-8", errors="replace").rstrip("\r\n")])
+    if record is not None:
+        yield record
+
+
+def _open_at(segment, start_key):
+    """Open a segment positioned near the first record at or after start_key. Returns (stream, skip_partial)."""
+    path = segment["path"]
+    if segment.get("compression"):
+        offset = _seek_frames(segment.get("frames") or [], start_key) if start_key else 0
+        return open_segment(path, offset), False
+    file = open(path, "rb")
+    offset = _seek_plain(path, file, start_key) if start_key else 0
+    file.seek(offset)
+    return file, offset > 0
+
+
+def search_logs(log_path, script=None, start=None, end=None, level=None, text=None, limit=DEFAULT_LIMIT):
+    """Search log records by time range, minimum level and case-insensitive text.
+
+    start and end accept epoch seconds, ISO 8601 strings or datetimes. Returns a dict with the matching records
+    (oldest first, at most limit), whether the limit was hit, and how many segments were read.
+    """
+    started = time.monotonic()
+    start_key, end_key = time_key(start), time_key(end)
+    if level and level.upper() not in LEVELS:
+        raise ValueError(f"Unknown level {level!r}, expected one of {', '.join(LEVELS)}")
+    min_level = LEVELS[level.upper()] if level else 0
+    needle = text.lower() if text else None
+
+    segments = list_segments(
+        log_path, script,
+        start=_epoch(start_key) - 1 if start_key else None,
+        end=_epoch(end_key) + 1 if end_key else None
+    )
+    results, truncated, segments_read = [], False, 0
+    for segment in segments:
+        segments_read += 1
+        stream, skip_partial = _open_at(segment, start_key)
+        with stream:
+            for key, record_level, lines in _records(stream, skip_partial):
+                if start_key and key < start_key:
+                    continue
+                if end_key and key > end_key:
+                    break
+                if min_level and LEVELS.get(record_level.upper(), 0) < min_level:
+                    continue
+                message = "\n".join(lines)
+                if needle and needle not in message.lower():
+                    continue
+                if len(results) >= limit:
+                    truncated = True
+                    break
+                results.append({
+                    "time": key.decode(),
+                    "level": record_level,
+                    "script": segment["script"],
+                    "file": segment["file"],
+                    "line": message
+                })
+        if truncated:
+            break
+    return {
+        "results": results,
+        "truncated": truncated,
+        "segments_read": segments_read,
+        "elapsed": time.monotonic() - started
+    }
+
+
+def _last_lines(file, count):
+    """Return the last count lines of an uncompressed file, reading backwards in blocks."""
+    size = file.seek(0, os.SEEK_END)
+    data, position = b"", size
+    while position > 0 and data.count(b"\n") <= count:
+        step = min(SEEK_WINDOW, position)
+        position -= step
+        file.seek(position)
+        data = file.read(step) + data
+    file.seek(size)
+    return [line.decode("utf-8", errors="replace") for line in data.splitlines()[-count:]] if count else []
+
+
+def _current_segment(log_path, script):
+    segments = [segment for segment in list_segments(log_path, script) if not segment.get("compression")]
+    return segments[-1]["path"] if segments else None
+
+
+def tail(log_path, script, lines=50, poll_interval=1.0, idle_timeout=None, stop_event=None):
+    """Yield the last lines of a script's current log, then new lines as they are written.
+
+    When the log rotates the new segment is followed from its start. Yields None after every idle poll so a
+    caller can send keep-alives. Stops when stop_event is set or after idle_timeout seconds without new lines.
+    """
+    path = _current_segment(log_path, script)
+    if path is None:
+        return
+    file = open(path, "rb")
+    try:
+        yield from _last_lines(file, lines)
+        buffer = b""
+        idle_since = time.monotonic()
+        while not (stop_event and stop_event.is_set()):
+            data = file.read()
+            if data:
+                buffer += data
+                *complete, buffer = buffer.split(b"\n")
+                for line in complete:
+                    yield line.decode("utf-8", errors="replace")
+                idle_since = time.monotonic()
+                continue
+
+            newest = _current_segment(log_path, script)
+            if newest and newest != path:
+                # Rotated: finish the old segment and continue with the new one from the start
+                buffer += file.read()
+                *complete, buffer = buffer.split(b"\n")
+                for line in complete:
+                    yield line.decode("utf-8", errors="replace")
+                if buffer:
+                    yield buffer.decode("utf-8", errors="replace")
+                    buffer = b""
+                file.close()
+                path = newest
+                file = open(path, "rb")
+                continue
+
+            if idle_timeout is not None and time.monotonic() - idle_since >= idle_timeout:
+                return
+            yield None
+            time.sleep(poll_interval)
+    finally:
+        file.close()
@@ -0,0 +1,164 @@
+import os
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from Log_rotation import RotatingLogHandler, wait_for_compression
+
+"""__summary__
+This module sets up logging the same way for every script.
+Records are put on an in-memory queue by the calling thread and written to the log file by a single background
+listener thread, so worker threads never wait on file I/O or the handler lock. Each script writes to its own
+file ({script}_log_{timestamp}.log in LOG_PATH), as plain text or, with LOG_FORMAT=json, as JSON lines.
+The file is rotated by size and age and finished segments are compressed in the background (see Log_rotation).
+RateLimitedLog keeps per-file messages from hot loops in check: a few messages per interval are logged for
+each kind of event, the rest are only counted and reported as periodic totals.
+"""
+
+# Map the log level string to actual logging levels
+LOG_LEVEL_MAPPING = {
+    'CRITICAL': logging.CRITICAL,
+    'ERROR': logging.ERROR,
+    'WARNING': logging.WARNING,
+    'INFO': logging.INFO,
+    'DEBUG': logging.DEBUG,
+    'NOTSET': logging.NOTSET
+}
+
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Rotation limits for a script's log file, 0 disables a limit
+LOG_MAX_SIZE_MB = float(os.getenv("LOG_MAX_SIZE_MB", 50))
+LOG_MAX_AGE_HOURS = float(os.getenv("LOG_MAX_AGE_HOURS", 24))
+
+# Compression of rotated segments: gzip, zstd (needs the zstandard package) or none
+LOG_COMPRESSION = os.getenv("LOG_COMPRESSION", "gzip")
+
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats a record as one JSON object per line."""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).astimezone().isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "msg": record.getMessage()
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+def setup_logging(script_name, log_path=None, level=None, log_format=None, default_level=logging.DEBUG):
+    """Route the root logger through a queue to a per-script log file. Returns the path of the first segment.
+
+    log_path, level and log_format default to the LOG_PATH, LOG_LEVEL and LOG_FORMAT ("text" or "json")
+    environment variables; default_level is used when the level name is not valid. Calling it again replaces
+    the previous setup.
+    """
+    global _listener
+    log_path = log_path or os.getenv("LOG_PATH")
+    level = LOG_LEVEL_MAPPING.get((level or os.getenv("LOG_LEVEL", "DEBUG")).upper(), default_level)
+    log_format = (log_format or os.getenv("LOG_FORMAT", "text")).lower()
+
+    file_handler = RotatingLogHandler(
+        script_name, log_path,
+        max_bytes=int(LOG_MAX_SIZE_MB * 1024 * 1024),
+        max_age=LOG_MAX_AGE_HOURS * 3600,
+        compression=LOG_COMPRESSION
+    )
+    log_file = file_handler.baseFilename
+    if log_format == "json":
+        file_handler.setFormatter(JsonFormatter())
+    else:
+        file_handler.setFormatter(logging.Formatter(TEXT_FORMAT, DATE_FORMAT))
+
+    stop_logging()
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+        handler.close()
+    root.addHandler(QueueHandler(log_queue))
+    root.setLevel(level)
+
+    _listener = QueueListener(log_queue, file_handler, respect_handler_level=True)
+    _listener.start()
+    return log_file
+
+
+def stop_logging():
+    """Flush queued records to disk and stop the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+    wait_for_compression()
+
+
+atexit.register(stop_logging)
+
+
+class RateLimitedLog:
+    """Logs at most `limit` messages per `interval` seconds for each kind of event and counts every event.
+
+    Suppressed events are still counted; whenever an interval ends a one line summary of the counts is logged,
+    and summary() logs the totals at the end of a run.
+    """
+
+    def __init__(self, name, interval=10.0, limit=20, logger=None):
+        self.name = name
+        self.interval = interval
+        self.limit = limit
+        self.logger = logger or logging.getLogger()
+        self.counts = {}
+        self.suppressed = 0
+        self._window_start = time.monotonic()
+        self._window_counts = {}
+        self._lock = threading.Lock()
+
+    def event(self, kind, message=None, level=logging.INFO):
+        """Count an event and log its message unless this kind has used up its allowance for the interval."""
+        report = None
+        with self._lock:
+            self.counts[kind] = self.counts.get(kind, 0) + 1
+            now = time.monotonic()
+            if now - self._window_start >= self.interval:
+                report = self._progress()
+                self._window_start = now
+                self._window_counts = {}
+            emit = message is not None and self.logger.isEnabledFor(level)
+            if emit:
+                logged = self._window_counts.get(kind, 0)
+                if logged < self.limit:
+                    self._window_counts[kind] = logged + 1
+                else:
+                    emit = False
+                    self.suppressed += 1
+        if report:
+            self.logger.info(report)
+        if emit:
+            self.logger.log(level, message)
+
+    def _progress(self):
+        counts = ", ".join(f"{kind}={count}" for kind, count in sorted(self.counts.items()))
+        return f"{self.name}: {counts} ({self.suppressed} messages suppressed)"
+
+    def summary(self):
+        """Log the totals for the run."""
+        with self._lock:
+            report = self._progress()
+        self.logger.info(report)
+        return dict(self.counts)
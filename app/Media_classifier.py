@@ -0,0 +1,187 @@
+import os
+import json
+import logging
+import threading
+
+"""__summary__
+This module decides what Dir_cleanup keeps and what it deletes.
+Files are classified by configurable extension rules first:
+    media      video and audio files, always kept
+    sidecar    subtitles, artwork and metadata, kept only next to media files in the same directory
+    partial    downloads still in progress, always kept
+    junk       known clutter (samples, text files, installers), deleted
+Files with an unknown or ambiguous extension (".ts" is both MPEG transport stream and TypeScript) are identified
+by sniffing the magic bytes at the start of the file. Sniffed results are cached by inode, size and mtime and
+persisted between runs, so a file is read at most once until it changes.
+"""
+
+MEDIA = "media"
+SIDECAR = "sidecar"
+PARTIAL = "partial"
+JUNK = "junk"
+
+DEFAULT_MEDIA_EXTENSIONS = {
+    '.mkv', '.mp4', '.m4v', '.avi', '.mov', '.wmv', '.webm', '.mpg', '.mpeg', '.m2ts', '.vob', '.flv',
+    '.mp3', '.m4a', '.m4b', '.wav', '.flac', '.ogg', '.opus', '.aac', '.wma', '.alac', '.aiff'
+}
+DEFAULT_SIDECAR_EXTENSIONS = {
+    '.srt', '.sub', '.idx', '.ass', '.ssa', '.vtt', '.sup', '.nfo', '.jpg', '.jpeg', '.png', '.cue', '.lrc'
+}
+DEFAULT_PARTIAL_EXTENSIONS = {'.part', '.!qb', '.crdownload', '.partial', '.!ut', '.aria2'}
+DEFAULT_JUNK_EXTENSIONS = {'.txt', '.exe', '.url', '.lnk', '.nzb', '.sfv', '.md5', '.db', '.html', '.htm'}
+
+# Extensions that are always sniffed, even though they are known
+DEFAULT_SNIFF_EXTENSIONS = {'.ts'}
+
+# Bytes read from the start of a file to identify it
+SNIFF_SIZE = 4096
+
+# MPEG transport stream packets are 188 bytes and start with a 0x47 sync byte
+TS_PACKET_SIZE = 188
+
+
+def sniff_media(header):
+    """Return True if the first bytes of a file identify a known audio or video container."""
+    if header.startswith(b"\x1a\x45\xdf\xa3"):  # Matroska / WebM
+        return True
+    if header[4:8] == b"ftyp":  # MP4, M4V, MOV, M4A, 3GP
+        return True
+    if header[4:8] in (b"moov", b"mdat", b"wide", b"free"):  # Older QuickTime files
+        return True
+    if header.startswith(b"RIFF") and header[8:12] in (b"AVI ", b"WAVE"):
+        return True
+    if header.startswith((b"fLaC", b"OggS", b"ID3", b"FLV", b"FORM")):
+        return True
+    if header.startswith(b"\x30\x26\xb2\x75\x8e\x66\xcf\x11"):  # ASF / WMV / WMA
+        return True
+    if header.startswith((b"\x00\x00\x01\xba", b"\x00\x00\x01\xb3")):  # MPEG program stream / video
+        return True
+    if len(header) >= 2 and header[0] == 0xFF and header[1] & 0xE0 == 0xE0:  # MPEG audio frame sync
+        return True
+    if len(header) > TS_PACKET_SIZE * 2 and all(header[offset] == 0x47 for offset in range(0, TS_PACKET_SIZE * 3, TS_PACKET_SIZE)):
+        return True
+    return False
+
+
+def _extensions(value, default):
+    """Parse a comma separated extension list from configuration, falling back to the default set."""
+    if not value:
+        return set(default)
+    return {ext.strip().lower() if ext.strip().startswith(".") else f".{ext.strip().lower()}" for ext in value.split(",") if ext.strip()}
+
+
+class MediaClassifier:
+    """Classifies files as media, sidecar, partial or junk, sniffing unknown types with a persistent result cache."""
+
+    def __init__(self, media_extensions=None, sidecar_extensions=None, partial_extensions=None,
+                 junk_extensions=None, sniff_extensions=None, cache_file=None):
+        self.media_extensions = set(media_extensions or DEFAULT_MEDIA_EXTENSIONS)
+        self.sidecar_extensions = set(sidecar_extensions or DEFAULT_SIDECAR_EXTENSIONS)
+        self.partial_extensions = set(partial_extensions or DEFAULT_PARTIAL_EXTENSIONS)
+        self.junk_extensions = set(junk_extensions or DEFAULT_JUNK_EXTENSIONS)
+        self.sniff_extensions = set(DEFAULT_SNIFF_EXTENSIONS if sniff_extensions is None else sniff_extensions)
+        self.cache_file = cache_file
+        self._cache = {}
+        self._seen = {}
+        self._lock = threading.Lock()
+        self.counts = {MEDIA: 0, SIDECAR: 0, PARTIAL: 0, JUNK: 0}
+        self.sniffed = 0
+        self.sniff_bytes = 0
+        self.cache_hits = 0
+
+    @classmethod
+    def from_env(cls, cache_file=None):
+        """Build a classifier from the CLEANUP_*_EXTENSIONS environment variables."""
+        sniff = os.getenv("CLEANUP_SNIFF_EXTENSIONS")
+        return cls(
+            media_extensions=_extensions(os.getenv("CLEANUP_MEDIA_EXTENSIONS"), DEFAULT_MEDIA_EXTENSIONS),
+            sidecar_extensions=_extensions(os.getenv("CLEANUP_SIDECAR_EXTENSIONS"), DEFAULT_SIDECAR_EXTENSIONS),
+            partial_extensions=_extensions(os.getenv("CLEANUP_PARTIAL_EXTENSIONS"), DEFAULT_PARTIAL_EXTENSIONS),
+            junk_extensions=_extensions(os.getenv("CLEANUP_JUNK_EXTENSIONS"), DEFAULT_JUNK_EXTENSIONS),
+            sniff_extensions=_extensions(sniff, DEFAULT_SNIFF_EXTENSIONS) if sniff is not None else None,
+            cache_file=cache_file
+        )
+
+    def is_media_extension(self, path):
+        return os.path.splitext(path)[1].lower() in self.media_extensions
+
+    def classify(self, path, stat=None):
+        """Classify a file. stat (an os.stat_result) is only needed for files that have to be sniffed."""
+        ext = os.path.splitext(path)[1].lower()
+        if ext in self.sniff_extensions or not (
+            ext in self.media_extensions or ext in self.sidecar_extensions
+            or ext in self.partial_extensions or ext in self.junk_extensions
+        ):
+            kind = self._sniff(path, stat)
+        elif ext in self.media_extensions:
+            kind = MEDIA
+        elif ext in self.partial_extensions:
+            kind = PARTIAL
+        elif ext in self.sidecar_extensions:
+            kind = SIDECAR
+        else:
+            kind = JUNK
+        with self._lock:
+            self.counts[kind] += 1
+        return kind
+
+    def _sniff(self, path, stat):
+        try:
+            stat = stat or os.stat(path)
+        except OSError:
+            return JUNK
+        key = f"{stat.st_dev}:{stat.st_ino}"
+        signature = [stat.st_size, stat.st_mtime_ns]
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None and cached[:2] == signature:
+                self.cache_hits += 1
+                self._seen[key] = cached
+                return cached[2]
+
+        try:
+            with open(path, "rb") as file:
+                header = file.read(SNIFF_SIZE)
+        except OSError as e:
+            # Unreadable files are kept rather than deleted on a guess
+            logging.warning(f"Could not read {path} to identify it: {e}")
+            return PARTIAL
+        kind = MEDIA if sniff_media(header) else JUNK
+        logging.debug(f"Sniffed {path} as {kind}")
+        with self._lock:
+            self.sniffed += 1
+            self.sniff_bytes += len(header)
+            self._cache[key] = self._seen[key] = signature + [kind]
+        return kind
+
+    def load_cache(self):
+        if not self.cache_file:
+            return
+        try:
+            with open(self.cache_file, "r") as file:
+                self._cache = json.load(file)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable classifier cache {self.cache_file}: {e}")
+
+    def save_cache(self, prune=True):
+        """Write the sniff results. With prune, only files seen in this run are kept, dropping files that are gone;
+        without it (after a scan that skipped unchanged directories) earlier results are kept as well."""
+        if not self.cache_file:
+            return
+        data = self._seen if prune else {**self._cache, **self._seen}
+        tmp_file = f"{self.cache_file}.tmp"
+        try:
+            with open(tmp_file, "w") as file:
+                json.dump(data, file)
+            os.replace(tmp_file, self.cache_file)
+        except OSError as e:
+            logging.error(f"Failed to write classifier cache {self.cache_file}: {e}")
+
+    def log_summary(self):
+        counts = ", ".join(f"{count} {kind}" for kind, count in self.counts.items())
+        logging.info(
+            f"Classified files: {counts}. Sniffed {self.sniffed} files ({self.sniff_bytes / 1024:.1f} KiB read), "
+            f"{self.cache_hits} sniff results reused from the cache"
+        )
@@ -2,10 +2,15 @@ import os
 import time
 import logging
 import requests
-import re
-import socket
-import platform
 from dotenv import load_dotenv
+from Log_setup import setup_logging
+import Http_client
+from Service_health import ServiceUnavailable
+from Power_manager import power_lease
+import Plex_usage
+import Power_control
+from Host_readiness import parse_checks, check
+from Plex_notifications import NotificationListener, notifications_url, watch_until_idle
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
 """_summary_
@@ -13,6 +18,10 @@ This is an experimental script that looks for active Plex sessions and performs
 The script can be configured to:    
 1. Power on a Dell server using iDRAC.
 2. Send a Wake-On-LAN (WOL) packet to a target machine.
+3. Follow Plex's notification stream (PLEX_NOTIFICATIONS=true) to notice sessions starting and stopping at once,
+   polling only every few minutes to reconcile and while the stream is down.
+4. Record when sessions start and stop (see Plex_usage) and, with PLEX_PREWAKE=true, wake the server ahead of the
+   times Plex is usually in use, and keep it on after the last session when another one is likely to start soon.
 
 Due to the nature of monitoring inbound network traffic, the script is designed to be run on a machine that is always on.
 Monitoring inbound traffic on a machine that is powered off will not be possible. This will require a proxy server such as a Raspberry Pi.
@@ -47,132 +56,42 @@ if ENABLE_WOL == "TRUE" and not all([TARGET_MAC, TARGET_IP, TARGET_PORT]):
 PLEX_API_URL = os.getenv("PLEX_API_URL")
 PLEX_API_TOKEN = os.getenv("PLEX_API_TOKEN")
 
+# Follow Plex's notification stream instead of polling every minute, see Plex_notifications
+PLEX_NOTIFICATIONS = os.getenv("PLEX_NOTIFICATIONS", "False").lower() == "true"
+
+# Wake the server ahead of likely viewing times learned from the session history, see Plex_usage
+PLEX_PREWAKE = os.getenv("PLEX_PREWAKE", "False").lower() == "true"
+
+# Minutes ahead of a likely viewing window the server is woken, enough for it to boot
+PREWAKE_LEAD = int(os.getenv("PREWAKE_LEAD_MINUTES", 15)) * 60
+
+# The server stays on after the last session while another one is likely within this many minutes
+PREWAKE_KEEP_ON = int(os.getenv("PREWAKE_KEEP_ON_MINUTES", 30)) * 60
+
 # File path for logs
 LOG_PATH = os.getenv("LOG_PATH")
 LOG_LEVEL = os.getenv("LOG_LEVEL", "DEBUG").upper()
 
-# Map the log level string to actual logging levels
-LOG_LEVEL_MAPPING = {
-    'CRITICAL': logging.CRITICAL,
-    'ERROR': logging.ERROR,
-    'WARNING': logging.WARNING,
-    'INFO': logging.INFO,
-    'DEBUG': logging.DEBUG,
-    'NOTSET': logging.NOTSET
-}
-
 required_env_vars = ["DIRECTORY_1", "DIRECTORY_2", "LOG_PATH", "LOG_LEVEL"]
 missing_vars = [var for var in required_env_vars if not os.getenv(var)]
 
 if missing_vars:
     raise EnvironmentError(f"Missing required environment variables: {', '.join(missing_vars)}")
 
-# Default to DEBUG if the provided LOG_LEVEL isn't valid
-log_level = LOG_LEVEL_MAPPING.get(LOG_LEVEL, logging.INFO)
-
-# Setup Logging
-logging.basicConfig(
-    filename=f"{LOG_PATH}/directory_cleanup_log_{time.strftime('%Y-%m-%d_%H-%M-%S')}.log",
-    level=log_level,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
-)
-
-def send_wol_packet(mac_address):
-    """Send a Wake-On-LAN magic packet to a specific MAC address."""
-    if not mac_address:
-        logging.error("No MAC address provided for WOL. Skipping WOL.")
-        return
-    
-    if not re.match(r"([0-9A-Fa-f]{2}[:-]){5}([0-9A-Fa-f]{2})", mac_address):
-        raise ValueError("Invalid MAC address format. Must be in the format 'XX:XX:XX:XX:XX:XX' or 'XX-XX-XX-XX-XX-XX'")
-
-    mac_address = mac_address.replace(":", "").replace("-", "").upper()
-    if len(mac_address) != 12:
-        raise ValueError("Invalid MAC address format")
-
-    # Create the magic packet
-    data = b"FF" * 6 + (mac_address * 16).encode()
-    magic_packet = bytes.fromhex(data.decode())
-
-    # Send the packet
-    try:
-        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
-            sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-            sock.sendto(magic_packet, (TARGET_IP, TARGET_PORT))
-        logging.debug(f"Magic packet sent to {TARGET_IP}:{TARGET_PORT}")
-    except Exception as e:
-        logging.error(f"Failed to send WOL packet: {e}")
-
-def shutdown_machine():
-    system = platform.system()
-    if system == "Windows":
-        os.system("shutdown /s /t 0")
-    elif system in ("Linux", "Darwin"):  # Linux or macOS
-        os.system("sudo shutdown now")
-    else:
-        logging.info(f"Unsupported OS: {system}")
-
-# Function to power on the Dell server
-def power_on_server():
-    url = f"{IDRAC_HOST}/redfish/v1/Systems/System.Embedded.1/Actions/ComputerSystem.Reset"
-    payload = {"ResetType": "On"}
-    max_retries = 12 # 12 retries * 5 seconds = 60 seconds
-    retry_count = 0
-    
-    while retry_count < max_retries:
-        try:
-            response = requests.post(url, json=payload, auth=(IDRAC_USER, IDRAC_PASS), verify=False)
-            
-            if response.status_code == 204:
-                logging.debug("Power-on command sent successfully.")
-                print("Giving time for the server to boot!")
-                time.sleep(360)
-                return
-            elif response.status_code == 409:
-                logging.debug("Server is already powered on.")
-                break
-            else:
-                logging.warning(f"Unexpected response: {response.status_code}, {response.text}")
-            
-            # Wait for a short duration before sending the next request
-            retry_count += 1
-            time.sleep(5)
-        except requests.RequestException as e:
-            logging.error(f"Error while sending power-on request: {e}")
-            retry_count += 1
-            time.sleep(5)  # Retry after a delay
-    logging.error("Failed to power on Dell server. Exiting script.")
-    
-# Function to power off the Dell server
-def power_off_server():
-    url = f"{IDRAC_HOST}/redfish/v1/Systems/System.Embedded.1/Actions/ComputerSystem.Reset"
-    payload = {"ResetType": "ForceOff"}
-    max_retries = 5
-    
-    for attempt in range(max_retries):
-        try:
-            response = requests.post(url, json=payload, auth=(IDRAC_USER, IDRAC_PASS), verify=False)
-            if response.status_code == 204:
-                logging.debug("Dell server powered off successfully.")
-                return
-            logging.warning(f"Attempt {attempt + 1}: Unexpected response - {response.status_code}, {response.text}")
-        except requests.RequestException as e:
-            logging.error(f"Attempt {attempt + 1}: Error while powering off server: {e}")
-        time.sleep(5)
-    logging.error("Failed to power off Dell server after retries.")
+# Setup Logging, through a queue to this script's own log file
+setup_logging("plex_heartbeat", LOG_PATH, LOG_LEVEL, default_level=logging.INFO)
 
 # Function to check if there are active Plex sessions
 def has_active_sessions():
-    session_data = get_plex_sessions_with_retries()
-    if session_data and "MediaContainer" in session_data:
-        return session_data["MediaContainer"].get("size", 0) > 0
-    return False
-
-# Function to retrieve Plex session data
-def get_plex_sessions():
-    url = f"{PLEX_API_URL}?X-Plex-Token={PLEX_API_TOKEN}"
-    response = requests.get(url)
+    return bool(get_active_session_keys())
+
+# Function to retrieve Plex session data, retrying failed requests with backoff
+def get_plex_sessions(retries=None, delay=None):
+    try:
+        response = Http_client.get(PLEX_API_URL, params={"X-Plex-Token": PLEX_API_TOKEN}, retries=retries, backoff=delay)
+    except (ServiceUnavailable, requests.RequestException) as e:
+        logging.error(f"Failed to retrieve sessions: {e}")
+        return None
     if response.status_code == 200:
         print("Plex session data retrieved successfully.")
         return response.json()
@@ -181,44 +100,74 @@ def get_plex_sessions():
         logging.error(f"Failed to retrieve sessions: {response.status_code}, {response.text}")
         return None
 
-# Function with retries to fetch Plex session data
-def get_plex_sessions_with_retries(retries=3, delay=5):
-    for _ in range(retries):
-        session_data = get_plex_sessions()
-        if session_data:
-            return session_data
-        t.sleep(delay)
+# Function returning the keys of the active Plex sessions, or None when they could not be retrieved
+def get_active_session_keys():
+    session_data = get_plex_sessions_with_retries()
+    if session_data is None:
+        return None
+    session_keys = {str(item.get("sessionKey")) for item in session_data.get("MediaContainer", {}).get("Metadata", [])}
+    record_sessions(session_keys)
+    return session_keys
+
+# Function adding session starts and stops to the usage history
+def record_sessions(session_keys):
+    try:
+        started = Plex_usage.store().observe(session_keys, server_up=server_is_up)
+    except Exception as e:
+        logging.warning(f"Could not record Plex sessions: {e}")
+        return
+    if started:
+        logging.info(f"{len(started)} Plex session(s) started.")
+
+# Function telling whether the Dell server is on, or None when there is no way to tell
+def server_is_up():
+    try:
+        if Power_control.ENABLE_IDRAC:
+            return Power_control.redfish_power_state() == "On"
+        checks = parse_checks()
+        if checks:
+            return all(check(target) for target in checks)
+    except Exception as e:
+        logging.debug(f"Could not tell whether the server is up: {e}")
     return None
 
-def main():
-    logging.debug("Starting the Plex heartbeat monitor...")
+# Function telling whether Plex is likely to be used within window seconds, while no session is active
+def usage_expected(window=PREWAKE_KEEP_ON, reason=Plex_usage.KEEP_ON):
+    if not PLEX_PREWAKE:
+        return False
+    try:
+        usage = Plex_usage.store()
+        expected = usage.likely_soon(window=window)
+        usage.track_prediction(expected, reason)
+    except Exception as e:
+        logging.warning(f"Could not read the Plex usage model: {e}")
+        return False
+    return expected
 
-    if has_active_sessions():
-        logging.info("Active Plex sessions detected. Ensuring the server is powered on.")
-        
-        # Step 1: Attempt to power on the server
-        try:
-            if ENABLE_WOL:
-                send_wol_packet(TARGET_MAC)
-                logging.info("WOL packet sent successfully. Waiting for the server to boot.")
-                time.sleep(30)  # Adjust boot time as needed
-            
-            if ENABLE_IDRAC:
-                power_on_server()
-                logging.info("Server powered on successfully using iDRAC.")
-        except Exception as e:
-            logging.error(f"Error during server power-on: {e}")
-            return  # Exit script if server power-on fails
-        
-        # Step 2: Monitor Plex activity
+# Function with retries to fetch Plex session data
+def get_plex_sessions_with_retries(retries=3, delay=5):
+    return get_plex_sessions(retries=retries, delay=delay)
+
+# Function returning once no Plex session has been active for IDLE_TIMEOUT seconds
+def monitor_plex_activity():
+    if PLEX_NOTIFICATIONS:
+        logging.info("Following Plex notifications...")
+        with NotificationListener(notifications_url(PLEX_API_URL, PLEX_API_TOKEN)) as listener:
+            watch_until_idle(listener, IDLE_TIMEOUT, get_active_session_keys, on_sessions=record_sessions,
+                             busy=usage_expected)
+        logging.info(f"No activity detected for {IDLE_TIMEOUT} seconds. Releasing the power lease.")
+    else:
         logging.info("Monitoring Plex sessions...")
         while True:
             if has_active_sessions():
                 logging.info("Active Plex sessions ongoing. Server remains powered on.")
                 time.sleep(60)  # Polling interval
+            elif usage_expected():
+                logging.info("No active Plex sessions, but one is likely soon. Server remains powered on.")
+                time.sleep(60)
             else:
                 logging.info("No active Plex sessions detected. Starting idle countdown.")
-                
+            
                 # Grace period logic
                 idle_start_time = time.time()
                 while time.time() - idle_start_time < IDLE_TIMEOUT:
@@ -226,24 +175,38 @@ def main():
                         logging.info("Activity resumed during grace period. Resetting idle timer.")
                         idle_start_time = time.time()  # Reset idle timer
                     time.sleep(60)  # Polling interval during grace period
-                
+            
                 # If no activity resumes during the grace period, proceed to shutdown
-                logging.info(f"No activity detected for {IDLE_TIMEOUT} seconds. Proceeding to shut down the server.")
+                logging.info(f"No activity detected for {IDLE_TIMEOUT} seconds. Releasing the power lease.")
                 break
-            
-        # Step 3: No active sessions detected, shut down the server
-        logging.info("No active Plex sessions detected. Proceeding to shut down the server.")
-        try:
-            if ENABLE_WOL:
-                shutdown_machine()
-                logging.info("Shutdown command issued via WOL.")
-            if ENABLE_IDRAC:
-                power_off_server()
-                logging.info("Shutdown command issued via iDRAC.")
-        except Exception as e:
-            logging.error(f"Error during server shutdown: {e}")
+
+def main():
+    logging.debug("Starting the Plex heartbeat monitor...")
+
+    if has_active_sessions():
+        logging.info("Active Plex sessions detected. Ensuring the server is powered on.")
+    elif usage_expected(PREWAKE_LEAD, Plex_usage.PREWAKE):
+        logging.info("Plex is usually in use around this time. Waking the server ahead of it.")
     else:
         logging.info("No active Plex sessions detected. No action required.")
+        logging.info("Plex heartbeat monitor script completed.")
+        return
+
+    # Hold a power lease while Plex is in use: the server is woken (WOL and/or iDRAC) if needed, and is only
+    # powered off once no other job, such as a running transfer, holds a lease either (see Power_manager)
+    try:
+        with power_lease("plex_heartbeat") as ready:
+            if not ready:
+                logging.warning("The server did not report ready.")
+            monitor_plex_activity()
+        logging.info("Plex is idle, power lease released.")
+    except Exception as e:
+        logging.error(f"Error while monitoring Plex activity: {e}")
+    finally:
+        try:
+            Plex_usage.store().track_prediction(False)
+        except Exception as e:
+            logging.warning(f"Could not record the predicted uptime: {e}")
 
     logging.info("Plex heartbeat monitor script completed.")
 
@@ -0,0 +1,344 @@
+import os
+import ssl
+import json
+import time
+import base64
+import socket
+import hashlib
+import logging
+import threading
+from urllib.parse import urlsplit, urlencode
+
+import Http_client
+
+"""__summary__
+This module follows Plex activity through the notifications WebSocket (/:/websockets/notifications) instead
+of polling /status/sessions. Plex sends a "playing" notification whenever a session starts, pauses, resumes or
+stops, so NotificationListener knows about a change within the time it takes the message to arrive.
+The WebSocket client is a small RFC 6455 implementation on top of the socket module: text messages, ping/pong
+and close, which is all the Plex stream uses. The listener reconnects with backoff when the socket drops.
+watch_until_idle() uses it to wait until no session has been active for the idle timeout; it still polls now and
+then to reconcile with the real session list, and polls more often while the socket is down.
+"""
+
+# Seconds between reconciling polls of /status/sessions while the socket is up, and while it is down
+RECONCILE_INTERVAL = float(os.getenv("PLEX_RECONCILE_INTERVAL", 300))
+FALLBACK_POLL_INTERVAL = float(os.getenv("PLEX_POLL_INTERVAL", 60))
+
+# A ping is sent after this many seconds without a message; the socket is dropped if the pong does not arrive either
+PING_INTERVAL = 30.0
+
+# Longest wait between reconnection attempts
+MAX_RECONNECT_DELAY = 30.0
+
+# Session states that count as activity; "stopped" ends a session
+ACTIVE_STATES = frozenset({"playing", "paused", "buffering"})
+
+NOTIFICATIONS_PATH = "/:/websockets/notifications"
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+OP_CONTINUATION, OP_TEXT, OP_BINARY, OP_CLOSE, OP_PING, OP_PONG = 0x0, 0x1, 0x2, 0x8, 0x9, 0xA
+
+
+def notifications_url(plex_url, token):
+    """WebSocket URL of the notification stream for the Plex server of plex_url (any URL on that server)."""
+    parts = urlsplit(plex_url)
+    scheme = "wss" if parts.scheme == "https" else "ws"
+    return f"{scheme}://{parts.netloc}{NOTIFICATIONS_PATH}?{urlencode({'X-Plex-Token': token})}"
+
+
+class WebSocket:
+    """Minimal WebSocket client connection: send and receive text messages, answer pings."""
+
+    def __init__(self, url, timeout=10):
+        parts = urlsplit(url)
+        secure = parts.scheme == "wss"
+        port = parts.port or (443 if secure else 80)
+        sock = socket.create_connection((parts.hostname, port), timeout=timeout)
+        if secure:
+            sock = ssl.create_default_context().wrap_socket(sock, server_hostname=parts.hostname)
+        self.sock = sock
+        self._buffer = bytearray()
+        self._fragments = []
+        self._binary = False
+        self.last_received = time.monotonic()
+        try:
+            self._handshake(parts, port)
+        except BaseException:
+            sock.close()
+            raise
+
+    def _handshake(self, parts, port):
+        key = base64.b64encode(os.urandom(16)).decode()
+        path = parts.path or "/"
+        if parts.query:
+            path = f"{path}?{parts.query}"
+        self.sock.sendall((
+            f"GET {path} HTTP/1.1\r\n"
+            f"Host: {parts.hostname}:{port}\r\n"
+            "Upgrade: websocket\r\n"
+            "Connection: Upgrade\r\n"
+            f"Sec-WebSocket-Key: {key}\r\n"
+            "Sec-WebSocket-Version: 13\r\n\r\n"
+        ).encode())
+        while b"\r\n\r\n" not in self._buffer:
+            self._receive()
+        end = self._buffer.index(b"\r\n\r\n")
+        lines = self._buffer[:end].decode("latin-1").split("\r\n")
+        del self._buffer[:end + 4]
+        status = lines[0].split(" ", 2)
+        if len(status) < 2 or status[1] != "101":
+            raise ConnectionError(f"WebSocket upgrade refused: {lines[0]}")
+        headers = {name.strip().lower(): value.strip() for name, _, value in (line.partition(":") for line in lines[1:])}
+        expected = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode()).digest()).decode()
+        if headers.get("sec-websocket-accept") != expected:
+            raise ConnectionError("WebSocket upgrade answered with a wrong Sec-WebSocket-Accept")
+
+    def _receive(self):
+        data = self.sock.recv(65536)
+        if not data:
+            raise ConnectionError("Connection closed by the server")
+        self._buffer += data
+        self.last_received = time.monotonic()
+
+    def _frame(self):
+        """Read one frame as (fin, opcode, payload). Nothing is taken from the buffer until the frame is
+        complete, so a read timeout part way through a frame loses nothing."""
+        while True:
+            buffer = self._buffer
+            if len(buffer) >= 2:
+                length, offset = buffer[1] & 0x7F, 2
+                if length == 126:
+                    length, offset = (int.from_bytes(buffer[2:4], "big"), 4) if len(buffer) >= 4 else (None, 4)
+                elif length == 127:
+                    length, offset = (int.from_bytes(buffer[2:10], "big"), 10) if len(buffer) >= 10 else (None, 10)
+                masked = buffer[1] & 0x80
+                start = offset + (4 if masked else 0)
+                if length is not None and len(buffer) >= start + length:
+                    payload = bytes(buffer[start:start + length])
+                    if masked:
+                        payload = _mask(payload, buffer[offset:start])
+                    fin, opcode = buffer[0] & 0x80, buffer[0] & 0x0F
+                    del buffer[:start + length]
+                    return fin, opcode, payload
+            self._receive()
+
+    def recv(self):
+        """Return the next text or binary message, answering pings on the way. Raises ConnectionError when the
+        server closes the connection and socket.timeout when nothing arrives within the socket timeout."""
+        while True:
+            fin, opcode, payload = self._frame()
+            if opcode == OP_PING:
+                self.send(payload, OP_PONG)
+            elif opcode == OP_PONG:
+                continue
+            elif opcode == OP_CLOSE:
+                raise ConnectionError("WebSocket closed by the server")
+            else:
+                self._fragments.append(payload)
+                if opcode != OP_CONTINUATION:
+                    self._binary = opcode == OP_BINARY
+                if fin:
+                    message = b"".join(self._fragments)
+                    self._fragments = []
+                    return message if self._binary else message.decode("utf-8")
+
+    def send(self, payload, opcode=OP_TEXT):
+        """Send one frame; client frames are always masked."""
+        if isinstance(payload, str):
+            payload = payload.encode()
+        header = bytearray([0x80 | opcode])
+        length = len(payload)
+        if length < 126:
+            header.append(0x80 | length)
+        elif length < 1 << 16:
+            header.append(0x80 | 126)
+            header += length.to_bytes(2, "big")
+        else:
+            header.append(0x80 | 127)
+            header += length.to_bytes(8, "big")
+        key = os.urandom(4)
+        self.sock.sendall(bytes(header) + key + _mask(payload, key))
+
+    def close(self):
+        try:
+            self.send(b"", OP_CLOSE)
+        except OSError:
+            pass
+        self.sock.close()
+
+
+def _mask(payload, key):
+    return bytes(byte ^ key[index % 4] for index, byte in enumerate(payload))
+
+
+def session_changes(message):
+    """Return (session key, state) for every playback state change in a notification message."""
+    try:
+        container = json.loads(message).get("NotificationContainer") or {}
+    except (ValueError, AttributeError):
+        return []
+    if container.get("type") != "playing":
+        return []
+    return [
+        (str(notification.get("sessionKey")), notification.get("state"))
+        for notification in container.get("PlaySessionStateNotification") or []
+    ]
+
+
+class NotificationListener:
+    """Keep track of active Plex sessions from the notification stream, in a background thread."""
+
+    def __init__(self, url, connect_timeout=10, ping_interval=PING_INTERVAL):
+        self.url = url
+        self.connect_timeout = connect_timeout
+        self.ping_interval = ping_interval
+        self.connected = threading.Event()
+        # Set on every change of the sessions or of the connection, for waiters to wake up
+        self.changed = threading.Event()
+        self.events = 0
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._socket = None
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="plex-notifications", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        ws = self._socket
+        if ws is not None:
+            try:
+                ws.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def active_sessions(self):
+        """Return the sessions believed to be active, as {session key: state}."""
+        with self._lock:
+            return dict(self._sessions)
+
+    def handle(self, message):
+        """Apply one notification message."""
+        changes = session_changes(message)
+        if not changes:
+            return
+        with self._lock:
+            for key, state in changes:
+                if state in ACTIVE_STATES:
+                    self._sessions[key] = state
+                else:
+                    self._sessions.pop(key, None)
+            self.events += 1
+        logging.debug(f"Plex session changes: {changes}")
+        self.changed.set()
+
+    def reconcile(self, session_keys):
+        """Replace the tracked sessions with the keys of a /status/sessions poll, which is authoritative."""
+        with self._lock:
+            sessions = {key: self._sessions.get(key, "playing") for key in session_keys}
+            if sessions.keys() == self._sessions.keys():
+                return
+            logging.debug(f"Reconciled Plex sessions: {sorted(self._sessions)} -> {sorted(sessions)}")
+            self._sessions = sessions
+        self.changed.set()
+
+    def _run(self):
+        attempt = 0
+        while not self._stop.is_set():
+            try:
+                ws = WebSocket(self.url, timeout=self.connect_timeout)
+            except OSError as e:
+                logging.warning(f"Could not connect to the Plex notification stream: {e}")
+            else:
+                self._socket = ws
+                ws.sock.settimeout(self.ping_interval)
+                self.connected.set()
+                self.changed.set()
+                attempt = 0
+                logging.info("Listening to Plex notifications.")
+                try:
+                    self._listen(ws)
+                except OSError as e:
+                    if not self._stop.is_set():
+                        logging.warning(f"Plex notification stream dropped: {e}")
+                finally:
+                    self._socket = None
+                    self.connected.clear()
+                    self.changed.set()
+                    ws.close()
+            self._stop.wait(Http_client.backoff_delay(attempt, 1, MAX_RECONNECT_DELAY))
+            attempt += 1
+
+    def _listen(self, ws):
+        while not self._stop.is_set():
+            try:
+                message = ws.recv()
+            except socket.timeout:
+                # Quiet for a ping interval: ping, and give up when the previous ping got no answer either
+                if time.monotonic() - ws.last_received >= 1.5 * self.ping_interval:
+                    raise ConnectionError("No answer to ping")
+                ws.send(b"", OP_PING)
+                continue
+            self.handle(message)
+
+
+def watch_until_idle(listener, idle_timeout, poll, reconcile_interval=RECONCILE_INTERVAL,
+                     poll_interval=FALLBACK_POLL_INTERVAL, clock=time.monotonic, on_sessions=None, busy=None):
+    """Return once no Plex session has been active for idle_timeout seconds.
+
+    Session changes come from the listener as they happen. poll() returns the keys of the active sessions (or
+    None when the poll failed); it is called every reconcile_interval seconds while the listener is connected,
+    and every poll_interval seconds while it is not, and once more after each reconnection, since sessions may
+    have changed while the stream was down.
+    on_sessions(keys) is given the active sessions after every change. busy(), checked at least every
+    poll_interval seconds while no session is active, keeps the idle countdown from starting while it returns True.
+    """
+    idle_since = None
+    next_poll = clock()
+    was_connected = listener.connected.is_set()
+    while True:
+        listener.changed.clear()
+        now = clock()
+        connected = listener.connected.is_set()
+        if connected and not was_connected:
+            next_poll = now
+        was_connected = connected
+        if now >= next_poll:
+            session_keys = poll()
+            if session_keys is not None:
+                listener.reconcile(session_keys)
+            now = clock()
+            next_poll = now + (reconcile_interval if connected else poll_interval)
+        elif not connected:
+            next_poll = min(next_poll, now + poll_interval)
+
+        session_keys = listener.active_sessions()
+        if on_sessions is not None:
+            on_sessions(session_keys)
+        if session_keys or (busy is not None and busy()):
+            if idle_since is not None:
+                logging.info("Activity resumed during grace period. Resetting idle timer.")
+            idle_since = None
+        elif idle_since is None:
+            logging.info("No active Plex sessions detected. Starting idle countdown.")
+            idle_since = now
+        elif now - idle_since >= idle_timeout:
+            return
+
+        wake_at = next_poll if idle_since is None else min(next_poll, idle_since + idle_timeout)
+        if busy is not None and not session_keys:
+            wake_at = min(wake_at, now + poll_interval)
+        listener.changed.wait(max(0.0, wake_at - now))
@@ -0,0 +1,269 @@
+import os
+import json
+import time
+import sqlite3
+import argparse
+import threading
+from datetime import datetime
+
+"""__summary__
+This module records when Plex is used and predicts when it will be used next, so Plex_Heartbeat can wake the
+server before people start watching instead of after, and keep it on when someone is likely to start soon.
+Sessions are stored in a local SQLite database with their start and stop times and whether the server was
+already up when they started. The model splits the week into USAGE_BUCKET_MINUTES slots and, for each slot,
+weighs the share of past weeks in which Plex was in use during it, recent weeks counting more (half-life of
+USAGE_HALF_LIFE_WEEKS). A slot whose weight reaches PREWAKE_THRESHOLD is a likely viewing window.
+The time the server is kept on only because of a prediction is recorded as well, so report() can show the
+trade-off: how many sessions found the server already up, and how many extra powered-on hours that cost.
+"""
+
+STATE_PATH = os.getenv("STATE_PATH") or os.getenv("CONFIG_PATH") or "."
+DB_FILE = os.getenv("PLEX_USAGE_DB", os.path.join(STATE_PATH, "plex_usage.db"))
+
+# Size of the time-of-week slots, weeks of history used and how fast old weeks fade
+BUCKET_MINUTES = int(os.getenv("USAGE_BUCKET_MINUTES", 30))
+HISTORY_WEEKS = int(os.getenv("USAGE_HISTORY_WEEKS", 8))
+HALF_LIFE_WEEKS = float(os.getenv("USAGE_HALF_LIFE_WEEKS", 4))
+
+# Weight from which a slot counts as a likely viewing window, and the weeks of history needed before predicting
+PREWAKE_THRESHOLD = float(os.getenv("PREWAKE_THRESHOLD", 0.5))
+MIN_HISTORY_WEEKS = 2
+
+# The model is rebuilt from the database at most this often (seconds)
+MODEL_REFRESH = 3600
+
+# A session still open in the database but not seen for this many seconds was left by a run that ended without
+# closing it; it is closed at the time it was last seen
+STALE_SESSION = 600
+
+PREWAKE = "prewake"
+KEEP_ON = "keep_on"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    session_key TEXT NOT NULL,
+    started REAL NOT NULL,
+    stopped REAL,
+    seen REAL,
+    server_up INTEGER
+);
+CREATE INDEX IF NOT EXISTS sessions_started ON sessions (started);
+CREATE TABLE IF NOT EXISTS predicted_uptime (
+    id INTEGER PRIMARY KEY,
+    reason TEXT NOT NULL,
+    started REAL NOT NULL,
+    stopped REAL NOT NULL
+);
+"""
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def _week(timestamp):
+    """Number of the local week (starting on Monday) of a timestamp."""
+    day = datetime.fromtimestamp(timestamp).date()
+    return (day.toordinal() - day.weekday()) // 7
+
+
+def _bucket(timestamp, bucket_minutes):
+    moment = datetime.fromtimestamp(timestamp)
+    return (moment.weekday() * 1440 + moment.hour * 60 + moment.minute) // bucket_minutes
+
+
+class UsageStore:
+    """SQLite history of Plex sessions and predicted uptime, and the time-of-week model built from it."""
+
+    def __init__(self, db_path=None, bucket_minutes=BUCKET_MINUTES, history_weeks=HISTORY_WEEKS,
+                 half_life_weeks=HALF_LIFE_WEEKS, threshold=PREWAKE_THRESHOLD, clock=time.time):
+        self.db_path = db_path or DB_FILE
+        self.bucket_minutes = bucket_minutes
+        self.history_weeks = history_weeks
+        self.half_life_weeks = half_life_weeks
+        self.threshold = threshold
+        self.clock = clock
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        with self.conn:
+            self.conn.execute(
+                "UPDATE sessions SET stopped = COALESCE(seen, started) WHERE stopped IS NULL AND COALESCE(seen, started) < ?",
+                (self.clock() - STALE_SESSION,)
+            )
+        # Sessions still running, as {session key: row id}
+        self._open = {
+            key: row_id for row_id, key in self.conn.execute("SELECT id, session_key FROM sessions WHERE stopped IS NULL")
+        }
+        self._prediction = None
+        self._model = None
+        self._model_at = None
+
+    def close(self):
+        with self._lock:
+            if self.conn is not None:
+                self._end_prediction(self.clock())
+                self.conn.close()
+                self.conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def observe(self, session_keys, now=None, server_up=None):
+        """Record the sessions active now: new keys start a session, missing ones end it.
+
+        server_up is called (only when a session starts) to tell whether the server was already on; it may
+        return None when that is unknown. Returns the keys of the sessions that started.
+        """
+        now = self.clock() if now is None else now
+        with self._lock:
+            started = set(session_keys) - set(self._open)
+            stopped = [key for key in self._open if key not in session_keys]
+            if not started and not stopped:
+                if self._open:
+                    with self.conn:
+                        self.conn.execute("UPDATE sessions SET seen = ? WHERE stopped IS NULL", (now,))
+                return started
+            up = server_up() if started and server_up is not None else None
+            with self.conn:
+                for key in stopped:
+                    self.conn.execute("UPDATE sessions SET stopped = ? WHERE id = ?", (now, self._open.pop(key)))
+                for key in started:
+                    cursor = self.conn.execute(
+                        "INSERT INTO sessions (session_key, started, seen, server_up) VALUES (?, ?, ?, ?)",
+                        (key, now, now, None if up is None else int(up))
+                    )
+                    self._open[key] = cursor.lastrowid
+            if self._open:
+                self._end_prediction(now)
+            return started
+
+    def track_prediction(self, predicted, reason=KEEP_ON, now=None):
+        """Note whether the server is being kept on only because of a prediction, to measure what it costs."""
+        now = self.clock() if now is None else now
+        with self._lock:
+            if predicted and self._prediction is None:
+                self._prediction = (reason, now)
+            elif not predicted:
+                self._end_prediction(now)
+
+    def _end_prediction(self, now):
+        if self._prediction is None:
+            return
+        reason, started = self._prediction
+        self._prediction = None
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO predicted_uptime (reason, started, stopped) VALUES (?, ?, ?)", (reason, started, now)
+            )
+
+    def model(self, now=None):
+        """Return the weight of every time-of-week slot, rebuilt from the history at most every MODEL_REFRESH seconds."""
+        now = self.clock() if now is None else now
+        if self._model is not None and now - self._model_at < MODEL_REFRESH:
+            return self._model
+        slot_seconds = self.bucket_minutes * 60
+        current_week = _week(now)
+        first_week = current_week - self.history_weeks
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT started, COALESCE(stopped, ?) FROM sessions WHERE COALESCE(stopped, ?) >= ?",
+                (now, now, now - (self.history_weeks + 1) * 7 * 86400)
+            ).fetchall()
+            oldest = self.conn.execute("SELECT MIN(started) FROM sessions").fetchone()[0]
+
+        # Slots in use per week, counting only complete weeks
+        in_use = {}
+        for started, stopped in rows:
+            moment = started - started % slot_seconds
+            while moment <= stopped:
+                week = _week(moment)
+                if first_week <= week < current_week:
+                    in_use.setdefault(week, set()).add(_bucket(moment, self.bucket_minutes))
+                moment += slot_seconds
+
+        weeks = range(max(first_week, _week(oldest)) if oldest is not None else current_week, current_week)
+        weights = {week: 0.5 ** ((current_week - 1 - week) / self.half_life_weeks) for week in weeks}
+        total = sum(weights.values())
+        slots = [0.0] * (7 * 1440 // self.bucket_minutes)
+        if len(weeks) >= MIN_HISTORY_WEEKS and total:
+            for week, buckets in in_use.items():
+                for bucket in buckets:
+                    slots[bucket] += weights[week] / total
+        self._model, self._model_at = slots, now
+        return slots
+
+    def likely_use(self, now=None, window=0):
+        """Weight of the most likely slot between now and window seconds from now."""
+        now = self.clock() if now is None else now
+        slots = self.model(now)
+        moment, end, best = now, now + window, 0.0
+        while True:
+            best = max(best, slots[_bucket(moment, self.bucket_minutes)])
+            if moment >= end:
+                return best
+            moment = min(end, moment + self.bucket_minutes * 60)
+
+    def likely_soon(self, now=None, window=0):
+        """True if Plex is likely to be in use within window seconds."""
+        return self.likely_use(now, window) >= self.threshold
+
+    def report(self, days=30, now=None):
+        """Sessions in the last days that found the server already up or had to wait, and predicted uptime."""
+        now = self.clock() if now is None else now
+        since = now - days * 86400
+        with self._lock:
+            counts = dict(self.conn.execute(
+                "SELECT COALESCE(server_up, -1), COUNT(*) FROM sessions WHERE started >= ? GROUP BY 1", (since,)
+            ).fetchall())
+            uptime = dict(self.conn.execute(
+                "SELECT reason, SUM(stopped - started) FROM predicted_uptime WHERE started >= ? GROUP BY reason",
+                (since,)
+            ).fetchall())
+            prewakes = self.conn.execute(
+                "SELECT COUNT(*) FROM predicted_uptime WHERE reason = ? AND started >= ?", (PREWAKE, since)
+            ).fetchone()[0]
+        known = counts.get(1, 0) + counts.get(0, 0)
+        return {
+            "days": days,
+            "sessions": sum(counts.values()),
+            "found_server_up": counts.get(1, 0),
+            "waited_for_server": counts.get(0, 0),
+            "unknown": counts.get(-1, 0),
+            "share_found_up": counts.get(1, 0) / known if known else None,
+            "prewakes": prewakes,
+            "extra_hours": {reason: round(seconds / 3600, 2) for reason, seconds in uptime.items()},
+            "extra_hours_total": round(sum(uptime.values()) / 3600, 2)
+        }
+
+
+def store():
+    """Return the process wide UsageStore, using DB_FILE."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = UsageStore(DB_FILE)
+        return _store
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report how predictive pre-wake of the server performs")
+    parser.add_argument("--days", type=int, default=30, help="Days of history to report on")
+    parser.add_argument("--model", action="store_true", help="Also print the likely viewing windows")
+    args = parser.parse_args()
+
+    with UsageStore(DB_FILE) as usage:
+        print(json.dumps(usage.report(args.days), indent=2))
+        if args.model:
+            days = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+            for bucket, weight in enumerate(usage.model()):
+                if weight >= usage.threshold:
+                    minute = bucket * usage.bucket_minutes
+                    print(f"{days[minute // 1440]} {minute % 1440 // 60:02d}:{minute % 60:02d}  {weight:.2f}")
+
+
+if __name__ == "__main__":
+    main()
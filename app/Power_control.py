@@ -0,0 +1,179 @@
+import os
+import re
+import time
+import socket
+import logging
+import platform
+import requests
+from dotenv import load_dotenv
+
+import Redfish_client
+from Host_readiness import parse_checks, wait_until_ready
+from Service_health import ServiceUnavailable
+
+"""__summary__
+This module holds the power controls shared by Plex_Heartbeat, File_transfer_detailed and Rclone_transfer:
+Wake-On-LAN, shutting down the local machine, and powering a Dell server on or off through the iDRAC Redfish API.
+Redfish calls go through Redfish_client, which reuses one session token and reads the power state before acting,
+and through Http_client, so they reuse a pooled connection, have timeouts, are retried with backoff (reads on
+connection errors and 5xx answers, logins and resets only when they never reached the iDRAC), and are skipped
+while the iDRAC is marked as down.
+After a power-on, wait_for_host() waits until the server is actually usable (see Host_readiness) rather than
+sleeping a fixed time; the fixed waits are only used when no readiness checks are configured.
+"""
+
+load_dotenv()
+
+# Redfish API details from .env
+IDRAC_USER = os.getenv("IDRAC_USER")
+IDRAC_PASS = os.getenv("IDRAC_PASS")
+IDRAC_HOST = os.getenv("IDRAC_HOST")
+ENABLE_IDRAC = os.getenv("ENABLE_IDRAC", "FALSE").upper() == "TRUE"
+
+# WOL Configurations
+ENABLE_WOL = os.getenv("ENABLE_WOL", "False").lower() == "true"
+TARGET_MAC = os.getenv("TARGET_MAC")
+TARGET_IP = os.getenv("TARGET_IP", "255.255.255.255")  # Default to broadcast
+TARGET_PORT = int(os.getenv("TARGET_PORT", 9))
+
+# Retries for Redfish calls and the backoff between them (seconds, doubled after each retry)
+REDFISH_RETRIES = int(os.getenv("REDFISH_MAX_RETRIES", 5))
+REDFISH_BACKOFF = float(os.getenv("REDFISH_BACKOFF", 2))
+
+# Seconds given to the server to boot after a Redfish power-on or a WOL packet, when no readiness checks are configured
+BOOT_WAIT = 360
+WOL_BOOT_WAIT = 30
+
+
+def send_wol_packet(mac_address):
+    """Send a Wake-On-LAN magic packet to a specific MAC address."""
+    if not mac_address:
+        logging.error("No MAC address provided for WOL. Skipping WOL.")
+        return
+
+    if not re.match(r"([0-9A-Fa-f]{2}[:-]){5}([0-9A-Fa-f]{2})", mac_address):
+        raise ValueError("Invalid MAC address format. Must be in the format 'XX:XX:XX:XX:XX:XX' or 'XX-XX-XX-XX-XX-XX'")
+
+    mac_address = mac_address.replace(":", "").replace("-", "").upper()
+    if len(mac_address) != 12:
+        raise ValueError("Invalid MAC address format")
+
+    # Create the magic packet
+    data = b"FF" * 6 + (mac_address * 16).encode()
+    magic_packet = bytes.fromhex(data.decode())
+
+    # Send the packet
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+            sock.sendto(magic_packet, (TARGET_IP, TARGET_PORT))
+        logging.debug(f"Magic packet sent to {TARGET_IP}:{TARGET_PORT}")
+    except Exception as e:
+        logging.error(f"Failed to send WOL packet: {e}")
+
+
+def shutdown_machine():
+    system = platform.system()
+    if system == "Windows":
+        os.system("shutdown /s /t 0")
+    elif system in ("Linux", "Darwin"):  # Linux or macOS
+        os.system("sudo shutdown now")
+    else:
+        logging.info(f"Unsupported OS: {system}")
+
+
+def redfish():
+    """The Redfish client for the iDRAC; its session token is shared by every call of this process."""
+    return Redfish_client.client(
+        IDRAC_HOST, IDRAC_USER, IDRAC_PASS, retries=REDFISH_RETRIES, backoff=REDFISH_BACKOFF
+    )
+
+
+def redfish_power_state():
+    """Return the server's current Redfish PowerState ("On", "Off", "PoweringOn", ...)."""
+    return redfish().power_state(max_age=0)
+
+
+def wait_for_host(power_state=None, fixed_wait=WOL_BOOT_WAIT):
+    """Wait until the powered on server is usable and log how long that took. Returns True once it is ready.
+
+    Without readiness checks (READY_HOST, READY_CHECKS) the server is given fixed_wait seconds to boot, counted
+    from when power_state (if given) reads "On", since the OS is still starting at that point.
+    """
+    checks = parse_checks()
+    if not checks and power_state is None:
+        logging.info(f"No readiness checks configured, giving the server {fixed_wait} seconds to boot.")
+        time.sleep(fixed_wait)
+        return True
+    result = wait_until_ready(checks, power_state=power_state)
+    if not result["ready"]:
+        return False
+    if not checks and fixed_wait:
+        logging.info(f"PowerState On, but no readiness checks configured: giving the OS {fixed_wait} seconds to boot.")
+        time.sleep(fixed_wait)
+        result["elapsed"] += fixed_wait
+    powered_on = f", PowerState On after {result['powered_on']:.0f} seconds" if result["powered_on"] is not None else ""
+    logging.info(f"Server ready {result['elapsed']:.0f} seconds after power-on{powered_on} (fixed wait: {fixed_wait} seconds).")
+    return True
+
+
+def power_on_server():
+    """Power on the Dell server unless it is on, and wait until it is usable. Returns True if it is on and ready."""
+    try:
+        sent = redfish().power_on()
+    except ServiceUnavailable as e:
+        logging.error(f"Not sending power-on request: {e}")
+        return False
+    except requests.RequestException as e:
+        logging.error(f"Failed to power on Dell server: {e}")
+        return False
+
+    if sent:
+        logging.debug("Power-on command sent successfully.")
+        return wait_for_host(redfish_power_state, BOOT_WAIT)
+    logging.debug("Server is already powered on.")
+    return wait_for_host(redfish_power_state, 0)
+
+
+def power_off_server():
+    """Shut the Dell server down, gracefully if possible (see Redfish_client). Returns True once it is off."""
+    try:
+        result = redfish().power_off()
+    except ServiceUnavailable as e:
+        logging.error(f"Not sending power-off request: {e}")
+        return False
+    except requests.RequestException as e:
+        logging.error(f"Failed to power off Dell server: {e}")
+        return False
+
+    logging.debug({
+        "off": "Dell server was already off.",
+        "graceful": "Dell server shut down gracefully.",
+        "forced": "Dell server forced off."
+    }[result])
+    return True
+
+
+def wake_host():
+    """Power the server on with WOL and/or iDRAC, whichever is enabled, and wait until it is usable.
+    Returns True once it is ready."""
+    ready = True
+    if ENABLE_WOL:
+        send_wol_packet(TARGET_MAC)
+        logging.info("WOL packet sent successfully. Waiting for the server to boot.")
+        ready = wait_for_host()
+    if ENABLE_IDRAC:
+        ready = power_on_server()
+    return ready
+
+
+def sleep_host():
+    """Shut the server down the way it was woken. Returns True if the shutdown was accepted."""
+    done = True
+    if ENABLE_WOL:
+        logging.info("WOL mode enabled. Shutting down the machine.")
+        shutdown_machine()
+    if ENABLE_IDRAC:
+        logging.info("IDRAC mode enabled. Powering off the Dell server.")
+        done = power_off_server()
+    return done
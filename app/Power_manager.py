@@ -0,0 +1,298 @@
+import os
+import time
+import uuid
+import logging
+import threading
+import contextlib
+import requests
+
+import Http_client
+import Power_control
+from Service_health import ServiceUnavailable
+
+"""__summary__
+This module makes the jobs that need the Dell server (File_transfer_detailed, Rclone_transfer, Plex_Heartbeat)
+share its power state instead of each powering it on and off on its own.
+The Flask app holds one PowerManager and serves it under /api/power. A job takes a lease for as long as it needs
+the server: the first lease wakes the server, leases taken while it is waking or on simply join, and the server
+is only powered off once every lease has been released and HOLD_DOWN seconds have passed without a new one.
+So one job can no longer power the server off in the middle of another job's transfer, and jobs that start
+together share one boot. Leases must be renewed within their TTL (the client does this in the background),
+so a job that died does not keep the server on forever.
+Jobs use power_lease(); without POWER_MANAGER_URL it wakes and shuts down the server directly, as before.
+"""
+
+# Seconds the server stays on after the last lease is released, in case another job starts soon
+HOLD_DOWN = float(os.getenv("POWER_HOLD_DOWN", 600))
+
+# Leases that are not renewed for this many seconds are dropped
+LEASE_TTL = float(os.getenv("POWER_LEASE_TTL", 300))
+
+# Flask app serving the leases, for example http://127.0.0.1:5000
+POWER_MANAGER_URL = os.getenv("POWER_MANAGER_URL")
+
+# Longest wait for the server to be woken for a lease
+WAKE_TIMEOUT = float(os.getenv("POWER_WAKE_TIMEOUT", 900))
+
+OFF = "off"
+WAKING = "waking"
+ON = "on"
+HOLDING = "holding"
+SHUTTING_DOWN = "shutting_down"
+
+# Longest single wait of a client polling for its lease to be ready
+LONG_POLL_SECONDS = 30
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+class PowerManager:
+    """Reference counted power state of the server: leases keep it on, the last release powers it off later."""
+
+    def __init__(self, wake=None, sleep=None, hold_down=HOLD_DOWN, lease_ttl=LEASE_TTL, clock=time.monotonic):
+        self.wake = wake or Power_control.wake_host
+        self.sleep = sleep or Power_control.sleep_host
+        self.hold_down = hold_down
+        self.lease_ttl = lease_ttl
+        self.clock = clock
+        # Not known at start; waking a server that is already on is quick (the iDRAC answers "already on")
+        self.state = OFF
+        self.error = None
+        self.leases = {}
+        self.stats = {"leases": 0, "joined": 0, "wakes": 0, "wake_failures": 0, "sleeps": 0, "expired": 0}
+        self._hold_until = None
+        self._cond = threading.Condition()
+        self._closed = False
+        self._worker = threading.Thread(target=self._run, name="power-manager", daemon=True)
+        self._worker.start()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._worker.join(timeout=5)
+
+    def _view(self, lease):
+        return {
+            "id": lease["id"], "job": lease["job"], "ttl": lease["ttl"], "acquired_at": lease["acquired_at"],
+            "state": self.state, "ready": self.state == ON, "error": self.error
+        }
+
+    def acquire(self, job, ttl=None):
+        """Take a lease for job, waking the server if it is off. Returns the lease; poll wait() until it is ready."""
+        ttl = float(ttl or self.lease_ttl)
+        if not 0 < ttl < float("inf"):
+            raise ValueError("ttl must be a positive number of seconds")
+        with self._cond:
+            lease = {
+                "id": uuid.uuid4().hex, "job": job, "ttl": ttl, "acquired_at": time.time(),
+                "expires": self.clock() + ttl
+            }
+            self.leases[lease["id"]] = lease
+            self.stats["leases"] += 1
+            if self.state == OFF:
+                self._begin_wake()
+            else:
+                self.stats["joined"] += 1
+                if self.state == HOLDING:
+                    logging.info(f"Lease for {job} taken during the hold-down, keeping the server on.")
+                    self.state = ON
+                    self._hold_until = None
+            logging.info(f"Power lease for {job} acquired ({len(self.leases)} active, server {self.state}).")
+            self._cond.notify_all()
+            return self._view(lease)
+
+    def renew(self, lease_id):
+        """Extend a lease by its TTL. Returns the lease, or None if it is unknown or expired."""
+        with self._cond:
+            lease = self.leases.get(lease_id)
+            if lease is None:
+                return None
+            lease["expires"] = self.clock() + lease["ttl"]
+            self._cond.notify_all()
+            return self._view(lease)
+
+    def wait(self, lease_id, timeout=0):
+        """Wait up to timeout seconds for the server to be on for a lease. Returns the lease, or None."""
+        with self._cond:
+            self._cond.wait_for(
+                lambda: self.state not in (WAKING, SHUTTING_DOWN) or lease_id not in self.leases, timeout
+            )
+            lease = self.leases.get(lease_id)
+            return self._view(lease) if lease else None
+
+    def release(self, lease_id):
+        """Release a lease. Returns False if it was not held."""
+        with self._cond:
+            lease = self.leases.pop(lease_id, None)
+            if lease is None:
+                return False
+            logging.info(f"Power lease for {lease['job']} released ({len(self.leases)} active).")
+            self._start_hold_down()
+            self._cond.notify_all()
+            return True
+
+    def status(self):
+        with self._cond:
+            now = self.clock()
+            return {
+                "state": self.state,
+                "error": self.error,
+                "power_off_in": max(0.0, self._hold_until - now) if self.state == HOLDING else None,
+                "leases": [
+                    {"id": lease["id"], "job": lease["job"], "acquired_at": lease["acquired_at"],
+                     "expires_in": max(0.0, lease["expires"] - now)}
+                    for lease in self.leases.values()
+                ],
+                "stats": dict(self.stats)
+            }
+
+    def _start_hold_down(self):
+        if not self.leases and self.state == ON:
+            self.state = HOLDING
+            self._hold_until = self.clock() + self.hold_down
+            logging.info(f"No power leases left, powering off in {self.hold_down:.0f} seconds unless a job starts.")
+
+    def _begin_wake(self):
+        self.state = WAKING
+        self.error = None
+        threading.Thread(target=self._wake, name="power-wake", daemon=True).start()
+
+    def _wake(self):
+        error = "Server did not come up"
+        try:
+            ready = self.wake()
+        except Exception as e:
+            logging.error(f"Error during server power-on: {e}")
+            ready, error = False, str(e)
+        with self._cond:
+            if ready:
+                self.state = ON
+                self.stats["wakes"] += 1
+                self._start_hold_down()
+            else:
+                self.state = OFF
+                self.error = error
+                self.stats["wake_failures"] += 1
+            self._cond.notify_all()
+
+    def _expire(self, now):
+        for lease_id, lease in list(self.leases.items()):
+            if lease["expires"] <= now:
+                del self.leases[lease_id]
+                self.stats["expired"] += 1
+                logging.warning(f"Power lease for {lease['job']} was not renewed and has expired.")
+                self._start_hold_down()
+
+    def _run(self):
+        with self._cond:
+            while not self._closed:
+                now = self.clock()
+                self._expire(now)
+                if self.state == HOLDING and now >= self._hold_until:
+                    self.state = SHUTTING_DOWN
+                    self._cond.release()
+                    try:
+                        done = self.sleep()
+                    except Exception as e:
+                        logging.error(f"Error during server shutdown: {e}")
+                        done = False
+                    finally:
+                        self._cond.acquire()
+                    self.state = OFF
+                    self.stats["sleeps"] += bool(done)
+                    # A job that asked for the server during the shutdown wakes it again
+                    if self.leases:
+                        self._begin_wake()
+                    self._cond.notify_all()
+                    continue
+                deadlines = [lease["expires"] for lease in self.leases.values()]
+                if self.state == HOLDING:
+                    deadlines.append(self._hold_until)
+                self._cond.wait(max(0.0, min(deadlines) - now) if deadlines else None)
+
+
+def manager():
+    """Return the process wide PowerManager, as served by the Flask app."""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = PowerManager()
+        return _manager
+
+
+def _renew(leases_url, held, interval, stop):
+    """Renew the lease at held["url"] every interval seconds. A lease the manager no longer knows (it expired, or
+    the web app restarted) is taken again, so the server is not powered off under the running job."""
+    while not stop.wait(interval):
+        try:
+            response = Http_client.request("PUT", held["url"], retries=1)
+            if response.status_code == 404:
+                logging.error(f"Power lease for {held['job']} was lost, taking a new one.")
+                response = Http_client.post(leases_url, json={"job": held["job"], "ttl": held["ttl"]})
+                response.raise_for_status()
+                held["url"] = f"{leases_url}/{response.json()['id']}"
+            else:
+                response.raise_for_status()
+        except (requests.RequestException, ServiceUnavailable, ValueError, KeyError) as e:
+            logging.error(f"Could not renew the power lease for {held['job']}: {e}")
+
+
+def _wait_ready(lease_url, lease, timeout):
+    """Long-poll the manager until the server is on for the lease, the wake failed, or timeout has passed."""
+    give_up_at = time.monotonic() + timeout
+    while not lease["ready"] and lease["state"] != OFF and time.monotonic() < give_up_at:
+        wait = min(LONG_POLL_SECONDS, max(0.0, give_up_at - time.monotonic()))
+        response = Http_client.get(lease_url, params={"wait": wait}, timeout=(5, wait + 10))
+        response.raise_for_status()
+        lease = response.json()
+    return lease
+
+
+@contextlib.contextmanager
+def power_lease(job, manager_url=None, ttl=None, wake_timeout=WAKE_TIMEOUT):
+    """Keep the server on while the block runs; yields True once it is ready.
+
+    The lease is taken from the power manager at manager_url (POWER_MANAGER_URL), renewed in the background
+    and released afterwards. Without a manager URL the server is woken and shut down directly. If the manager
+    cannot be reached, the server is woken directly but left on, since other jobs may still be using it.
+    """
+    manager_url = POWER_MANAGER_URL if manager_url is None else manager_url
+    if not manager_url:
+        ready = Power_control.wake_host()
+        try:
+            yield ready
+        finally:
+            Power_control.sleep_host()
+        return
+
+    leases_url = f"{manager_url.rstrip('/')}/api/power/leases"
+    try:
+        response = Http_client.post(leases_url, json={"job": job, "ttl": ttl})
+        response.raise_for_status()
+        lease = response.json()
+    except (requests.RequestException, ServiceUnavailable, ValueError) as e:
+        logging.warning(f"Power manager not available ({e}). Waking the server directly and leaving it on.")
+        yield Power_control.wake_host()
+        return
+
+    held = {"url": f"{leases_url}/{lease['id']}", "job": job, "ttl": lease["ttl"]}
+    stop = threading.Event()
+    renewer = threading.Thread(target=_renew, args=(leases_url, held, lease["ttl"] / 3, stop), daemon=True)
+    renewer.start()
+    try:
+        try:
+            lease = _wait_ready(held["url"], lease, wake_timeout)
+        except (requests.RequestException, ServiceUnavailable, ValueError) as e:
+            lease = {**lease, "ready": False, "error": str(e)}
+        if not lease["ready"]:
+            logging.warning(f"Server is not ready for {job}: {lease.get('error') or lease['state']}")
+        yield lease["ready"]
+    finally:
+        stop.set()
+        renewer.join()
+        try:
+            Http_client.delete(held["url"])
+        except (requests.RequestException, ServiceUnavailable) as e:
+            logging.warning(f"Could not release the power lease, it will expire instead: {e}")
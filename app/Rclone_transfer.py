@@ -1,13 +1,11 @@
 import os
-import time
 import psutil
 import shutil
 import logging
-import requests
-import re
-import platform
-import socket
 from dotenv import load_dotenv
+from Log_setup import setup_logging
+from Power_manager import power_lease
+from Log_rotation import new_segment_path, record_finished_segment
 import subprocess
 
 """__summary__
@@ -47,118 +45,19 @@ if ENABLE_WOL == "TRUE" and not all([TARGET_MAC, TARGET_IP, TARGET_PORT]):
 LOG_PATH = os.getenv("LOG_PATH")
 LOG_LEVEL = os.getenv("LOG_LEVEL", "DEBUG").upper()
 
-# Map the log level string to actual logging levels
-LOG_LEVEL_MAPPING = {
-    'CRITICAL': logging.CRITICAL,
-    'ERROR': logging.ERROR,
-    'WARNING': logging.WARNING,
-    'INFO': logging.INFO,
-    'DEBUG': logging.DEBUG,
-    'NOTSET': logging.NOTSET
-}
-
 required_env_vars = ["DIRECTORY_1", "DIRECTORY_2", "LOG_PATH", "LOG_LEVEL"]
 missing_vars = [var for var in required_env_vars if not os.getenv(var)]
 
 if missing_vars:
     raise EnvironmentError(f"Missing required environment variables: {', '.join(missing_vars)}")
 
-# Default to DEBUG if the provided LOG_LEVEL isn't valid
-log_level = LOG_LEVEL_MAPPING.get(LOG_LEVEL, logging.INFO)
-
-# Setup Logging
-logging.basicConfig(
-    filename=f"{LOG_PATH}/directory_cleanup_log_{time.strftime('%Y-%m-%d_%H-%M-%S')}.log",
-    level=log_level,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
-)
-
-def send_wol_packet(mac_address):
-    """Send a Wake-On-LAN magic packet to a specific MAC address."""
-    if not mac_address:
-        logging.error("No MAC address provided for WOL. Skipping WOL.")
-        return
-    
-    if not re.match(r"([0-9A-Fa-f]{2}[:-]){5}([0-9A-Fa-f]{2})", mac_address):
-        raise ValueError("Invalid MAC address format. Use the format 'XX:XX:XX:XX:XX:XX' or 'XX-XX-XX-XX-XX-XX'")
-
-    mac_address = mac_address.replace(":", "").replace("-", "").upper()
-    if len(mac_address) != 12:
-        raise ValueError("Invalid MAC address format")
-
-    # Create the magic packet
-    data = b"FF" * 6 + (mac_address * 16).encode()
-    magic_packet = bytes.fromhex(data.decode())
-
-    # Send the packet
-    try:
-        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
-            sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-            sock.sendto(magic_packet, (TARGET_IP, TARGET_PORT))
-        logging.debug(f"Magic packet sent to {TARGET_IP}:{TARGET_PORT}")
-    except Exception as e:
-        logging.error(f"Failed to send WOL packet: {e}")
-
-def shutdown_machine():
-    system = platform.system()
-    if system == "Windows":
-        os.system("shutdown /s /t 0")
-    elif system in ("Linux", "Darwin"):  # Linux or macOS
-        os.system("sudo shutdown now")
-    else:
-        logging.info(f"Unsupported OS: {system}")
-
-
-# Function to power on the Dell server
-def power_on_server():
-    url = f"{IDRAC_HOST}/redfish/v1/Systems/System.Embedded.1/Actions/ComputerSystem.Reset"
-    payload = {"ResetType": "On"}
-    max_retries = 12 # 12 retries * 5 seconds = 60 seconds
-    retry_count = 0
-    
-    while retry_count < max_retries:
-        try:
-            response = requests.post(url, json=payload, auth=(IDRAC_USER, IDRAC_PASS), verify=False)
-            
-            if response.status_code == 204:
-                logging.debug("Power-on command sent successfully.")
-                print("Giving time for the server to boot!")
-                time.sleep(360)
-                return
-            elif response.status_code == 409:
-                logging.debug("Server is already powered on.")
-                break
-            else:
-                logging.warning(f"Unexpected response: {response.status_code}, {response.text}")
-            
-            # Wait for a short duration before sending the next request
-            retry_count += 1
-            time.sleep(5)
-        except requests.RequestException as e:
-            logging.error(f"Error while sending power-on request: {e}")
-            retry_count += 1
-            time.sleep(5)  # Retry after a delay
-    logging.error("Failed to power on Dell server. Exiting script.")
-
-# Function to power off the Dell server
-def power_off_server():
-    url = f"{IDRAC_HOST}/redfish/v1/Systems/System.Embedded.1/Actions/ComputerSystem.Reset"
-    payload = {"ResetType": "ForceOff"}
-    max_retries = 5
-    
-    for attempt in range(max_retries):
-        try:
-            response = requests.post(url, json=payload, auth=(IDRAC_USER, IDRAC_PASS), verify=False)
-            if response.status_code == 204:
-                logging.debug("Dell server powered off successfully.")
-                return
-            logging.warning(f"Attempt {attempt + 1}: Unexpected response - {response.status_code}, {response.text}")
-        except requests.RequestException as e:
-            logging.error(f"Attempt {attempt + 1}: Error while powering off server: {e}")
-        time.sleep(5)
-    logging.error("Failed to power off Dell server after retries.")
+# Setup Logging, through a queue to this script's own log file
+setup_logging("rclone_transfer", LOG_PATH, LOG_LEVEL, default_level=logging.INFO)
 
+# rclone writes its own log segment next to ours; DEBUG logs every file checked, so default to INFO
+RCLONE_LOG_LEVEL = os.getenv("RCLONE_LOG_LEVEL", "INFO").upper()
+if RCLONE_LOG_LEVEL not in ("DEBUG", "INFO", "NOTICE", "ERROR"):
+    RCLONE_LOG_LEVEL = "INFO"
 
 def get_max_transfers():
     """Dynamically calculate the number of max transfers based on system resources."""
@@ -225,6 +124,9 @@ def sync_directories_with_rclone():
 
     logging.info(f"Using rclone executable: {rclone_executable}")
 
+    # rclone writes its own log segment, picked up by Log_clear's retention once it is finished
+    log_file = new_segment_path("rclone", LOG_PATH)
+
     # Construct the rclone command
     rclone_command = [
         rclone_executable, "copy", 
@@ -233,7 +135,7 @@ def sync_directories_with_rclone():
         "--checkers", str(max_transfers),
         "--progress",
         "--log-file", log_file,
-        "--log-level", "DEBUG",
+        "--log-level", RCLONE_LOG_LEVEL,
         "--exclude", ".Trash-99/**"
     ]
 
@@ -248,50 +150,28 @@ def sync_directories_with_rclone():
         logging.error(f"rclone command failed with error: {e.stderr}")
     except Exception as e:
         logging.error(f"Unexpected error during rclone sync: {e}")
+    finally:
+        if os.path.exists(log_file):
+            record_finished_segment(log_file)
 
 def main():
     logging.debug("Starting the script...")
 
-    # Step 1: Handle WOL if enabled
-    if ENABLE_WOL == "TRUE":
-        try:
-            logging.info("WOL mode enabled. Attempting to power on the Dell server.")
-            send_wol_packet(TARGET_MAC)
-            logging.info("WOL packet sent successfully. Waiting for the server to boot.")
-            time.sleep(30)  # Wait for the server to power on (adjust as needed)
-        except Exception as e:
-            logging.error(f"Error during WOL execution: {e}")
-            return  # Exit script if WOL fails
-
-    # Step 2: Handle iDRAC if enabled
-    if ENABLE_IDRAC == "TRUE":
-        try:
-            logging.info("IDRAC mode enabled. Powering on the Dell server.")
-            power_on_server()
-        except Exception as e:
-            logging.error(f"Error during iDRAC power-on: {e}")
-            return  # Exit script if iDRAC fails
-
-    # Step 3: Perform synchronization
+    # Step 1: Hold a power lease, so the Dell server is woken (WOL and/or iDRAC) if needed and is not powered off
+    # until this and every other job using it are done, see Power_manager
     try:
-        logging.info("Starting directory synchronization.")
-        sync_directories_with_rclone()
-        logging.info("Directory synchronization completed successfully.")
+        with power_lease("rclone_transfer") as ready:
+            if not ready:
+                logging.warning("The server did not report ready, trying the synchronization anyway.")
+
+            # Step 2: Perform synchronization
+            logging.info("Starting directory synchronization.")
+            sync_directories_with_rclone()
+            logging.info("Directory synchronization completed successfully.")
     except Exception as e:
         logging.error(f"An error occurred during synchronization: {e}")
         return  # Exit script if synchronization fails
 
-    # Step 4: Handle shutdown if WOL or iDRAC was used
-    try:
-        if ENABLE_WOL == "TRUE":
-            logging.info("WOL mode enabled. Sending shutdown magic packet.")
-            shutdown_machine()
-        if ENABLE_IDRAC == "TRUE":
-            logging.info("IDRAC mode enabled. Powering off the Dell server.")
-            power_off_server()
-    except Exception as e:
-        logging.error(f"Error during server shutdown: {e}")
-
     logging.info("Rclone transfer script completed successfully.")
 
 # Run the script
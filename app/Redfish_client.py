@@ -0,0 +1,167 @@
+import os
+import time
+import atexit
+import logging
+import threading
+from urllib.parse import urljoin
+
+import requests
+
+import Http_client
+
+"""__summary__
+This module is the client for the iDRAC Redfish API used by Power_control.
+    - logs in once through the SessionService and sends the X-Auth-Token with every call, instead of Basic auth,
+      which makes the iDRAC run a full authentication (often 1-3 seconds) per request; the session is logged in
+      again when it expires and deleted when the process exits
+    - falls back to Basic auth on an iDRAC without the SessionService
+    - caches Systems/System.Embedded.1 for STATE_TTL seconds and reads PowerState before acting, so power_on()
+      on a server that is already on sends nothing
+    - power_off() asks the OS for a GracefulShutdown when the iDRAC offers it and only forces the server off if it
+      is still on after GRACEFUL_TIMEOUT seconds
+"""
+
+SESSIONS_PATH = "/redfish/v1/SessionService/Sessions"
+SYSTEM_PATH = "/redfish/v1/Systems/System.Embedded.1"
+RESET_PATH = f"{SYSTEM_PATH}/Actions/ComputerSystem.Reset"
+
+# Seconds the system state read from the iDRAC is reused
+STATE_TTL = float(os.getenv("REDFISH_STATE_TTL", 5))
+
+# Seconds given to a graceful shutdown before the server is forced off, and between power state checks meanwhile
+GRACEFUL_TIMEOUT = float(os.getenv("REDFISH_GRACEFUL_TIMEOUT", 300))
+POWER_POLL_INTERVAL = 5.0
+
+
+class RedfishClient:
+    """Session-token Redfish client for one iDRAC, with a short-lived cache of the system state."""
+
+    def __init__(self, host, user, password, verify=False, retries=None, backoff=None, state_ttl=STATE_TTL,
+                 clock=time.monotonic, sleep=time.sleep):
+        self.host = host.rstrip("/")
+        self.user = user
+        self.password = password
+        self.verify = verify
+        self.retries = retries
+        self.backoff = backoff
+        self.state_ttl = state_ttl
+        self.clock = clock
+        self.sleep = sleep
+        self.token = None
+        self.session_url = None
+        self.basic_auth = False
+        self.logins = 0
+        self._system = None
+        self._system_at = None
+        self._lock = threading.Lock()
+
+    def _send(self, method, path, **kwargs):
+        return Http_client.request(
+            method, f"{self.host}{path}", verify=self.verify, retries=self.retries, backoff=self.backoff, **kwargs
+        )
+
+    def login(self):
+        """Create a Redfish session. Falls back to Basic auth when the iDRAC has no SessionService."""
+        # Not retried once the request may have reached the iDRAC: each retry could open another session
+        response = self._send("POST", SESSIONS_PATH, json={"UserName": self.user, "Password": self.password})
+        if response.status_code in (404, 405, 501):
+            logging.info("iDRAC has no Redfish SessionService, using Basic auth.")
+            self.basic_auth = True
+            return
+        response.raise_for_status()
+        self.token = response.headers.get("X-Auth-Token")
+        if not self.token:
+            raise requests.HTTPError("Redfish session created without an X-Auth-Token", response=response)
+        location = response.headers.get("Location")
+        self.session_url = urljoin(f"{self.host}/", location) if location else None
+        self.logins += 1
+        logging.debug("Logged in to the iDRAC Redfish API.")
+
+    def logout(self):
+        """Delete the Redfish session, so it does not take up one of the iDRAC's session slots."""
+        with self._lock:
+            token, session_url = self.token, self.session_url
+            self.token = self.session_url = None
+        if token and session_url:
+            try:
+                Http_client.delete(session_url, headers={"X-Auth-Token": token}, verify=self.verify, retries=0)
+            except requests.RequestException as e:
+                logging.debug(f"Could not delete the Redfish session: {e}")
+
+    def request(self, method, path, **kwargs):
+        """Make an authenticated call, logging in first if needed and once more if the session has expired."""
+        for attempt in range(2):
+            with self._lock:
+                if not self.token and not self.basic_auth:
+                    self.login()
+                auth = {"auth": (self.user, self.password)} if self.basic_auth else {"headers": {"X-Auth-Token": self.token}}
+            response = self._send(method, path, **auth, **kwargs)
+            if response.status_code != 401 or self.basic_auth or attempt:
+                return response
+            logging.debug("Redfish session expired, logging in again.")
+            with self._lock:
+                self.token = self.session_url = None
+
+    def system(self, max_age=None):
+        """Return Systems/System.Embedded.1, from the cache if it is younger than max_age (STATE_TTL) seconds."""
+        max_age = self.state_ttl if max_age is None else max_age
+        if self._system is not None and self.clock() - self._system_at < max_age:
+            return self._system
+        response = self.request("GET", SYSTEM_PATH)
+        response.raise_for_status()
+        self._system, self._system_at = response.json(), self.clock()
+        return self._system
+
+    def power_state(self, max_age=None):
+        """Return PowerState: "On", "Off", "PoweringOn" or "PoweringOff"."""
+        return self.system(max_age).get("PowerState")
+
+    def reset_types(self):
+        action = self.system().get("Actions", {}).get("#ComputerSystem.Reset", {})
+        return action.get("ResetType@Redfish.AllowableValues") or []
+
+    def reset(self, reset_type):
+        """Send a ComputerSystem.Reset action. Returns the response; a 409 means the server is already in that state."""
+        response = self.request("POST", RESET_PATH, json={"ResetType": reset_type})
+        self._system = None
+        if response.status_code != 409:
+            response.raise_for_status()
+        return response
+
+    def power_on(self):
+        """Power the server on unless it already is. Returns True if a power-on was sent, False if it was on."""
+        if self.power_state() in ("On", "PoweringOn"):
+            return False
+        return self.reset("On").status_code != 409
+
+    def power_off(self, graceful_timeout=GRACEFUL_TIMEOUT, poll_interval=POWER_POLL_INTERVAL):
+        """Shut the server down, gracefully when the iDRAC offers it, forcing it off only when that does not
+        finish within graceful_timeout seconds. Returns "off" (already off), "graceful" or "forced"."""
+        if self.power_state() == "Off":
+            return "off"
+        if "GracefulShutdown" in self.reset_types():
+            self.reset("GracefulShutdown")
+            give_up_at = self.clock() + graceful_timeout
+            while self.clock() < give_up_at:
+                if self.power_state(max_age=0) == "Off":
+                    return "graceful"
+                self.sleep(min(poll_interval, max(0.0, give_up_at - self.clock())))
+            if self.power_state(max_age=0) == "Off":
+                return "graceful"
+            logging.warning(f"Server still on {graceful_timeout:.0f} seconds after a graceful shutdown, forcing it off.")
+        self.reset("ForceOff")
+        return "forced"
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def client(host, user, password, **options):
+    """Return the process wide RedfishClient for the iDRAC, logging its session out when the process exits."""
+    global _client
+    with _client_lock:
+        if _client is None or _client.host != host.rstrip("/"):
+            _client = RedfishClient(host, user, password, **options)
+            atexit.register(_client.logout)
+        return _client
@@ -0,0 +1,305 @@
+import os
+import time
+import atexit
+import sqlite3
+import threading
+from urllib.parse import urlsplit
+import requests
+
+"""__summary__
+This module keeps a shared record of the health of the services the scripts talk to (Plex, Radarr, Sonarr,
+Overseerr, the iDRAC Redfish API) and puts a circuit breaker in front of them.
+Every call made through ServiceHealth.call() records a success or failure and its latency in a small SQLite
+database, so all scripts, running as separate processes, see the same state:
+    closed      calls go through; after FAILURE_THRESHOLD failures in a row the circuit opens
+    open        calls fail at once with ServiceUnavailable, without touching the network, for a cooldown that
+                doubles each time the circuit opens again (up to MAX_COOLDOWN)
+    half_open   once the cooldown has passed one caller is let through as a probe; its success closes the
+                circuit, its failure opens it again
+A response is a failure when the connection fails or the service answers with a 5xx status; a 4xx answer
+means the service is up. Services are identified by the scheme, host and port of their URL, see service_key().
+"""
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+STATE_PATH = os.getenv("STATE_PATH") or os.getenv("CONFIG_PATH") or "."
+DB_FILE = os.getenv("SERVICE_HEALTH_DB", os.path.join(STATE_PATH, "service_health.db"))
+
+# Failures in a row that open the circuit, and how long it stays open (seconds)
+FAILURE_THRESHOLD = int(os.getenv("SERVICE_FAILURE_THRESHOLD", 3))
+COOLDOWN = float(os.getenv("SERVICE_COOLDOWN", 60))
+MAX_COOLDOWN = float(os.getenv("SERVICE_MAX_COOLDOWN", 900))
+
+# State read from the database is reused for this long before it is read again, and successes of a healthy
+# service are written at most this often
+REFRESH_SECONDS = 2.0
+
+# Weight of the newest sample in the moving latency average
+LATENCY_SMOOTHING = 0.2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS services (
+    name TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    failures INTEGER NOT NULL,
+    open_count INTEGER NOT NULL,
+    opened_at REAL,
+    probe_at REAL,
+    last_success REAL,
+    last_failure REAL,
+    last_error TEXT,
+    latency_ms REAL,
+    successes_total INTEGER NOT NULL,
+    failures_total INTEGER NOT NULL,
+    checked_at REAL
+);
+"""
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+class ServiceUnavailable(Exception):
+    """Raised instead of calling a service whose circuit is open."""
+
+    def __init__(self, name, retry_at):
+        super().__init__(f"{name} is marked as down, not calling it until {time.strftime('%H:%M:%S', time.localtime(retry_at))}")
+        self.name = name
+        self.retry_at = retry_at
+
+
+def service_key(url):
+    """Identify a service by the scheme, host and port of a URL."""
+    parts = urlsplit(url or "")
+    if not parts.netloc:
+        return url
+    return f"{parts.scheme}://{parts.netloc}".lower()
+
+
+def _new_row(name):
+    return {
+        "name": name, "state": CLOSED, "failures": 0, "open_count": 0, "opened_at": None, "probe_at": None,
+        "last_success": None, "last_failure": None, "last_error": None, "latency_ms": None,
+        "successes_total": 0, "failures_total": 0, "checked_at": None
+    }
+
+
+def _average(current, sample):
+    if sample is None:
+        return current
+    if current is None:
+        return sample
+    return current + LATENCY_SMOOTHING * (sample - current)
+
+
+class ServiceHealth:
+    """Circuit breakers and cached health for services, stored in SQLite and shared between processes."""
+
+    def __init__(self, db_path=None, failure_threshold=FAILURE_THRESHOLD, cooldown=COOLDOWN,
+                 max_cooldown=MAX_COOLDOWN, refresh=REFRESH_SECONDS, clock=time.time):
+        self.db_path = db_path or DB_FILE
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.refresh = refresh
+        self.clock = clock
+        self.conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self._cache = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def close(self):
+        with self._lock:
+            if self.conn is None:
+                return
+            self._flush_all()
+            self.conn.close()
+            self.conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _read(self, name):
+        row = self.conn.execute("SELECT * FROM services WHERE name = ?", (name,)).fetchone()
+        return dict(row) if row else _new_row(name)
+
+    def _write(self, row):
+        columns = list(row)
+        self.conn.execute(
+            f"INSERT OR REPLACE INTO services ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})",
+            [row[column] for column in columns]
+        )
+
+    def _update(self, name, change):
+        """Read a service's row, apply change(row) and write it back, in one transaction across processes."""
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self._read(name)
+            pending = self._pending.pop(name, None)
+            if pending:
+                self._apply_successes(row, *pending)
+            result = change(row)
+            self._write(row)
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self._cache[name] = (row, self.clock())
+        return result
+
+    def _row(self, name):
+        cached = self._cache.get(name)
+        if cached is None or self.clock() - cached[1] >= self.refresh:
+            cached = self._cache[name] = (self._read(name), self.clock())
+        return cached[0]
+
+    def _cooldown(self, row):
+        return min(self.cooldown * 2 ** max(row["open_count"] - 1, 0), self.max_cooldown)
+
+    def _apply_successes(self, row, count, latency_ms, at):
+        row["successes_total"] += count
+        row["latency_ms"] = _average(row["latency_ms"], latency_ms)
+        # Successes older than a failure recorded meanwhile (by another process) do not reset the circuit
+        if at < (row["last_failure"] or 0):
+            return
+        row["failures"] = 0
+        row["last_success"] = row["checked_at"] = at
+        if row["state"] != CLOSED:
+            row.update(state=CLOSED, open_count=0, opened_at=None, probe_at=None)
+
+    def _flush_all(self):
+        for name in list(self._pending):
+            self._update(name, lambda row: None)
+
+    def allow(self, name):
+        """Return True if a call to the service may go ahead (closed, or this caller is the half-open probe)."""
+        with self._lock:
+            row = self._row(name)
+            if row["state"] == CLOSED:
+                return True
+            if not self._probe_due(row):
+                return False
+
+            def claim(row):
+                if row["state"] == CLOSED:
+                    return True
+                if not self._probe_due(row):
+                    return False
+                row.update(state=HALF_OPEN, probe_at=self.clock())
+                return True
+            return self._update(name, claim)
+
+    def _probe_due(self, row):
+        now = self.clock()
+        if row["state"] == OPEN:
+            return now - row["opened_at"] >= self._cooldown(row)
+        # A half-open probe that never reported back is given up after one cooldown
+        return now - (row["probe_at"] or 0) >= self.cooldown
+
+    def retry_at(self, name):
+        """When the next call to an open service will be let through."""
+        row = self._row(name)
+        if row["state"] == OPEN:
+            return row["opened_at"] + self._cooldown(row)
+        return (row["probe_at"] or 0) + self.cooldown
+
+    def record_success(self, name, latency_ms=None):
+        with self._lock:
+            now = self.clock()
+            row = self._row(name)
+            pending = self._pending.get(name)
+            count, average = (pending[0], pending[1]) if pending else (0, None)
+            self._pending[name] = (count + 1, _average(average, latency_ms), now)
+            # State changes are written at once, routine successes of a healthy service in batches
+            if row["state"] != CLOSED or row["failures"] or now - (row["checked_at"] or 0) >= self.refresh:
+                self._update(name, lambda row: None)
+
+    def record_failure(self, name, error=None, latency_ms=None):
+        with self._lock:
+            now = self.clock()
+
+            def fail(row):
+                row["failures"] += 1
+                row["failures_total"] += 1
+                row["last_failure"] = row["checked_at"] = now
+                row["last_error"] = str(error)[:500] if error is not None else None
+                row["latency_ms"] = _average(row["latency_ms"], latency_ms)
+                if row["state"] == HALF_OPEN or (row["state"] == CLOSED and row["failures"] >= self.failure_threshold):
+                    row.update(state=OPEN, opened_at=now, probe_at=None, open_count=row["open_count"] + 1)
+            self._update(name, fail)
+
+    def call(self, name, func, *args, **kwargs):
+        """Call func through the service's circuit breaker, recording the outcome and latency.
+
+        Raises ServiceUnavailable without calling func when the circuit is open. Exceptions from func are
+        re-raised; a requests.HTTPError for a status below 500 does not count as a failure.
+        """
+        if not self.allow(name):
+            raise ServiceUnavailable(name, self.retry_at(name))
+        started = time.monotonic()
+        try:
+            result = func(*args, **kwargs)
+        except requests.HTTPError as e:
+            latency_ms = (time.monotonic() - started) * 1000
+            if e.response is not None and e.response.status_code < 500:
+                self.record_success(name, latency_ms)
+            else:
+                self.record_failure(name, e, latency_ms)
+            raise
+        except Exception as e:
+            self.record_failure(name, e, (time.monotonic() - started) * 1000)
+            raise
+        self.record_success(name, (time.monotonic() - started) * 1000)
+        return result
+
+    def status(self, name):
+        """Return the stored health of a service, as a dict."""
+        with self._lock:
+            if name in self._pending:
+                self._update(name, lambda row: None)
+            return self._read(name)
+
+    def all_status(self):
+        """Return the stored health of every known service."""
+        with self._lock:
+            self._flush_all()
+            return [dict(row) for row in self.conn.execute("SELECT * FROM services ORDER BY name")]
+
+    def is_available(self, name, max_age=None):
+        """Cached health check: False while the circuit is open, None when there is no result newer than max_age."""
+        row = self.status(name)
+        if row["state"] == OPEN:
+            return False
+        if row["checked_at"] is None or (max_age is not None and self.clock() - row["checked_at"] > max_age):
+            return None
+        return row["failures"] == 0
+
+
+def registry():
+    """Return the process wide ServiceHealth, using DB_FILE."""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = ServiceHealth(DB_FILE)
+            atexit.register(_registry.close)
+        return _registry
+
+
+def configure(db_path=None, **options):
+    """Replace the process wide ServiceHealth, for example to use another database."""
+    global _registry
+    with _registry_lock:
+        if _registry is not None:
+            _registry.close()
+        _registry = ServiceHealth(db_path, **options)
+        atexit.register(_registry.close)
+        return _registry
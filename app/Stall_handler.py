@@ -1,7 +1,27 @@
 import os
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 import requests
 
+import Http_client
+from Stall_tracker import StallTracker
+
+"""__summary__
+This script removes and blocklists stalled downloads in Radarr and Sonarr and triggers a new search for them.
+Radarr and Sonarr are processed at the same time. Calls go through Http_client, so each service is reached over
+pooled keep-alive connections, every call has a timeout, and failed calls are retried with backoff.
+The queue is read page by page and stalled items are removed in bulk as each page arrives, so large queues are
+handled in bounded memory, and the removed movies or episodes are searched for with one command per batch
+instead of one per item. Servers without the bulk endpoint get one call per item.
+The time taken and the number of requests issued are reported for each service.
+With --watch the queues are polled every STALL_WATCH_INTERVAL seconds instead and item progress is tracked in
+SQLite (see Stall_tracker); a stalled item is only removed once it has made no progress for
+STALL_NO_PROGRESS_MINUTES, so items that stalled briefly are left to recover.
+"""
+
 # Load environment variables
 load_dotenv()
 
@@ -11,28 +31,106 @@ RADARR_API_KEY = os.getenv("RADARR_API_KEY")
 SONARR_API_URL = os.getenv("SONARR_API_URL")
 SONARR_API_KEY = os.getenv("SONARR_API_KEY")
 
-def fetch_stalled_items(api_url, api_key):
-    """Fetch stalled items from Radarr or Sonarr."""
+# Connect and read timeouts in seconds for every API call
+CONNECT_TIMEOUT = float(os.getenv("STALL_CONNECT_TIMEOUT", 5))
+READ_TIMEOUT = float(os.getenv("STALL_READ_TIMEOUT", 30))
+
+# Per item calls made at the same time, for servers without the bulk queue endpoint
+ITEM_CONCURRENCY = int(os.getenv("STALL_ITEM_CONCURRENCY", 4))
+
+# Retries for failed calls, waiting up to RETRY_BACKOFF * 2^n seconds between attempts
+MAX_RETRIES = int(os.getenv("STALL_MAX_RETRIES", 3))
+RETRY_BACKOFF = float(os.getenv("STALL_RETRY_BACKOFF", 0.5))
+
+# Queue records fetched per request, and an optional server side status filter (for example "warning")
+QUEUE_PAGE_SIZE = int(os.getenv("STALL_QUEUE_PAGE_SIZE", 250))
+QUEUE_STATUS_FILTER = os.getenv("STALL_QUEUE_STATUS_FILTER")
+
+# Queue items removed per bulk delete and media ids per search command
+DELETE_BATCH_SIZE = int(os.getenv("STALL_DELETE_BATCH_SIZE", 100))
+SEARCH_BATCH_SIZE = int(os.getenv("STALL_SEARCH_BATCH_SIZE", 100))
+
+# Walks over the queue per run, see process_queue
+MAX_QUEUE_PASSES = 3
+
+# Watch mode: seconds between polls, and minutes a stalled item may go without progress before it is removed
+WATCH_INTERVAL = float(os.getenv("STALL_WATCH_INTERVAL", 300))
+NO_PROGRESS_WINDOW = float(os.getenv("STALL_NO_PROGRESS_MINUTES", 60)) * 60
+
+# Watch mode item state
+STATE_PATH = os.getenv("STATE_PATH") or os.getenv("CONFIG_PATH") or "."
+TRACKER_DB = os.getenv("STALL_TRACKER_DB", os.path.join(STATE_PATH, "stall_tracker.db"))
+
+# Status codes meaning the server has no bulk queue endpoint
+BULK_UNSUPPORTED_STATUS = (404, 405, 501)
+
+_no_bulk_delete = set()
+
+def request_stats(api_url):
+    """Requests issued to a service, counting every retried attempt, and how many of them failed."""
+    stats = Http_client.metrics(api_url)
+    return {"requests": stats["attempts"], "errors": stats["errors"]}
+
+def close_sessions():
+    Http_client.close_sessions()
+    _no_bulk_delete.clear()
+
+def _request(method, api_url, path, **kwargs):
+    """Make a call with retries; raises ServiceUnavailable while the service is marked as down."""
+    response = Http_client.request(
+        method, f"{api_url}{path}", timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),
+        retries=MAX_RETRIES, backoff=RETRY_BACKOFF, **kwargs
+    )
+    response.raise_for_status()
+    return response
+
+def iter_queue_pages(api_url, api_key):
+    """Yield the records of the download queue one page at a time.
+
+    Older servers that return the whole queue as a plain list are yielded as a single page. When
+    QUEUE_STATUS_FILTER is set it is sent as the status filter, so the server only returns matching records.
+    """
+    params = {"apikey": api_key, "pageSize": QUEUE_PAGE_SIZE}
+    if QUEUE_STATUS_FILTER:
+        params["status"] = QUEUE_STATUS_FILTER
+    page = 1
+    while True:
+        response = _request("GET", api_url, "/api/v3/queue", params={**params, "page": page})
+        body = response.json()
+        if isinstance(body, list):
+            yield body
+            return
+        records = body.get("records") or []
+        yield records
+        page_size = body.get("pageSize") or QUEUE_PAGE_SIZE
+        if not records or page * page_size >= body.get("totalRecords", 0):
+            return
+        page += 1
+
+def iter_stalled_items(api_url, api_key, progress=None):
+    """Yield stalled items from Radarr or Sonarr as each page of the queue arrives.
+
+    If a progress dict is given its "pages" entry is incremented for every page read.
+    """
     try:
-        url = f"{api_url}/api/v3/queue"
-        params = {"apikey": api_key}
-        response = requests.get(url, params=params)
-        response.raise_for_status()
-        queue = response.json()
-        # Filter for stalled items
-        stalled_items = [item for item in queue if item.get("status") == "Stalled"]
-        return stalled_items
+        for records in iter_queue_pages(api_url, api_key):
+            if progress is not None:
+                progress["pages"] = progress.get("pages", 0) + 1
+            for item in records:
+                if item.get("status") == "Stalled":
+                    yield item
     except Exception as e:
         print(f"Error fetching queue from {api_url}: {e}")
-        return []
+
+def fetch_stalled_items(api_url, api_key):
+    """Fetch stalled items from Radarr or Sonarr."""
+    return list(iter_stalled_items(api_url, api_key))
 
 def remove_and_blocklist_item(api_url, api_key, item_id, title):
     """Remove and blocklist an item."""
     try:
-        url = f"{api_url}/api/v3/queue/{item_id}"
-        params = {"apikey": api_key, "blacklist": "true"}
-        response = requests.delete(url, params=params)
-        response.raise_for_status()
+        params = {"apikey": api_key, "blocklist": "true"}
+        _request("DELETE", api_url, f"/api/v3/queue/{item_id}", params=params)
         print(f"Blocked and removed: {title}")
         return True
     except Exception as e:
@@ -42,7 +140,6 @@ def remove_and_blocklist_item(api_url, api_key, item_id, title):
 def trigger_search(api_url, api_key, title, media_id, is_movie=True):
     """Trigger a search for the given media."""
     try:
-        url = f"{api_url}/api/v3/command"
         data = {
             "name": "Search" if is_movie else "EpisodeSearch",
             "movieId": media_id if is_movie else None,
@@ -51,33 +148,236 @@ def trigger_search(api_url, api_key, title, media_id, is_movie=True):
         # Remove None keys from the payload
         data = {k: v for k, v in data.items() if v is not None}
         headers = {"X-Api-Key": api_key}
-        response = requests.post(url, json=data, headers=headers)
-        response.raise_for_status()
+        _request("POST", api_url, "/api/v3/command", json=data, headers=headers)
         print(f"Search triggered for: {title}")
         return True
     except Exception as e:
         print(f"Error triggering search for {title}: {e}")
         return False
 
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def _remove_one_by_one(api_url, api_key, items):
+    with ThreadPoolExecutor(max_workers=ITEM_CONCURRENCY) as executor:
+        results = list(executor.map(
+            lambda item: remove_and_blocklist_item(api_url, api_key, item["id"], item["title"]), items
+        ))
+    return [item for item, removed in zip(items, results) if removed]
+
+def remove_and_blocklist_items(api_url, api_key, items):
+    """Remove and blocklist queue items with one bulk call. Returns the items that were removed.
+
+    Servers without DELETE /api/v3/queue/bulk are remembered and their items are removed one at a time.
+    """
+    if api_url in _no_bulk_delete:
+        return _remove_one_by_one(api_url, api_key, items)
+    try:
+        params = {"apikey": api_key, "blocklist": "true", "removeFromClient": "true"}
+        _request("DELETE", api_url, "/api/v3/queue/bulk", params=params, json={"ids": [item["id"] for item in items]})
+        print(f"Blocked and removed {len(items)} items: {', '.join(item['title'] for item in items)}")
+        return items
+    except requests.HTTPError as e:
+        if e.response.status_code not in BULK_UNSUPPORTED_STATUS:
+            print(f"Error removing {len(items)} items: {e}")
+            return []
+    except Exception as e:
+        print(f"Error removing {len(items)} items: {e}")
+        return []
+    print(f"{api_url} does not support bulk removal, removing items one at a time")
+    _no_bulk_delete.add(api_url)
+    return _remove_one_by_one(api_url, api_key, items)
+
+def trigger_searches(api_url, api_key, media_ids, is_movie=True):
+    """Trigger one search command for a batch of movies or episodes. Returns True if it was accepted."""
+    try:
+        if is_movie:
+            data = {"name": "MoviesSearch", "movieIds": media_ids}
+        else:
+            data = {"name": "EpisodeSearch", "episodeIds": media_ids}
+        headers = {"X-Api-Key": api_key}
+        _request("POST", api_url, "/api/v3/command", json=data, headers=headers)
+        print(f"{data['name']} triggered for {len(media_ids)} {'movies' if is_movie else 'episodes'}")
+        return True
+    except Exception as e:
+        print(f"Error triggering search for {len(media_ids)} items: {e}")
+        return False
+
 def process_queue(api_url, api_key, is_movie=True):
-    """Process the activity queue for stalled items."""
-    stalled_items = fetch_stalled_items(api_url, api_key)
-    for item in stalled_items:
-        title = item["title"]
-        item_id = item["id"]
-        media_id = item["movieId"] if "movieId" in item else item["episodeId"]
-
-        print(f"Processing stalled item: {title}")
-        removed = remove_and_blocklist_item(api_url, api_key, item_id, title)
-        if removed:
-            trigger_search(api_url, api_key, title, media_id, is_movie=is_movie)
-
-def main():
-    print("Processing Radarr queue...")
-    process_queue(RADARR_API_URL, RADARR_API_KEY, is_movie=True)
-
-    print("Processing Sonarr queue...")
-    process_queue(SONARR_API_URL, SONARR_API_KEY, is_movie=False)
+    """Process the activity queue for stalled items. Returns the counts and timing for the service.
+
+    Stalled items are collected as each page of the queue arrives and removed DELETE_BATCH_SIZE at a time, so
+    memory stays bounded on large queues. The removed movies or episodes are searched for with one command per
+    SEARCH_BATCH_SIZE ids. Removing items moves later records onto earlier pages, so when a pass over several
+    pages removed anything the queue is walked again for items that were missed.
+    """
+    started = time.monotonic()
+    requests_before = request_stats(api_url)["requests"]
+    seen = set()
+    to_remove = []
+    # Several queue items can belong to the same movie or episode, it is searched for once
+    to_search = {}
+    stalled = removed = searched = 0
+
+    def flush_removals():
+        nonlocal removed
+        for batch in _chunks(to_remove, DELETE_BATCH_SIZE):
+            for item in remove_and_blocklist_items(api_url, api_key, batch):
+                removed += 1
+                media_id = item.get("movieId", item.get("episodeId"))
+                # Unmatched downloads have no movie or episode to search for
+                if media_id is not None:
+                    to_search[media_id] = True
+        to_remove.clear()
+
+    def flush_searches(final=False):
+        nonlocal searched
+        media_ids = list(to_search)
+        if not final:
+            # Only full batches are sent while the queue is still being read
+            media_ids = media_ids[:len(media_ids) - len(media_ids) % SEARCH_BATCH_SIZE]
+        for batch in _chunks(media_ids, SEARCH_BATCH_SIZE):
+            if trigger_searches(api_url, api_key, batch, is_movie=is_movie):
+                searched += len(batch)
+        for media_id in media_ids:
+            del to_search[media_id]
+
+    for _ in range(MAX_QUEUE_PASSES):
+        removed_before = removed
+        progress = {}
+        for item in iter_stalled_items(api_url, api_key, progress):
+            if item["id"] in seen:
+                continue
+            seen.add(item["id"])
+            stalled += 1
+            print(f"Processing stalled item: {item['title']}")
+            to_remove.append(item)
+            if len(to_remove) >= DELETE_BATCH_SIZE:
+                flush_removals()
+            if len(to_search) >= SEARCH_BATCH_SIZE:
+                flush_searches()
+        flush_removals()
+        if removed == removed_before or progress.get("pages", 0) <= 1:
+            break
+    flush_searches(final=True)
+
+    return {
+        "service": api_url,
+        "stalled": stalled,
+        "removed": removed,
+        "searched": searched,
+        "requests": request_stats(api_url)["requests"] - requests_before,
+        "elapsed": time.monotonic() - started
+    }
+
+def report(name, stats):
+    print(
+        f"{name}: {stats['stalled']} stalled, {stats['removed']} removed, {stats['searched']} searched for, "
+        f"{stats['requests']} requests in {stats['elapsed']:.2f}s"
+    )
+
+def _remove_and_search(api_url, api_key, items, is_movie):
+    """Remove items in bulk batches and search for their media. Returns (removed items, media searched for)."""
+    removed_items = []
+    for batch in _chunks(items, DELETE_BATCH_SIZE):
+        removed_items.extend(remove_and_blocklist_items(api_url, api_key, batch))
+    media_ids = list(dict.fromkeys(
+        item.get("movieId", item.get("episodeId")) for item in removed_items
+        if item.get("movieId", item.get("episodeId")) is not None
+    ))
+    searched = 0
+    for batch in _chunks(media_ids, SEARCH_BATCH_SIZE):
+        if trigger_searches(api_url, api_key, batch, is_movie=is_movie):
+            searched += len(batch)
+    return removed_items, searched
+
+def poll_service(tracker, name, api_url, api_key, is_movie, window, now=None):
+    """Record one poll of a service's queue and act on items stalled without progress for window seconds.
+
+    Returns the poll counts, or None when the queue could not be read (nothing is recorded then, so items are
+    not treated as gone because of a failed poll).
+    """
+    now = time.time() if now is None else now
+    try:
+        records = [item for page in iter_queue_pages(api_url, api_key) for item in page]
+    except Exception as e:
+        print(f"Error fetching queue from {api_url}: {e}")
+        return None
+
+    changes = tracker.update(name, records, now)
+    stalled = tracker.stalled(name)
+    due = tracker.due(name, window, now)
+    for item in due:
+        print(f"Processing stalled item: {item['title']} (no progress for {(now - item['last_progress']) / 60:.0f} min)")
+    removed, searched = _remove_and_search(api_url, api_key, due, is_movie) if due else ([], 0)
+    tracker.forget(name, [item["id"] for item in removed])
+    return {
+        "service": name,
+        "queued": len(records),
+        **changes,
+        "stalled": len(stalled),
+        "due": len(due),
+        "removed": len(removed),
+        "searched": searched
+    }
+
+def report_poll(stats, window):
+    print(
+        f"{stats['service']}: {stats['queued']} queued ({stats['new']} new, {stats['changed']} changed, "
+        f"{stats['gone']} gone), {stats['stalled']} stalled, {stats['due']} without progress for "
+        f"{window / 60:.0f} min, {stats['removed']} removed, {stats['searched']} searched for"
+    )
+
+def watch(services, tracker, interval=WATCH_INTERVAL, window=NO_PROGRESS_WINDOW, stop_event=None, polls=None):
+    """Poll the services every interval seconds until stop_event is set (or after polls polls)."""
+    stop_event = stop_event or threading.Event()
+    count = 0
+    with ThreadPoolExecutor(max_workers=max(1, len(services))) as executor:
+        while not stop_event.is_set():
+            futures = [
+                executor.submit(poll_service, tracker, name, url, key, is_movie, window)
+                for name, url, key, is_movie in services
+            ]
+            for future in futures:
+                stats = future.result()
+                if stats:
+                    report_poll(stats, window)
+            count += 1
+            if polls is not None and count >= polls:
+                break
+            stop_event.wait(interval)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Remove, blocklist and search again for stalled downloads")
+    parser.add_argument('--watch', action='store_true', help='Keep polling the queues and only act on items that stopped making progress')
+    parser.add_argument('--interval', type=float, default=WATCH_INTERVAL, help='Seconds between polls in watch mode')
+    parser.add_argument('--window', type=float, default=NO_PROGRESS_WINDOW / 60, help='Minutes without progress before a stalled item is removed in watch mode')
+    args = parser.parse_args(argv)
+
+    services = [
+        ("Radarr", RADARR_API_URL, RADARR_API_KEY, True),
+        ("Sonarr", SONARR_API_URL, SONARR_API_KEY, False)
+    ]
+    services = [service for service in services if service[1]]
+
+    try:
+        if args.watch:
+            print(f"Watching {', '.join(name for name, *_ in services)} queues every {args.interval:.0f}s...")
+            with StallTracker(TRACKER_DB) as tracker:
+                try:
+                    watch(services, tracker, interval=args.interval, window=args.window * 60)
+                except KeyboardInterrupt:
+                    print("Stopped watching")
+            return
+
+        print(f"Processing {', '.join(name for name, *_ in services)} queues...")
+        with ThreadPoolExecutor(max_workers=max(1, len(services))) as executor:
+            futures = {name: executor.submit(process_queue, url, key, is_movie) for name, url, key, is_movie in services}
+            for name, future in futures.items():
+                report(name, future.result())
+    finally:
+        close_sessions()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,156 @@
+import sqlite3
+import threading
+
+"""__summary__
+This module keeps per-item download state for the Stall_handler watcher in a local SQLite database.
+For every queue item it records when it was first seen, when it was first seen stalled, and the downloaded bytes
+with the time they last changed. Each poll is compared with the previous one in memory and only the differences
+(new items, items whose status or progress changed, items that left the queue) are written, so an idle queue costs
+no writes. An item is due for removal once it is stalled and has not made progress for the configured window.
+"""
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS queue_items (
+    service TEXT NOT NULL,
+    item_id INTEGER NOT NULL,
+    title TEXT,
+    media_key TEXT,
+    media_id INTEGER,
+    status TEXT,
+    downloaded INTEGER NOT NULL,
+    first_seen REAL NOT NULL,
+    last_progress REAL NOT NULL,
+    stalled_since REAL,
+    PRIMARY KEY (service, item_id)
+);
+"""
+
+STALLED_STATUS = "Stalled"
+
+
+def _media(record):
+    for key in ("movieId", "episodeId"):
+        if key in record:
+            return key, record[key]
+    return None, None
+
+
+def _downloaded(record):
+    return (record.get("size") or 0) - (record.get("sizeleft") or 0)
+
+
+class StallTracker:
+    """SQLite record of queue items, their progress over time and how long they have been stalled."""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(SCHEMA)
+        self._rows = {}
+        self._lock = threading.Lock()
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _service_rows(self, service):
+        rows = self._rows.get(service)
+        if rows is None:
+            rows = self._rows[service] = {
+                row["item_id"]: dict(row)
+                for row in self.conn.execute("SELECT * FROM queue_items WHERE service = ?", (service,))
+            }
+        return rows
+
+    def update(self, service, records, now):
+        """Apply a poll of a service's queue. Returns counts of new, changed, unchanged and gone items."""
+        with self._lock:
+            rows = self._service_rows(service)
+            inserted, changed, present = [], [], set()
+            for record in records:
+                item_id = record["id"]
+                present.add(item_id)
+                status = record.get("status")
+                downloaded = _downloaded(record)
+                stalled = status == STALLED_STATUS
+                row = rows.get(item_id)
+                if row is None:
+                    media_key, media_id = _media(record)
+                    row = rows[item_id] = {
+                        "service": service, "item_id": item_id, "title": record.get("title"),
+                        "media_key": media_key, "media_id": media_id, "status": status,
+                        "downloaded": downloaded, "first_seen": now, "last_progress": now,
+                        "stalled_since": now if stalled else None
+                    }
+                    inserted.append(row)
+                    continue
+                if row["status"] == status and row["downloaded"] == downloaded:
+                    continue
+                if row["downloaded"] != downloaded:
+                    row["downloaded"] = downloaded
+                    row["last_progress"] = now
+                if not stalled:
+                    row["stalled_since"] = None
+                elif row["stalled_since"] is None:
+                    row["stalled_since"] = now
+                row["status"] = status
+                changed.append(row)
+            gone = [item_id for item_id in rows if item_id not in present]
+            for item_id in gone:
+                del rows[item_id]
+
+            with self.conn:
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO queue_items (service, item_id, title, media_key, media_id, status, "
+                    "downloaded, first_seen, last_progress, stalled_since) VALUES (:service, :item_id, :title, "
+                    ":media_key, :media_id, :status, :downloaded, :first_seen, :last_progress, :stalled_since)",
+                    inserted
+                )
+                self.conn.executemany(
+                    "UPDATE queue_items SET status = :status, downloaded = :downloaded, "
+                    "last_progress = :last_progress, stalled_since = :stalled_since "
+                    "WHERE service = :service AND item_id = :item_id",
+                    changed
+                )
+                self.conn.executemany(
+                    "DELETE FROM queue_items WHERE service = ? AND item_id = ?",
+                    [(service, item_id) for item_id in gone]
+                )
+            return {
+                "new": len(inserted),
+                "changed": len(changed),
+                "unchanged": len(present) - len(inserted) - len(changed),
+                "gone": len(gone)
+            }
+
+    def stalled(self, service):
+        """Return the tracked items of a service that are currently stalled."""
+        with self._lock:
+            return [dict(row) for row in self._service_rows(service).values() if row["stalled_since"] is not None]
+
+    def due(self, service, window, now):
+        """Return the stalled items that have not made progress for window seconds, shaped like queue records."""
+        return [
+            {"id": row["item_id"], "title": row["title"], row["media_key"] or "movieId": row["media_id"],
+             "stalled_since": row["stalled_since"], "last_progress": row["last_progress"]}
+            for row in self.stalled(service)
+            if now - row["last_progress"] >= window
+        ]
+
+    def forget(self, service, item_ids):
+        """Stop tracking items, after they were removed from the queue."""
+        with self._lock:
+            rows = self._service_rows(service)
+            for item_id in item_ids:
+                rows.pop(item_id, None)
+            with self.conn:
+                self.conn.executemany(
+                    "DELETE FROM queue_items WHERE service = ? AND item_id = ?",
+                    [(service, item_id) for item_id in item_ids]
+                )
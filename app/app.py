@@ -1,10 +1,16 @@
 import os
 import subprocess
 from dotenv import load_dotenv
-from flask import Flask, jsonify, render_template, request
+from flask import Flask, Response, jsonify, render_template, request, stream_with_context
 from flask_sqlalchemy import SQLAlchemy, enum
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
+from API_test import PROBE_DEADLINE, check_api_status, read_history, record_history
+from Log_rotation import list_segments
+from Service_health import registry
+from Power_manager import manager as power_manager
+from Plex_usage import store as plex_usage
+from Log_search import DEFAULT_LIMIT, search_logs, tail
 
 load_dotenv()
 
@@ -12,6 +18,9 @@ load_dotenv()
 SERVER_IP = os.getenv('SERVER_IP', '127.0.0.1')
 PORT_NUMBER_FLASK = int(os.getenv('PORT_NUMBER_FLASK', 5000))
 
+# Log path shared with the scripts, used by the log search and tail endpoints
+LOG_PATH = os.getenv('LOG_PATH', '.')
+
 app = Flask(__name__)
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///database.db'
 db = SQLAlchemy(app)
@@ -157,5 +166,133 @@ def cancel_cron(script_name):
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+# API to list log segments, optionally for one script
+@app.route('/api/logs', methods=['GET'])
+def list_logs():
+    segments = list_segments(LOG_PATH, request.args.get('script'))
+    return jsonify([
+        {key: segment.get(key) for key in ('file', 'script', 'start', 'end', 'size', 'compression')}
+        for segment in segments
+    ]), 200
+
+# API to search logs by time range, level and text
+@app.route('/api/logs/search', methods=['GET'])
+def search_log_records():
+    try:
+        result = search_logs(
+            LOG_PATH,
+            script=request.args.get('script'),
+            start=request.args.get('start'),
+            end=request.args.get('end'),
+            level=request.args.get('level'),
+            text=request.args.get('q'),
+            limit=min(int(request.args.get('limit', DEFAULT_LIMIT)), 10000)
+        )
+    except ValueError as e:
+        return jsonify({'error': f'Invalid query: {e}'}), 400
+    return jsonify(result), 200
+
+# API to follow a script's log as server-sent events
+@app.route('/api/logs/<script_name>/tail', methods=['GET'])
+def tail_log(script_name):
+    try:
+        lines = min(max(int(request.args.get('lines', 50)), 0), 5000)
+    except ValueError as e:
+        return jsonify({'error': f'Invalid query: {e}'}), 400
+
+    def events():
+        idle_polls = 0
+        for line in tail(LOG_PATH, script_name, lines=lines):
+            if line is not None:
+                idle_polls = 0
+                yield f"data: {line}\n\n"
+                continue
+            # A comment every 15 idle polls keeps the connection open and detects clients that went away
+            idle_polls += 1
+            if idle_polls % 15 == 0:
+                yield ": keep-alive\n\n"
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+# API to probe the configured services, optionally several times for latency percentiles
+@app.route('/api/health', methods=['GET'])
+def api_health():
+    try:
+        repeat = min(max(int(request.args.get('repeat', 1)), 1), 50)
+        deadline = min(float(request.args.get('deadline', PROBE_DEADLINE)), 120)
+        max_age = float(request.args['max_age']) if 'max_age' in request.args else None
+    except ValueError as e:
+        return jsonify({'error': f'Invalid query: {e}'}), 400
+    results = check_api_status(repeat=repeat, deadline=deadline, max_age=max_age)
+    record_history(results)
+    return jsonify(results), 200
+
+# API to read earlier health check results
+@app.route('/api/health/history', methods=['GET'])
+def api_health_history():
+    try:
+        limit = min(max(int(request.args.get('limit', 100)), 1), 2000)
+    except ValueError as e:
+        return jsonify({'error': f'Invalid query: {e}'}), 400
+    return jsonify(read_history(limit=limit, service=request.args.get('service'))), 200
+
+# API to read the health and circuit state recorded for each service, without probing
+@app.route('/api/health/services', methods=['GET'])
+def api_service_health():
+    return jsonify(registry().all_status()), 200
+
+# API to read the server's power state and the jobs holding it on
+@app.route('/api/power', methods=['GET'])
+def power_status():
+    return jsonify(power_manager().status()), 200
+
+# API for a job to take a power lease; the first lease wakes the server
+@app.route('/api/power/leases', methods=['POST'])
+def acquire_power_lease():
+    data = request.json or {}
+    if not data.get('job'):
+        return jsonify({'error': 'job is required'}), 400
+    try:
+        lease = power_manager().acquire(data['job'], data.get('ttl'))
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': f'Invalid ttl: {e}'}), 400
+    return jsonify(lease), 201
+
+# API to read a lease, waiting up to ?wait= seconds for the server to be on
+@app.route('/api/power/leases/<lease_id>', methods=['GET'])
+def get_power_lease(lease_id):
+    try:
+        wait = min(max(float(request.args.get('wait', 0)), 0), 60)
+    except ValueError as e:
+        return jsonify({'error': f'Invalid query: {e}'}), 400
+    lease = power_manager().wait(lease_id, wait)
+    if lease is None:
+        return jsonify({'error': 'Lease not found'}), 404
+    return jsonify(lease), 200
+
+# API to renew a lease before its TTL runs out
+@app.route('/api/power/leases/<lease_id>', methods=['PUT'])
+def renew_power_lease(lease_id):
+    lease = power_manager().renew(lease_id)
+    if lease is None:
+        return jsonify({'error': 'Lease not found'}), 404
+    return jsonify(lease), 200
+
+# API to release a lease; the server is powered off after the hold-down once no lease is left
+@app.route('/api/power/leases/<lease_id>', methods=['DELETE'])
+def release_power_lease(lease_id):
+    if not power_manager().release(lease_id):
+        return jsonify({'error': 'Lease not found'}), 404
+    return jsonify({'message': 'Lease released'}), 200
+
+# API reporting how predictive pre-wake performed: sessions that found the server up, and the extra hours on
+@app.route('/api/power/usage', methods=['GET'])
+def power_usage_report():
+    try:
+        days = min(max(int(request.args.get('days', 30)), 1), 365)
+    except ValueError as e:
+        return jsonify({'error': f'Invalid query: {e}'}), 400
+    return jsonify(plex_usage().report(days)), 200
+
 if __name__ == "__main__":
     app.run(host=SERVER_IP, port=PORT_NUMBER_FLASK)
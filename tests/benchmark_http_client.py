@@ -0,0 +1,67 @@
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+sys.path.insert(0, os.path.dirname(__file__))
+
+import Http_client
+import Service_health
+from benchmark_stall_handler import mock_server_process
+
+"""Benchmark Http_client against plain requests calls, which open a new connection every time.
+
+Both send GET requests to the fake *arr server, running in a child process. Run from the repository root:
+    python tests/benchmark_http_client.py
+    python tests/benchmark_http_client.py --requests 2000 --latency 0.002
+"""
+
+
+def _percentile(ordered, pct):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def measure(send, url, count):
+    latencies = []
+    started = time.monotonic()
+    for _ in range(count):
+        request_started = time.monotonic()
+        send(url).raise_for_status()
+        latencies.append((time.monotonic() - request_started) * 1000)
+    elapsed = time.monotonic() - started
+    latencies.sort()
+    return {
+        "mean_ms": sum(latencies) / count, "p50_ms": _percentile(latencies, 50), "p95_ms": _percentile(latencies, 95),
+        "p99_ms": _percentile(latencies, 99), "per_second": count / elapsed
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pooled HTTP client against plain requests calls")
+    parser.add_argument("--requests", type=int, default=1000, help="Requests sent by each client")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds the server adds to every response")
+    args = parser.parse_args()
+
+    clients = {
+        "requests.get": lambda url: requests.get(url, headers={"X-Api-Key": "test-key"}, timeout=10),
+        "Http_client.get": lambda url: Http_client.get(url, headers={"X-Api-Key": "test-key"})
+    }
+    with tempfile.TemporaryDirectory() as state_dir, mock_server_process([], latency=args.latency) as url:
+        Service_health.configure(os.path.join(state_dir, "service_health.db"))
+        print(f"{'client':>16} {'mean ms':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'req/s':>8}")
+        for name, send in clients.items():
+            result = measure(send, f"{url}/api/v3/queue", args.requests)
+            print(
+                f"{name:>16} {result['mean_ms']:>8.2f} {result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f} "
+                f"{result['p99_ms']:>8.2f} {result['per_second']:>8.0f}"
+            )
+        Http_client.close_sessions()
+        Service_health.registry().close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import os
+import sys
+import argparse
+import tracemalloc
+import tempfile
+import contextlib
+import multiprocessing
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+sys.path.insert(0, os.path.dirname(__file__))
+
+import Service_health
+import Stall_handler
+from mock_arr_server import MockArrServer, make_queue
+
+"""Benchmark Stall_handler.process_queue against the fake *arr server with queues of growing size.
+
+The server runs in a child process, so the peak memory reported (tracemalloc) is only what the handler allocated.
+Run from the repository root:
+    python tests/benchmark_stall_handler.py
+    python tests/benchmark_stall_handler.py --sizes 10 1000 10000 --latency 0.005 --error-rate 0.02 --no-bulk
+"""
+
+
+def _serve(queue, options, port_queue):
+    server = MockArrServer(queue, **options)
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+
+@contextlib.contextmanager
+def mock_server_process(queue, **options):
+    """Run a MockArrServer in a child process and yield its URL."""
+    port_queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_serve, args=(queue, options, port_queue), daemon=True)
+    process.start()
+    try:
+        yield f"http://127.0.0.1:{port_queue.get(timeout=10)}"
+    finally:
+        process.terminate()
+        process.join()
+
+
+def run(size, stalled_every, latency, error_rate, bulk):
+    queue = make_queue(size, stalled_every=stalled_every)
+    with tempfile.TemporaryDirectory() as state_dir, mock_server_process(queue, latency=latency, error_rate=error_rate, bulk=bulk) as url:
+        Service_health.configure(os.path.join(state_dir, "service_health.db"))
+        tracemalloc.start()
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            stats = Stall_handler.process_queue(url, "test-key", is_movie=True)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        Stall_handler.close_sessions()
+        Service_health.registry().close()
+    return {**stats, "items": size, "peak": peak}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Stall_handler against a fake Radarr queue")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 1000, 10000], help="Queue sizes to run")
+    parser.add_argument("--stalled-every", type=int, default=4, help="Every n-th item is stalled")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds the server adds to every response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with 503")
+    parser.add_argument("--no-bulk", action="store_true", help="Server has no bulk queue endpoint")
+    args = parser.parse_args()
+
+    print(f"{'items':>8} {'stalled':>8} {'removed':>8} {'searched':>9} {'requests':>9} {'wall s':>8} {'peak MiB':>9}")
+    for size in args.sizes:
+        result = run(size, args.stalled_every, args.latency, args.error_rate, not args.no_bulk)
+        print(
+            f"{result['items']:>8} {result['stalled']:>8} {result['removed']:>8} {result['searched']:>9} "
+            f"{result['requests']:>9} {result['elapsed']:>8.2f} {result['peak'] / 1024 / 1024:>9.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+"""A small in-process fake of the Radarr/Sonarr v3 queue and command API, for tests."""
+
+
+class MockArrHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, body=None):
+        data = json.dumps(body).encode() if body is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length)) if length else None
+
+    def _handle(self, method):
+        server = self.server
+        url = urlparse(self.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        body = self._body()
+        with server.lock:
+            server.requests.append((method, url.path, query, body))
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+            failures = server.fail.get((method, url.path), 0)
+            if failures:
+                server.fail[(method, url.path)] = failures - 1
+            elif server.error_rate and server.random.random() < server.error_rate:
+                failures = 1
+            server.errors += bool(failures)
+        try:
+            if server.latency:
+                time.sleep(server.latency)
+            if failures:
+                return self._reply(503, {"message": "Service unavailable"})
+            if query.get("apikey", self.headers.get("X-Api-Key")) != server.api_key:
+                return self._reply(401, {"message": "Unauthorized"})
+            return self._route(method, url.path, query, body)
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def _route(self, method, path, query, body):
+        server = self.server
+        if method == "GET" and path == "/api/v3/queue":
+            with server.lock:
+                records = list(server.queue)
+            if not server.paged:
+                return self._reply(200, records)
+            if "status" in query:
+                records = [item for item in records if item["status"].lower() == query["status"].lower()]
+            page = int(query.get("page", 1))
+            page_size = int(query.get("pageSize", 10))
+            return self._reply(200, {
+                "page": page,
+                "pageSize": page_size,
+                "sortKey": "timeleft",
+                "sortDirection": "ascending",
+                "totalRecords": len(records),
+                "records": records[(page - 1) * page_size:page * page_size]
+            })
+        if method == "DELETE" and path == "/api/v3/queue/bulk":
+            if not server.bulk:
+                return self._reply(405, {"message": "Method not allowed"})
+            ids = set(body["ids"])
+            with server.lock:
+                server.queue = [item for item in server.queue if item["id"] not in ids]
+                if query.get("blocklist") == "true":
+                    server.blocklisted.extend(body["ids"])
+            return self._reply(200, {})
+        if method == "DELETE" and path.startswith("/api/v3/queue/"):
+            item_id = int(path.rsplit("/", 1)[1])
+            with server.lock:
+                remaining = [item for item in server.queue if item["id"] != item_id]
+                if len(remaining) == len(server.queue):
+                    return self._reply(404, {"message": "Not found"})
+                server.queue = remaining
+                if query.get("blocklist") == "true":
+                    server.blocklisted.append(item_id)
+            return self._reply(200, {})
+        if method == "POST" and path == "/api/v3/command":
+            with server.lock:
+                server.commands.append(body)
+            return self._reply(201, {"id": len(server.commands), "name": body.get("name"), "status": "queued"})
+        return self._reply(404, {"message": "Not found"})
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_DELETE(self):
+        self._handle("DELETE")
+
+    def do_POST(self):
+        self._handle("POST")
+
+
+class MockArrServer(ThreadingHTTPServer):
+    """Serves a queue of items, paged like the v3 API or (paged=False) as one list like older versions.
+    With bulk=False the bulk queue endpoint answers 405, as on servers that do not have it.
+
+    fail maps (method, path) to a number of 503 responses to return before answering normally, and error_rate
+    is the share of all other requests answered with a 503 (drawn from a random generator seeded with seed).
+    latency is added to every response.
+    """
+    daemon_threads = True
+
+    def __init__(self, queue=(), api_key="test-key", latency=0.0, paged=True, bulk=True,
+                 error_rate=0.0, seed=0, port=0):
+        super().__init__(("127.0.0.1", port), MockArrHandler)
+        self.queue = list(queue)
+        self.api_key = api_key
+        self.latency = latency
+        self.paged = paged
+        self.bulk = bulk
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.errors = 0
+        self.fail = {}
+        self.requests = []
+        self.commands = []
+        self.blocklisted = []
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
+
+
+def make_queue(count, stalled_every=1, movies=True, start_id=1):
+    """Build queue records; every stalled_every-th item is stalled."""
+    items = []
+    for number in range(start_id, start_id + count):
+        item = {
+            "id": number,
+            "title": f"Item {number}",
+            "status": "Stalled" if number % stalled_every == 0 else "Downloading",
+            "size": 1000000,
+            "sizeleft": 500000
+        }
+        item["movieId" if movies else "episodeId"] = 10000 + number
+        items.append(item)
+    return items
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a fake Radarr/Sonarr queue on localhost")
+    parser.add_argument("--port", type=int, default=7878)
+    parser.add_argument("--items", type=int, default=1000, help="Queue size")
+    parser.add_argument("--stalled-every", type=int, default=4, help="Every n-th item is stalled")
+    parser.add_argument("--episodes", action="store_true", help="Serve Sonarr style episode items")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with 503")
+    parser.add_argument("--no-bulk", action="store_true", help="Answer 405 on the bulk queue endpoint")
+    parser.add_argument("--api-key", default="test-key")
+    args = parser.parse_args()
+
+    queue = make_queue(args.items, stalled_every=args.stalled_every, movies=not args.episodes)
+    server = MockArrServer(queue, api_key=args.api_key, latency=args.latency, bulk=not args.no_bulk,
+                           error_rate=args.error_rate, port=args.port)
+    print(f"Serving {args.items} queue items on {server.url} (API key {args.api_key})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+import os
+import json
+import queue
+import base64
+import socket
+import hashlib
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+"""Fake Plex server with /status/sessions and the /:/websockets/notifications stream, for tests.
+
+play() changes a session's state and pushes a "playing" notification to every connected WebSocket client, the
+way Plex does; drop_clients() cuts the streams without a close frame. Run on its own to try Plex_Heartbeat:
+    python tests/mock_plex_server.py --port 32400 --token test-token
+"""
+
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+ACTIVE_STATES = ("playing", "paused", "buffering")
+_DROP = object()
+
+
+def _frame(opcode, payload):
+    header = bytearray([0x80 | opcode])
+    if len(payload) < 126:
+        header.append(len(payload))
+    elif len(payload) < 1 << 16:
+        header.append(126)
+        header += len(payload).to_bytes(2, "big")
+    else:
+        header.append(127)
+        header += len(payload).to_bytes(8, "big")
+    return bytes(header) + payload
+
+
+def _read_frame(rfile):
+    """Read one (masked) client frame; returns (opcode, payload), or None when the connection closed."""
+    header = rfile.read(2)
+    if len(header) < 2:
+        return None
+    length = header[1] & 0x7F
+    if length == 126:
+        length = int.from_bytes(rfile.read(2), "big")
+    elif length == 127:
+        length = int.from_bytes(rfile.read(8), "big")
+    key = rfile.read(4) if header[1] & 0x80 else b"\0\0\0\0"
+    payload = rfile.read(length)
+    return header[0] & 0x0F, bytes(byte ^ key[index % 4] for index, byte in enumerate(payload))
+
+
+class PlexHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        token = (query.get("X-Plex-Token") or [self.headers.get("X-Plex-Token")])[0]
+        if token != self.server.token:
+            return self._send_json(401, {"error": "Unauthorized"})
+        if url.path == "/:/websockets/notifications" and self.headers.get("Upgrade", "").lower() == "websocket":
+            if not self.server.websocket:
+                return self._send_json(404, {"error": "Not found"})
+            return self._stream()
+        if url.path == "/status/sessions":
+            self.server.polls += 1
+            with self.server.lock:
+                metadata = [
+                    {"sessionKey": key, "type": "movie", "Player": {"state": state}}
+                    for key, state in self.server.sessions.items()
+                ]
+            return self._send_json(200, {"MediaContainer": {"size": len(metadata), "Metadata": metadata}})
+        return self._send_json(404, {"error": "Not found"})
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _stream(self):
+        key = self.headers.get("Sec-WebSocket-Key", "")
+        accept = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode()).digest()).decode()
+        # Registered before the upgrade is answered, so a client that sees the 101 also gets every later message
+        outbox = queue.Queue()
+        with self.server.lock:
+            self.server.clients.append(outbox)
+        self.send_response(101, "Switching Protocols")
+        self.send_header("Upgrade", "websocket")
+        self.send_header("Connection", "Upgrade")
+        self.send_header("Sec-WebSocket-Accept", accept)
+        self.end_headers()
+        self.wfile.flush()
+        threading.Thread(target=self._read_client, args=(outbox,), daemon=True).start()
+        try:
+            while True:
+                frame = outbox.get()
+                if frame is None:
+                    self.wfile.write(_frame(0x8, b""))
+                    break
+                if frame is _DROP:
+                    break
+                self.wfile.write(frame)
+                self.wfile.flush()
+        except OSError:
+            pass
+        finally:
+            with self.server.lock:
+                self.server.clients.remove(outbox)
+            try:
+                self.connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.close_connection = True
+
+    def _read_client(self, outbox):
+        try:
+            while True:
+                frame = _read_frame(self.rfile)
+                if frame is None or frame[0] == 0x8:
+                    outbox.put(None)
+                    return
+                if frame[0] == 0x9:
+                    self.server.pings += 1
+                    if self.server.answer_pings:
+                        outbox.put(_frame(0xA, frame[1]))
+        except (OSError, ValueError):
+            outbox.put(_DROP)
+
+
+class MockPlexServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, token="test-token", websocket=True, answer_pings=True, port=0):
+        super().__init__(("127.0.0.1", port), PlexHandler)
+        self.token = token
+        self.websocket = websocket
+        self.answer_pings = answer_pings
+        self.sessions = {}
+        self.clients = []
+        self.polls = 0
+        self.pings = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.drop_clients()
+        self.shutdown()
+        self.server_close()
+
+    def connected_clients(self):
+        with self.lock:
+            return len(self.clients)
+
+    def play(self, session_key, state="playing", notify=True):
+        """Set a session's state ("stopped" ends it) and push the notification to connected clients."""
+        session_key = str(session_key)
+        with self.lock:
+            if state in ACTIVE_STATES:
+                self.sessions[session_key] = state
+            else:
+                self.sessions.pop(session_key, None)
+        if notify:
+            self.push(json.dumps({"NotificationContainer": {
+                "type": "playing", "size": 1,
+                "PlaySessionStateNotification": [{"sessionKey": session_key, "ratingKey": "1", "state": state}]
+            }}))
+
+    def push(self, message):
+        """Send a text message to every connected notification client."""
+        with self.lock:
+            clients = list(self.clients)
+        for outbox in clients:
+            outbox.put(_frame(0x1, message.encode()))
+
+    def drop_clients(self):
+        """Cut every notification stream without a close frame."""
+        with self.lock:
+            clients = list(self.clients)
+        for outbox in clients:
+            outbox.put(_DROP)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Plex server with sessions and a notification stream")
+    parser.add_argument("--port", type=int, default=32400)
+    parser.add_argument("--token", default=os.getenv("PLEX_API_TOKEN", "test-token"))
+    args = parser.parse_args()
+
+    server = MockPlexServer(token=args.token, port=args.port).start()
+    print(f"Fake Plex server on {server.url}. Commands: play <key>, pause <key>, stop <key>, drop, quit")
+    try:
+        while True:
+            command = input("> ").split()
+            if not command:
+                continue
+            if command[0] in ("play", "pause", "stop") and len(command) == 2:
+                server.play(command[1], {"play": "playing", "pause": "paused", "stop": "stopped"}[command[0]])
+            elif command[0] == "drop":
+                server.drop_clients()
+            elif command[0] == "quit":
+                break
+    except (EOFError, KeyboardInterrupt):
+        pass
+    server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+import json
+import time
+import base64
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+"""Fake iDRAC Redfish API with sessions, the system resource and ComputerSystem.Reset, for tests.
+
+Basic auth takes basic_auth_delay seconds per request, like the full authentication an iDRAC runs for it, while
+session tokens are checked at once. Power-on takes boot_delay seconds (PowerState "PoweringOn" meanwhile) and a
+GracefulShutdown shutdown_delay seconds, or never completes with graceful_works=False.
+Run on its own to try the power scripts:
+    python tests/mock_redfish_server.py --port 8443 --user root --password calvin
+"""
+
+SESSIONS_PATH = "/redfish/v1/SessionService/Sessions"
+SYSTEM_PATH = "/redfish/v1/Systems/System.Embedded.1"
+RESET_PATH = f"{SYSTEM_PATH}/Actions/ComputerSystem.Reset"
+RESET_TYPES = ["On", "ForceOff", "GracefulShutdown", "GracefulRestart", "ForceRestart", "PushPowerButton"]
+
+
+class RedfishHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, payload=None, headers=None):
+        body = json.dumps(payload).encode() if payload is not None else b""
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if body:
+            self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length)) if length else {}
+
+    def _authorized(self):
+        server = self.server
+        token = self.headers.get("X-Auth-Token")
+        if token:
+            with server.lock:
+                return token in server.tokens
+        authorization = self.headers.get("Authorization", "")
+        if authorization.startswith("Basic "):
+            server.basic_auths += 1
+            time.sleep(server.basic_auth_delay)
+            return base64.b64decode(authorization[6:]).decode() == f"{server.user}:{server.password}"
+        return False
+
+    def _handle(self):
+        server = self.server
+        server.requests.append((self.command, self.path))
+        body = self._body()
+        if self.command == "POST" and self.path == SESSIONS_PATH:
+            if not server.sessions_supported:
+                return self._send(405, {"error": "Method not allowed"})
+            if (body.get("UserName"), body.get("Password")) != (server.user, server.password):
+                return self._send(401, {"error": "Invalid credentials"})
+            with server.lock:
+                server.logins += 1
+                session_id = str(server.logins)
+                token = f"token-{session_id}"
+                server.tokens[token] = session_id
+                lost = server.lost_login_replies > 0
+                server.lost_login_replies -= lost
+            if lost:
+                return self._send(500, {"error": "Internal error"})
+            return self._send(201, {"Id": session_id}, {
+                "X-Auth-Token": token, "Location": f"{SESSIONS_PATH}/{session_id}"
+            })
+        if not self._authorized():
+            return self._send(401, {"error": "Unauthorized"})
+        if self.command == "DELETE" and self.path.startswith(f"{SESSIONS_PATH}/"):
+            session_id = self.path.rsplit("/", 1)[-1]
+            with server.lock:
+                server.tokens = {token: sid for token, sid in server.tokens.items() if sid != session_id}
+                server.logouts += 1
+            return self._send(200, {})
+        if self.command == "GET" and self.path == SYSTEM_PATH:
+            return self._send(200, {
+                "Id": "System.Embedded.1",
+                "PowerState": server.power_state(),
+                "Actions": {"#ComputerSystem.Reset": {
+                    "target": RESET_PATH, "ResetType@Redfish.AllowableValues": server.reset_types
+                }}
+            })
+        if self.command == "POST" and self.path == RESET_PATH:
+            reset_type = body.get("ResetType")
+            if reset_type not in server.reset_types:
+                return self._send(400, {"error": f"Unsupported ResetType {reset_type}"})
+            server.resets.append(reset_type)
+            return self._send(*server.reset(reset_type))
+        return self._send(404, {"error": "Not found"})
+
+    do_GET = do_POST = do_DELETE = _handle
+
+
+class MockRedfishServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, user="root", password="calvin", power="Off", boot_delay=0.0, shutdown_delay=0.0,
+                 graceful_works=True, sessions_supported=True, basic_auth_delay=0.0, reset_types=None, port=0):
+        super().__init__(("127.0.0.1", port), RedfishHandler)
+        self.user = user
+        self.password = password
+        self.boot_delay = boot_delay
+        self.shutdown_delay = shutdown_delay
+        self.graceful_works = graceful_works
+        self.sessions_supported = sessions_supported
+        self.basic_auth_delay = basic_auth_delay
+        self.reset_types = list(RESET_TYPES if reset_types is None else reset_types)
+        self.lock = threading.Lock()
+        self.tokens = {}
+        self.requests = []
+        self.resets = []
+        self.logins = 0
+        self.logouts = 0
+        self.basic_auths = 0
+        # Logins that create a session but answer 500, like a reply lost after the iDRAC acted
+        self.lost_login_replies = 0
+        # Power state and, while it is changing, the state it reaches at a given time
+        self._power = power
+        self._transition = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def expire_sessions(self):
+        with self.lock:
+            self.tokens.clear()
+
+    def power_state(self):
+        with self.lock:
+            if self._transition and time.monotonic() >= self._transition[1]:
+                self._power, self._transition = self._transition[0], None
+            if self._transition:
+                return "PoweringOn" if self._transition[0] == "On" else "PoweringOff"
+            return self._power
+
+    def reset(self, reset_type):
+        """Apply a reset; returns (status, payload) like an iDRAC."""
+        state = self.power_state()
+        with self.lock:
+            if reset_type == "On":
+                if state in ("On", "PoweringOn"):
+                    return 409, {"error": "Server is already powered on"}
+                self._transition = ("On", time.monotonic() + self.boot_delay)
+            elif reset_type == "ForceOff":
+                self._power, self._transition = "Off", None
+            elif reset_type == "GracefulShutdown":
+                if state == "Off":
+                    return 409, {"error": "Server is already powered off"}
+                if self.graceful_works:
+                    self._transition = ("Off", time.monotonic() + self.shutdown_delay)
+        return 204, None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake iDRAC Redfish API")
+    parser.add_argument("--port", type=int, default=8443)
+    parser.add_argument("--user", default="root")
+    parser.add_argument("--password", default="calvin")
+    parser.add_argument("--boot-delay", type=float, default=30.0, help="Seconds a power-on takes")
+    parser.add_argument("--basic-auth-delay", type=float, default=1.0, help="Seconds Basic auth takes per request")
+    args = parser.parse_args()
+
+    server = MockRedfishServer(
+        args.user, args.password, boot_delay=args.boot_delay, basic_auth_delay=args.basic_auth_delay, port=args.port
+    )
+    print(f"Fake iDRAC on {server.url} (IDRAC_HOST), press Ctrl+C to stop")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+
+
+if __name__ == "__main__":
+    main()
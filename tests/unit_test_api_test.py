@@ -0,0 +1,143 @@
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+import API_test
+import Service_health
+
+class StatusHandler(BaseHTTPRequestHandler):
+    delay = 0.0
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        time.sleep(self.delay)
+        body = json.dumps({"path": self.path, "token": self.headers.get("X-Plex-Token")}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+class SlowHandler(StatusHandler):
+    delay = 3.0
+
+def start_server(handler):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+class TestCheckApiStatus(unittest.TestCase):
+    def setUp(self):
+        self.fast, self.fast_url = start_server(StatusHandler)
+        self.slow, self.slow_url = start_server(SlowHandler)
+        self.health_dir = tempfile.mkdtemp()
+        Service_health.configure(os.path.join(self.health_dir, "service_health.db"))
+
+    def tearDown(self):
+        for server in (self.fast, self.slow):
+            server.shutdown()
+            server.server_close()
+        Service_health.registry().close()
+        shutil.rmtree(self.health_dir)
+
+    def test_slow_endpoints_do_not_delay_the_check(self):
+        endpoints = {
+            "fast": {"url": f"{self.fast_url}/status", "auth": "apikey", "token": "key"},
+            "slow1": {"url": self.slow_url},
+            "slow2": {"url": self.slow_url}
+        }
+        started = time.monotonic()
+        results = API_test.check_api_status(endpoints, deadline=1)
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertEqual(results["fast"]["status_code"], 200)
+        self.assertEqual(results["fast"]["response"]["path"], "/status?apikey=key")
+        self.assertIn("error", results["slow1"])
+        self.assertIn("error", results["slow2"])
+
+    def test_repeated_probes_give_percentiles(self):
+        endpoints = {"plex": {"url": self.fast_url, "auth": "header", "header": "X-Plex-Token", "token": "abc"}}
+        result = API_test.check_api_status(endpoints, repeat=20, deadline=10)["plex"]
+        self.assertEqual((result["samples"], result["failures"]), (20, 0))
+        self.assertLessEqual(result["p50_ms"], result["p95_ms"])
+        self.assertLessEqual(result["p95_ms"], result["p99_ms"])
+        self.assertEqual(result["response"]["token"], "abc")
+
+    def test_unreachable_endpoint(self):
+        result = API_test.check_api_status({"gone": {"url": "http://127.0.0.1:1"}}, repeat=3, deadline=5)["gone"]
+        self.assertIn("error", result)
+        self.assertEqual((result["samples"], result["failures"]), (3, 3))
+        self.assertIsNone(result["p50_ms"])
+
+    def test_results_are_shared_and_reused(self):
+        endpoints = {"plex": {"url": f"{self.fast_url}/identity"}, "gone": {"url": "http://127.0.0.1:1/status"}}
+        API_test.check_api_status(endpoints, repeat=3, deadline=5)
+        health = Service_health.registry()
+        self.assertEqual(health.status(Service_health.service_key(self.fast_url))["successes_total"], 3)
+        self.assertEqual(health.status("http://127.0.0.1:1")["state"], Service_health.OPEN)
+
+        results = API_test.check_api_status(endpoints, deadline=5, max_age=60)
+        self.assertTrue(results["plex"]["cached"])
+        self.assertNotIn("error", results["plex"])
+        self.assertTrue(results["gone"]["cached"])
+        self.assertIn("error", results["gone"])
+
+class TestHelpers(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(API_test.percentile(values, 50), 50)
+        self.assertEqual(API_test.percentile(values, 95), 95)
+        self.assertEqual(API_test.percentile([7], 99), 7)
+        self.assertIsNone(API_test.percentile([], 50))
+
+    def test_load_endpoints_expands_environment(self):
+        endpoints_file = os.path.join(self.temp_dir, "api_endpoints.json")
+        with open(endpoints_file, "w") as file:
+            json.dump({
+                "sonarr": {"url": "${TEST_SONARR_URL}/api/v3/system/status", "auth": "apikey", "token": "${TEST_SONARR_KEY}"},
+                "jackett": {"url": "http://localhost:9117", "enabled": False}
+            }, file)
+        os.environ.update({"TEST_SONARR_URL": "http://sonarr:8989", "TEST_SONARR_KEY": "secret"})
+        try:
+            endpoints = API_test.load_endpoints(endpoints_file)
+        finally:
+            del os.environ["TEST_SONARR_URL"], os.environ["TEST_SONARR_KEY"]
+        self.assertEqual(endpoints, {"sonarr": {"url": "http://sonarr:8989/api/v3/system/status", "auth": "apikey", "token": "secret"}})
+        self.assertIs(API_test.load_endpoints(os.path.join(self.temp_dir, "missing.json")), API_test.API_ENDPOINTS)
+
+    def test_history_is_recorded_and_trimmed(self):
+        history_file = os.path.join(self.temp_dir, "history.jsonl")
+        max_entries = API_test.HISTORY_MAX_ENTRIES
+        API_test.HISTORY_MAX_ENTRIES = 10
+        try:
+            for number in range(25):
+                API_test.record_history({
+                    "plex": {"status_code": 200, "response": "large body", "p50_ms": number},
+                    "radarr": {"error": "refused"}
+                }, history_file)
+        finally:
+            API_test.HISTORY_MAX_ENTRIES = max_entries
+        history = API_test.read_history(limit=100, history_file=history_file)
+        self.assertLessEqual(len(history), 11)
+        self.assertEqual(history[-1]["results"]["plex"], {"status_code": 200, "p50_ms": 24})
+        plex_only = API_test.read_history(limit=2, service="plex", history_file=history_file)
+        self.assertEqual([list(entry["results"]) for entry in plex_only], [["plex"], ["plex"]])
+
+if __name__ == "__main__":
+    unittest.main()
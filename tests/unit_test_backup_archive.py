@@ -0,0 +1,162 @@
+import os
+import sys
+import gzip
+import shutil
+import tarfile
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from Backup_archive import (
+    IndexedArchiveReader,
+    extract_members,
+    index_path_for,
+    list_members,
+    load_index,
+    open_archive_writer
+)
+from Backup_verify import verify_archive, verify_archives
+
+class ArchiveTestCase(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.source = os.path.join(self.workdir, "sonarr")
+        os.makedirs(os.path.join(self.source, "logs"))
+        self.files = {
+            "sonarr.db": os.urandom(300000),
+            "config.xml": b"<Config></Config>",
+            "logs/sonarr.txt": b"log line\n" * 50000,
+            "logs/empty.txt": b"",
+        }
+        for name, data in self.files.items():
+            with open(os.path.join(self.source, name), "wb") as file:
+                file.write(data)
+        self.archive = os.path.join(self.workdir, "sonarr_backup_20250101_000000.tar.gz")
+
+        # Use a small frame size so the archive spans many frames
+        with open_archive_writer(self.archive, "indexed", frame_size=64 * 1024) as tar:
+            for name in sorted(self.files):
+                tar.add(os.path.join(self.source, name), arcname=name)
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+class TestIndexedArchive(ArchiveTestCase):
+    def test_archive_is_a_standard_tar_gz(self):
+        with tarfile.open(self.archive, "r:gz") as tar:
+            for name, data in self.files.items():
+                self.assertEqual(tar.extractfile(name).read(), data)
+
+    def test_index_is_written_with_frames(self):
+        index = load_index(self.archive)
+        self.assertTrue(os.path.exists(index_path_for(self.archive)))
+        self.assertGreater(len(index["frames"]), 1)
+        self.assertEqual(sorted(member["name"] for member in index["members"]), sorted(self.files))
+
+    def test_list_members_uses_index(self):
+        members = {member["name"]: member for member in list_members(self.archive)}
+        self.assertEqual(members["sonarr.db"]["size"], len(self.files["sonarr.db"]))
+        self.assertEqual(members["sonarr.db"]["type"], "file")
+
+    def test_read_single_member(self):
+        with IndexedArchiveReader(self.archive) as reader:
+            self.assertEqual(reader.read_member("logs/sonarr.txt"), self.files["logs/sonarr.txt"])
+            # Seeking backwards after a forward read must still work
+            self.assertEqual(reader.read_member("config.xml"), self.files["config.xml"])
+
+    def test_extract_subtree(self):
+        dest = os.path.join(self.workdir, "restore")
+        extracted = extract_members(self.archive, dest, ["logs"])
+        self.assertEqual(extracted, 2)
+        with open(os.path.join(dest, "logs", "sonarr.txt"), "rb") as file:
+            self.assertEqual(file.read(), self.files["logs/sonarr.txt"])
+        self.assertFalse(os.path.exists(os.path.join(dest, "sonarr.db")))
+
+    def test_extract_without_index_falls_back_to_scan(self):
+        os.remove(index_path_for(self.archive))
+        dest = os.path.join(self.workdir, "restore")
+        self.assertEqual(extract_members(self.archive, dest, ["sonarr.db"]), 1)
+        with open(os.path.join(dest, "sonarr.db"), "rb") as file:
+            self.assertEqual(file.read(), self.files["sonarr.db"])
+
+    def test_hardlinks_are_restored(self):
+        linked = os.path.join(self.workdir, "linked")
+        os.makedirs(os.path.join(linked, "src"))
+        with open(os.path.join(linked, "src", "a"), "wb") as file:
+            file.write(b"shared data")
+        os.link(os.path.join(linked, "src", "a"), os.path.join(linked, "src", "b"))
+        archive = os.path.join(self.workdir, "linked.tar.gz")
+        with open_archive_writer(archive, "indexed") as tar:
+            for name in ("src", "src/a", "src/b"):
+                tar.add(os.path.join(linked, name), arcname=name)
+        members = {member["name"]: member for member in load_index(archive)["members"]}
+        self.assertEqual((members["src/b"]["type"], members["src/b"]["linkname"]), ("hardlink", "src/a"))
+
+        dest = os.path.join(self.workdir, "restore")
+        self.assertEqual(extract_members(archive, dest), 3)
+        stat_a, stat_b = os.stat(os.path.join(dest, "src", "a")), os.stat(os.path.join(dest, "src", "b"))
+        self.assertEqual(stat_a.st_ino, stat_b.st_ino)
+
+        # Only the link selected: its data comes from the target member
+        only_link = os.path.join(self.workdir, "restore_link")
+        self.assertEqual(extract_members(archive, only_link, ["src/b"]), 1)
+        with open(os.path.join(only_link, "src", "b"), "rb") as file:
+            self.assertEqual(file.read(), b"shared data")
+        self.assertFalse(os.path.exists(os.path.join(only_link, "src", "a")))
+
+    def test_plain_format_has_no_index(self):
+        plain = os.path.join(self.workdir, "plain.tar.gz")
+        with open_archive_writer(plain, "tar.gz") as tar:
+            tar.add(os.path.join(self.source, "config.xml"), arcname="config.xml")
+        self.assertIsNone(load_index(plain))
+        with gzip.open(plain) as file:
+            self.assertTrue(file.read())
+
+class TestVerifyArchive(ArchiveTestCase):
+    def test_valid_archive_passes(self):
+        result = verify_archive(self.archive)
+        self.assertTrue(result["ok"], result["error"])
+        self.assertEqual(result["members"], len(self.files))
+
+    def test_corrupted_frame_is_detected(self):
+        index = load_index(self.archive)
+        offset = index["frames"][2][0] + 100
+        with open(self.archive, "r+b") as file:
+            file.seek(offset)
+            byte = file.read(1)
+            file.seek(offset)
+            file.write(bytes([byte[0] ^ 0xFF]))
+        result = verify_archive(self.archive)
+        self.assertFalse(result["ok"])
+        self.assertIsNotNone(result["error"])
+
+    def test_truncated_archive_is_detected(self):
+        with open(self.archive, "r+b") as file:
+            file.truncate(os.path.getsize(self.archive) // 2)
+        self.assertFalse(verify_archive(self.archive)["ok"])
+
+    def test_plain_archive_is_checked_against_its_digest(self):
+        plain = os.path.join(self.workdir, "plain.tar.gz")
+        with open_archive_writer(plain, "tar.gz") as tar:
+            tar.add(os.path.join(self.source, "config.xml"), arcname="config.xml")
+        digest = tar.sha256
+        self.assertTrue(verify_archive(plain, digest)["ok"])
+        # Rewritten with different content: still a valid tar.gz, but not the archive that was cataloged
+        with open(os.path.join(self.source, "config.xml"), "wb") as file:
+            file.write(b"<Config><ApiKey>changed</ApiKey></Config>")
+        with open_archive_writer(plain, "tar.gz") as tar:
+            tar.add(os.path.join(self.source, "config.xml"), arcname="config.xml")
+        self.assertTrue(verify_archive(plain)["ok"])
+        result = verify_archive(plain, digest)
+        self.assertFalse(result["ok"])
+        self.assertIn("digest", result["error"])
+
+    def test_verify_archives_in_parallel(self):
+        results = verify_archives([self.archive, self.archive + ".missing"], max_workers=2)
+        by_path = {result["path"]: result for result in results}
+        self.assertTrue(by_path[self.archive]["ok"])
+        self.assertFalse(by_path[self.archive + ".missing"]["ok"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from Backup_catalog import BackupCatalog, parse_backup_filename, select_expired
+
+class TestBackupCatalog(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.backup_location = os.path.join(self.workdir, "backups")
+        os.makedirs(self.backup_location)
+        self.catalog = BackupCatalog(os.path.join(self.workdir, "catalog.db"))
+
+    def tearDown(self):
+        self.catalog.close()
+        shutil.rmtree(self.workdir)
+
+    def _touch(self, filename, size=10):
+        path = os.path.join(self.backup_location, filename)
+        with open(path, "wb") as file:
+            file.write(b"x" * size)
+        return path
+
+    def test_parse_backup_filename(self):
+        container, created_at = parse_backup_filename("binhex-plex_backup_20250102_030405.tar.gz")
+        self.assertEqual(container, "binhex-plex")
+        self.assertEqual(datetime.fromtimestamp(created_at), datetime(2025, 1, 2, 3, 4, 5))
+        self.assertIsNone(parse_backup_filename("notes.txt"))
+
+    def test_reconcile_adds_and_removes_entries(self):
+        self._touch("sonarr_backup_20250101_000000.tar.gz")
+        self._touch("radarr_backup_20250101_000000.tar.gz")
+        self.catalog.record(os.path.join(self.backup_location, "gone_backup_20240101_000000.tar.gz"), "gone", 0, 1)
+
+        self.assertFalse(self.catalog.is_reconciled(self.backup_location))
+        added, removed = self.catalog.reconcile(self.backup_location, compute_digest=True)
+        self.assertEqual((added, removed), (2, 1))
+        self.assertTrue(self.catalog.is_reconciled(self.backup_location))
+        self.assertEqual([backup["container"] for backup in self.catalog.list_backups("sonarr")], ["sonarr"])
+        self.assertIsNotNone(self.catalog.find_backup("radarr")["sha256"])
+
+    def test_find_backup_before(self):
+        older = datetime(2025, 1, 1).timestamp()
+        newer = datetime(2025, 2, 1).timestamp()
+        self.catalog.record("/b/sonarr_old.tar.gz", "sonarr", older, 1)
+        self.catalog.record("/b/sonarr_new.tar.gz", "sonarr", newer, 1)
+        self.assertEqual(self.catalog.find_backup("sonarr")["path"], "/b/sonarr_new.tar.gz")
+        self.assertEqual(self.catalog.find_backup("sonarr", datetime(2025, 1, 15))["path"], "/b/sonarr_old.tar.gz")
+
+class TestSelectExpired(unittest.TestCase):
+    def _backups(self, dates):
+        return [
+            {"path": f"/b/sonarr_{date:%Y%m%d}.tar.gz", "container": "sonarr", "created_at": date.timestamp()}
+            for date in dates
+        ]
+
+    def test_retention_days_only(self):
+        now = datetime(2025, 3, 10)
+        backups = self._backups([datetime(2025, 3, 9), datetime(2025, 2, 1)])
+        expired = select_expired(backups, 7, now=now)
+        self.assertEqual([backup["path"] for backup in expired], ["/b/sonarr_20250201.tar.gz"])
+
+    def test_grandfather_father_son_policy(self):
+        now = datetime(2025, 3, 10)
+        dates = [datetime(2025, 3, day) for day in range(1, 10)] + [datetime(2025, 2, 15), datetime(2025, 2, 1), datetime(2025, 1, 20)]
+        expired = {backup["path"] for backup in select_expired(self._backups(dates), 0, {"daily": 3, "monthly": 2}, now=now)}
+        kept = {backup["path"] for backup in self._backups(dates)} - expired
+        # Three newest days, plus the newest backup of February (March is already covered by a daily)
+        self.assertEqual(kept, {
+            "/b/sonarr_20250309.tar.gz", "/b/sonarr_20250308.tar.gz", "/b/sonarr_20250307.tar.gz",
+            "/b/sonarr_20250215.tar.gz"
+        })
+
+if __name__ == "__main__":
+    unittest.main()
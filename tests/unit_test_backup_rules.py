@@ -0,0 +1,69 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from Backup_rules import BackupFilter
+
+class TestBackupFilter(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def _write(self, rel_path, size=10):
+        path = os.path.join(self.workdir, rel_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as file:
+            file.write(b"x" * size)
+        return path
+
+    def _walk(self, backup_filter):
+        kept = []
+        for root, dirs, files in os.walk(self.workdir):
+            rel_root = os.path.relpath(root, self.workdir).replace(os.sep, "/")
+            backup_filter.prune_dirs(rel_root, dirs)
+            for file in files:
+                rel_path = file if rel_root == "." else f"{rel_root}/{file}"
+                if not backup_filter.skip_file(rel_path, os.path.join(root, file)):
+                    kept.append(rel_path)
+        return sorted(kept)
+
+    def test_excluded_directories_are_pruned(self):
+        self._write("Plex Media Server/Cache/a.bin")
+        self._write("Plex Media Server/Cache/deep/b.bin")
+        self._write("Plex Media Server/Preferences.xml")
+        self._write("Codecs/x.so")
+        backup_filter = BackupFilter(exclude=["Cache/", "Codecs/**"])
+        self.assertEqual(self._walk(backup_filter), ["Plex Media Server/Preferences.xml"])
+        self.assertEqual(backup_filter.stats["exclude:Cache/"]["dirs"], 1)
+        self.assertEqual(backup_filter.stats["exclude:Codecs/**"]["dirs"], 1)
+
+    def test_file_patterns_and_size_rules_are_counted(self):
+        self._write("db/radarr.db", size=100)
+        self._write("thumbs/a.jpg", size=50)
+        self._write("big.bin", size=3 * 1024 * 1024)
+        backup_filter = BackupFilter(exclude=["**/*.jpg"], max_file_size_mb=1)
+        self.assertEqual(self._walk(backup_filter), ["db/radarr.db"])
+        self.assertEqual(backup_filter.stats["exclude:**/*.jpg"], {"files": 1, "bytes": 50, "dirs": 0})
+        self.assertEqual(backup_filter.stats["max_file_size"]["files"], 1)
+
+    def test_include_and_anchored_patterns(self):
+        self._write("config.xml")
+        self._write("logs/config.xml")
+        self._write("logs/trace.txt")
+        backup_filter = BackupFilter(exclude=["logs/trace.txt"], include=["*.xml"])
+        self.assertEqual(self._walk(backup_filter), ["config.xml", "logs/config.xml"])
+
+    def test_from_config_merges_global_and_container_rules(self):
+        backup_filter = BackupFilter.from_config({"name": "plex", "exclude": ["Cache/"]}, {"EXCLUDE": ["*.pid"]})
+        self._write("plex.pid")
+        self._write("Cache/a")
+        self.assertEqual(self._walk(backup_filter), [])
+
+if __name__ == "__main__":
+    unittest.main()
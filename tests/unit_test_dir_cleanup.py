@@ -0,0 +1,164 @@
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+# Dir_cleanup validates its environment on import
+LOG_DIR = tempfile.mkdtemp()
+os.environ.setdefault("CLEANUP_DIRECTORY_1", LOG_DIR)
+os.environ.setdefault("LOG_LEVEL", "INFO")
+os.environ.setdefault("LOG_PATH", LOG_DIR)
+os.environ.setdefault("STATE_PATH", LOG_DIR)
+
+from Dir_cleanup import CleanupPlan, CleanupScanner, DirectoryCache, apply_plan, check_and_clean_directories
+
+class TestCleanup(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def _touch(self, rel_path):
+        path = os.path.join(self.workdir, rel_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        open(path, "w").close()
+        return path
+
+    def test_removes_empty_trees_bottom_up_without_depth_limit(self):
+        deep = "/".join(f"d{level}" for level in range(25))
+        self._touch(f"downloads/{deep}/readme.txt")
+        self._touch("downloads/show/episode.mkv")
+        self._touch("downloads/show/extras/sample.txt")
+
+        plan = CleanupScanner(max_workers=4).run([os.path.join(self.workdir, "downloads")])
+        # Scanning alone must not touch the tree
+        self.assertTrue(os.path.exists(os.path.join(self.workdir, "downloads", "show", "extras", "sample.txt")))
+        self.assertEqual(len(plan.files), 2)
+        self.assertEqual(len(plan.dirs), 26)
+        self.assertEqual(plan.media_dirs, [os.path.join(self.workdir, "downloads", "show")])
+
+        result = apply_plan(plan, max_workers=4, batch_size=1)
+        self.assertEqual(result["files_deleted"], 2)
+        self.assertEqual(result["dirs_removed"], 26)
+        self.assertFalse(os.path.exists(os.path.join(self.workdir, "downloads", "d0")))
+        self.assertFalse(os.path.exists(os.path.join(self.workdir, "downloads", "show", "extras")))
+        self.assertTrue(os.path.exists(os.path.join(self.workdir, "downloads", "show", "episode.mkv")))
+        self.assertTrue(os.path.isdir(os.path.join(self.workdir, "downloads")))
+
+    def test_multiple_roots_and_symlink_loops(self):
+        self._touch("a/movie/film.mp4")
+        self._touch("b/junk/file.tmp")
+        os.symlink(os.path.join(self.workdir, "a"), os.path.join(self.workdir, "b", "loop"))
+
+        plan = CleanupScanner(max_workers=2).run([os.path.join(self.workdir, "a"), os.path.join(self.workdir, "b")])
+        apply_plan(plan, max_workers=2)
+
+        self.assertTrue(os.path.exists(os.path.join(self.workdir, "a", "movie", "film.mp4")))
+        self.assertFalse(os.path.exists(os.path.join(self.workdir, "b", "junk")))
+        self.assertTrue(os.path.islink(os.path.join(self.workdir, "b", "loop")))
+
+    def test_dry_run_writes_plan_that_can_be_applied_later(self):
+        self._touch("downloads/release/release.nfo")
+        self._touch("downloads/release/movie.mkv")
+        with open(self._touch("downloads/old/setup.exe"), "w") as file:
+            file.write("x" * 100)
+        plan_file = os.path.join(self.workdir, "plan.jsonl")
+
+        check_and_clean_directories([os.path.join(self.workdir, "downloads")], dry_run=True, plan_file=plan_file)
+        self.assertTrue(os.path.exists(os.path.join(self.workdir, "downloads", "old", "setup.exe")))
+
+        plan = CleanupPlan.load(plan_file)
+        self.assertEqual(plan.bytes_reclaimed, 100)
+        self.assertEqual(plan.dirs, [os.path.join(self.workdir, "downloads", "old")])
+
+        # A directory that gained a file since the plan was made is left in place
+        self._touch("downloads/old/new.mkv")
+        result = apply_plan(plan)
+        self.assertEqual(result["dirs_failed"], 1)
+        self.assertTrue(os.path.exists(os.path.join(self.workdir, "downloads", "old", "new.mkv")))
+        self.assertTrue(os.path.exists(os.path.join(self.workdir, "downloads", "release", "movie.mkv")))
+        # Sidecars next to media are kept
+        self.assertTrue(os.path.exists(os.path.join(self.workdir, "downloads", "release", "release.nfo")))
+
+    def test_sidecars_without_media_and_partial_downloads(self):
+        self._touch("downloads/orphan/movie.srt")
+        self._touch("downloads/incoming/movie.mkv.part")
+        with open(self._touch("downloads/incoming/noext"), "wb") as file:
+            file.write(b"\x1a\x45\xdf\xa3" + bytes(60))
+
+        plan = CleanupScanner(max_workers=2).run([os.path.join(self.workdir, "downloads")])
+        self.assertEqual([path for path, _ in plan.files], [os.path.join(self.workdir, "downloads", "orphan", "movie.srt")])
+        self.assertEqual(plan.dirs, [os.path.join(self.workdir, "downloads", "orphan")])
+        self.assertEqual(plan.media_dirs, [os.path.join(self.workdir, "downloads", "incoming")])
+
+class TestDirectoryCache(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.root = os.path.join(self.workdir, "media")
+        self.cache_file = os.path.join(self.workdir, "cache.json")
+        for rel_path in ("show/s01/e01.mkv", "show/s01/e02.mkv", "show/s02/e01.mkv", "movie/film.mp4"):
+            path = os.path.join(self.root, rel_path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            open(path, "w").close()
+        self._age_tree()
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def _age_tree(self):
+        # Directory mtimes from the last few seconds are not trusted, so backdate them
+        old = time.time() - 3600
+        for dirpath, _, _ in os.walk(self.root):
+            os.utime(dirpath, (old, old))
+
+    def _scan(self, full_scan=False):
+        cache = DirectoryCache(self.cache_file)
+        cache.load(force_full_scan=full_scan)
+        started = time.time()
+        scanner = CleanupScanner(max_workers=2, cache=cache)
+        plan = scanner.run([self.root])
+        cache.save(started)
+        return scanner, plan
+
+    def test_unchanged_directories_are_not_listed(self):
+        scanner, _ = self._scan()
+        self.assertEqual(scanner.dirs_listed, 5)
+
+        scanner, plan = self._scan()
+        self.assertEqual(scanner.dirs_listed, 0)
+        self.assertEqual(scanner.dirs_cached, 5)
+        self.assertEqual(len(plan.media_dirs), 3)
+        self.assertEqual(plan.files, [])
+
+    def test_new_download_is_scanned(self):
+        self._scan()
+        os.makedirs(os.path.join(self.root, "show", "s02", "extras"))
+        open(os.path.join(self.root, "show", "s02", "extras", "sample.txt"), "w").close()
+
+        scanner, plan = self._scan()
+        # Only the changed directory and the new one are listed, the rest of the tree is taken from the cache
+        self.assertEqual(scanner.dirs_listed, 2)
+        self.assertEqual(plan.files, [(os.path.join(self.root, "show", "s02", "extras", "sample.txt"), 0)])
+        self.assertEqual(plan.dirs, [os.path.join(self.root, "show", "s02", "extras")])
+
+    def test_forced_and_periodic_full_scans(self):
+        self._scan()
+        scanner, _ = self._scan(full_scan=True)
+        self.assertEqual(scanner.dirs_listed, 5)
+
+        with open(self.cache_file) as file:
+            data = json.load(file)
+        data["last_full_scan"] -= 30 * 86400
+        with open(self.cache_file, "w") as file:
+            json.dump(data, file)
+        scanner, _ = self._scan()
+        self.assertEqual(scanner.dirs_listed, 5)
+
+if __name__ == "__main__":
+    unittest.main()
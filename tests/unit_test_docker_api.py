@@ -0,0 +1,125 @@
+import os
+import sys
+import json
+import shutil
+import tempfile
+import threading
+import unittest
+import socketserver
+from http.server import BaseHTTPRequestHandler
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from Docker_api import DockerAPIError, DockerClient
+
+class FakeDockerHandler(BaseHTTPRequestHandler):
+    """Minimal Docker Engine API served over a unix socket."""
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, body=None):
+        data = json.dumps(body).encode() if body is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self.server.requests.append(("GET", self.path))
+        name = self.path.split("/")[2]
+        container = self.server.containers.get(name)
+        if container is None:
+            return self._reply(404, {"message": f"No such container: {name}"})
+        state = {"Running": container["state"] == "running", "Paused": container["state"] == "paused"}
+        if "health" in container:
+            # Report "starting" for the first inspect after a start, then the configured status
+            state["Health"] = {"Status": container.pop("pending_health", container["health"])}
+        return self._reply(200, {"Name": f"/{name}", "State": state, "Mounts": container.get("mounts", [])})
+
+    def do_POST(self):
+        self.server.requests.append(("POST", self.path))
+        parts = self.path.split("?")[0].split("/")
+        name, action = parts[2], parts[3]
+        container = self.server.containers.get(name)
+        if container is None:
+            return self._reply(404, {"message": f"No such container: {name}"})
+        target = {"start": "running", "stop": "exited", "pause": "paused", "unpause": "running"}[action]
+        if action in ("start", "stop") and container["state"] == target:
+            return self._reply(304)
+        if action == "pause" and container["state"] == "paused":
+            return self._reply(409, {"message": "Container is already paused"})
+        if action == "start" and "health" in container:
+            container["pending_health"] = "starting"
+        container["state"] = target
+        return self._reply(204)
+
+class FakeDockerServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, containers):
+        super().__init__(socket_path, FakeDockerHandler)
+        self.containers = containers
+        self.requests = []
+
+class TestDockerClient(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.workdir, "docker.sock")
+        self.server = FakeDockerServer(self.socket_path, {
+            "sonarr": {"state": "running", "mounts": [
+                {"Type": "bind", "Source": "/mnt/user/downloads", "Destination": "/downloads"},
+                {"Type": "bind", "Source": "/mnt/user/appdata/sonarr", "Destination": "/config"},
+            ]},
+            "radarr": {"state": "running", "health": "healthy"},
+            "plex": {"state": "running", "mounts": [
+                {"Type": "bind", "Source": "/mnt/cache/appdata/plex", "Destination": "/plexconfig"},
+            ]},
+        })
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.client = DockerClient(self.socket_path)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.workdir)
+
+    def test_stop_and_start_reuse_one_connection(self):
+        self.assertTrue(self.client.stop("sonarr"))
+        self.assertFalse(self.client.stop("sonarr"))
+        self.assertTrue(self.client.start("sonarr"))
+        self.assertEqual(self.client.connections_opened, 1)
+        self.assertEqual(self.server.requests[0], ("POST", "/containers/sonarr/stop?t=30"))
+
+    def test_pause_already_paused_is_not_an_error(self):
+        self.assertTrue(self.client.pause("sonarr"))
+        self.assertFalse(self.client.pause("sonarr"))
+
+    def test_unknown_container_raises(self):
+        with self.assertRaises(DockerAPIError) as context:
+            self.client.inspect("missing")
+        self.assertEqual(context.exception.status, 404)
+
+    def test_batch_reports_per_container_errors(self):
+        results = self.client.batch("stop", ["sonarr", "radarr", "missing"])
+        self.assertIsNone(results["sonarr"])
+        self.assertIsNone(results["radarr"])
+        self.assertIsInstance(results["missing"], DockerAPIError)
+        self.assertEqual(self.server.containers["radarr"]["state"], "exited")
+
+    def test_wait_healthy_polls_health_status(self):
+        self.client.stop("radarr")
+        self.client.start("radarr")
+        self.assertTrue(self.client.wait_healthy("radarr", timeout=5, interval=0.01))
+        self.assertTrue(self.client.wait_healthy("sonarr", timeout=1, interval=0.01))
+
+    def test_find_appdata_path(self):
+        self.assertEqual(self.client.find_appdata_path("sonarr"), "/mnt/user/appdata/sonarr")
+        self.assertIsNone(self.client.find_appdata_path("plex"))
+        self.assertEqual(self.client.find_appdata_path("plex", "/mnt/cache/appdata"), "/mnt/cache/appdata/plex")
+
+if __name__ == "__main__":
+    unittest.main()
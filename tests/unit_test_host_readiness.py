@@ -0,0 +1,129 @@
+import os
+import sys
+import time
+import socket
+import threading
+import unittest
+from unittest import mock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+import Http_client
+import Host_readiness
+import Power_control
+
+class StatusHandler(BaseHTTPRequestHandler):
+    status = 200
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.send_response(self.status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+class BootingHandler(StatusHandler):
+    status = 503
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def listen_later(port, delay):
+    """Accept connections on port after delay seconds, like a service that comes up during boot."""
+    listener = socket.socket()
+
+    def serve():
+        time.sleep(delay)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind(("127.0.0.1", port))
+        listener.listen()
+    threading.Thread(target=serve, daemon=True).start()
+    return listener
+
+class TestParseChecks(unittest.TestCase):
+    def test_named_and_explicit_checks(self):
+        self.assertEqual(
+            Host_readiness.parse_checks("smb, ssh,plex,tcp://nas:2049", host="10.0.0.5"),
+            ["tcp://10.0.0.5:445", "tcp://10.0.0.5:22", "http://10.0.0.5:32400/identity", "tcp://nas:2049"]
+        )
+
+    def test_named_checks_need_a_host(self):
+        self.assertEqual(Host_readiness.parse_checks("smb,ssh", host=""), [])
+
+    def test_unknown_check(self):
+        with self.assertRaises(ValueError):
+            Host_readiness.parse_checks("ftp://nas", host="nas")
+
+class TestWaitUntilReady(unittest.TestCase):
+    def setUp(self):
+        self.servers = []
+
+    def tearDown(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+        Http_client.close_sessions()
+
+    def serve(self, handler):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.servers.append(server)
+        return f"http://127.0.0.1:{server.server_address[1]}/identity"
+
+    def test_returns_as_soon_as_every_service_answers(self):
+        port = free_port()
+        listener = listen_later(port, 0.4)
+        self.addCleanup(listener.close)
+        checks = [f"tcp://127.0.0.1:{port}", self.serve(StatusHandler)]
+        result = Host_readiness.wait_until_ready(checks, deadline=5, interval=0.1)
+        self.assertTrue(result["ready"])
+        self.assertGreaterEqual(result["checks"][checks[0]], 0.4)
+        self.assertLess(result["checks"][checks[1]], 0.4)
+        self.assertLess(result["elapsed"], 1.5)
+
+    def test_waits_for_power_state_first(self):
+        states = iter(["Off", "PoweringOn", None, "On"])
+
+        def power_state():
+            state = next(states)
+            if state is None:
+                raise ConnectionError("iDRAC busy")
+            return state
+        result = Host_readiness.wait_until_ready([self.serve(StatusHandler)], deadline=5, interval=0.05, power_state=power_state)
+        self.assertTrue(result["ready"])
+        self.assertGreaterEqual(result["powered_on"], 0.15)
+
+    def test_deadline(self):
+        booting = self.serve(BootingHandler)
+        started = time.monotonic()
+        result = Host_readiness.wait_until_ready([booting, f"tcp://127.0.0.1:{free_port()}"], deadline=0.5, interval=0.1)
+        self.assertLess(time.monotonic() - started, 1.5)
+        self.assertFalse(result["ready"])
+        self.assertEqual(list(result["checks"].values()), [None, None])
+
+    def test_power_state_deadline(self):
+        result = Host_readiness.wait_until_ready([], deadline=0.3, interval=0.1, power_state=lambda: "Off")
+        self.assertFalse(result["ready"])
+        self.assertIsNone(result["powered_on"])
+
+class TestWaitForHost(unittest.TestCase):
+    def test_fixed_wait_after_power_on_without_checks(self):
+        with mock.patch("Power_control.parse_checks", return_value=[]), \
+                mock.patch("Power_control.time.sleep") as sleep:
+            self.assertTrue(Power_control.wait_for_host(lambda: "On", fixed_wait=360))
+        sleep.assert_called_once_with(360)
+
+    def test_no_fixed_wait_with_checks(self):
+        with mock.patch("Power_control.parse_checks", return_value=["tcp://127.0.0.1:445"]), \
+                mock.patch("Power_control.wait_until_ready", return_value={"ready": True, "elapsed": 5.0, "powered_on": 1.0}), \
+                mock.patch("Power_control.time.sleep") as sleep:
+            self.assertTrue(Power_control.wait_for_host(lambda: "On", fixed_wait=360))
+        sleep.assert_not_called()
+
+if __name__ == "__main__":
+    unittest.main()
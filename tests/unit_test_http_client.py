@@ -0,0 +1,145 @@
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+import Http_client
+import Service_health
+
+class ScriptedHandler(BaseHTTPRequestHandler):
+    """Answers with the statuses queued in server.script (then 200) and records every request."""
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _answer(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+        server = self.server
+        with server.lock:
+            server.received.append((self.command, self.path, self.client_address[1]))
+            status, headers = server.script.pop(0) if server.script else (200, {})
+        body = json.dumps({"status": status}).encode()
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_POST = do_DELETE = _answer
+
+def start_server(script=()):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ScriptedHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.script = list(script)
+    server.received = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+class HttpClientTestCase(unittest.TestCase):
+    def setUp(self):
+        self.health_dir = tempfile.mkdtemp()
+        Service_health.configure(os.path.join(self.health_dir, "service_health.db"))
+        Http_client.reset_metrics()
+        self.servers = []
+
+    def tearDown(self):
+        Http_client.close_sessions()
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+        Service_health.registry().close()
+        shutil.rmtree(self.health_dir)
+
+    def serve(self, script=()):
+        server, url = start_server(script)
+        self.servers.append(server)
+        return server, url
+
+class TestBackoff(unittest.TestCase):
+    def test_full_jitter_stays_within_the_exponential_bound(self):
+        for attempt in range(6):
+            for _ in range(50):
+                delay = Http_client.backoff_delay(attempt, backoff=0.5, max_backoff=4)
+                self.assertGreaterEqual(delay, 0)
+                self.assertLessEqual(delay, min(4, 0.5 * 2 ** attempt))
+
+    def test_retry_after_seconds_and_date(self):
+        response = requests.Response()
+        response.headers["Retry-After"] = "7"
+        self.assertEqual(Http_client.retry_after(response), 7)
+        self.assertEqual(Http_client.backoff_delay(0, max_backoff=5, response=response), 5)
+        response.headers["Retry-After"] = formatdate(time.time() + 30, usegmt=True)
+        self.assertAlmostEqual(Http_client.retry_after(response), 30, delta=2)
+        response.headers["Retry-After"] = "soon"
+        self.assertIsNone(Http_client.retry_after(response))
+
+class TestRequest(HttpClientTestCase):
+    def test_connections_are_reused(self):
+        server, url = self.serve()
+        for _ in range(5):
+            self.assertEqual(Http_client.get(f"{url}/status").status_code, 200)
+        self.assertEqual(len({port for _, _, port in server.received}), 1)
+        self.assertIs(Http_client.session_for(url), Http_client.session_for(f"{url}/other"))
+
+    def test_server_errors_are_retried(self):
+        server, url = self.serve([(503, {}), (502, {})])
+        response = Http_client.get(f"{url}/status", backoff=0)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(server.received), 3)
+        stats = Http_client.metrics(url)
+        self.assertEqual((stats["requests"], stats["attempts"], stats["retries"], stats["errors"]), (1, 3, 2, 2))
+        self.assertLessEqual(stats["p50_ms"], stats["p99_ms"])
+
+    def test_retries_are_limited(self):
+        server, url = self.serve([(500, {})] * 5)
+        response = Http_client.get(url, retries=2, backoff=0)
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(len(server.received), 3)
+
+    def test_post_is_only_retried_when_idempotent(self):
+        server, url = self.serve([(503, {}), (503, {})])
+        self.assertEqual(Http_client.post(url, json={}, backoff=0).status_code, 503)
+        self.assertEqual(len(server.received), 1)
+        self.assertEqual(Http_client.post(url, json={}, backoff=0, idempotent=True).status_code, 200)
+        self.assertEqual(len(server.received), 3)
+
+    def test_retry_after_is_honoured(self):
+        server, url = self.serve([(429, {"Retry-After": "1"})])
+        started = time.monotonic()
+        self.assertEqual(Http_client.post(url, backoff=0).status_code, 200)
+        self.assertGreaterEqual(time.monotonic() - started, 1)
+        self.assertEqual(len(server.received), 2)
+
+    def test_connection_errors_are_raised_after_the_last_attempt(self):
+        with self.assertRaises(requests.ConnectionError):
+            Http_client.get("http://127.0.0.1:1/", retries=2, backoff=0)
+        self.assertEqual(Http_client.metrics("http://127.0.0.1:1")["attempts"], 3)
+
+    def test_open_circuit_stops_requests(self):
+        server, url = self.serve([(503, {})] * 3)
+        Http_client.get(url, retries=2, backoff=0)
+        with self.assertRaises(Service_health.ServiceUnavailable):
+            Http_client.get(url)
+        self.assertEqual(len(server.received), 3)
+        Http_client.get(url, breaker=False)
+        self.assertEqual(len(server.received), 4)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,130 @@
+import os
+import sys
+import time
+import shutil
+import logging
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from Log_rotation import (
+    RotatingLogHandler,
+    apply_retention,
+    list_segments,
+    open_segment,
+    read_index,
+    record_finished_segment,
+    wait_for_compression
+)
+
+class LogDirTestCase(unittest.TestCase):
+    def setUp(self):
+        self.log_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.log_dir)
+
+    def _segment(self, script, age_hours, size, closed=True, suffix=""):
+        started = time.time() - age_hours * 3600
+        name = f"{script}_log_{time.strftime('%Y-%m-%d_%H-%M-%S', time.localtime(started))}.log"
+        path = os.path.join(self.log_dir, name)
+        with open(path, "w") as file:
+            file.write("x" * size)
+        os.utime(path, (started + 60, started + 60))
+        if closed:
+            record_finished_segment(path)
+        return name
+
+class TestRotatingLogHandler(LogDirTestCase):
+    def test_rotates_by_size_and_compresses_in_background(self):
+        handler = RotatingLogHandler("sync", self.log_dir, max_bytes=2000)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger = logging.getLogger("rotation_test")
+        logger.propagate = False
+        logger.addHandler(handler)
+        try:
+            for i in range(300):
+                logger.warning(f"line {i:04d} " + "x" * 40)
+        finally:
+            logger.removeHandler(handler)
+            handler.close()
+        wait_for_compression()
+
+        segments = list_segments(self.log_dir, "sync")
+        self.assertGreater(len(segments), 5)
+        # Every rotated segment is compressed, the last one is closed but left for the retention job
+        self.assertTrue(all(segment["compression"] == "gz" for segment in segments[:-1]))
+        self.assertIsNone(segments[-1]["compression"])
+        self.assertTrue(all(segment["closed"] for segment in segments))
+
+        lines = []
+        for segment in segments:
+            with open_segment(segment["path"]) as file:
+                lines.extend(file.read().decode().splitlines())
+        self.assertEqual(lines, [f"line {i:04d} " + "x" * 40 for i in range(300)])
+
+    def test_rotates_by_age(self):
+        handler = RotatingLogHandler("heartbeat", self.log_dir, max_age=3600, compression="none")
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        handler.handle(logging.makeLogRecord({"msg": "first"}))
+        handler.opened_at -= 7200
+        first_segment = handler.baseFilename
+        handler.handle(logging.makeLogRecord({"msg": "second"}))
+        handler.close()
+        self.assertNotEqual(handler.baseFilename, first_segment)
+        self.assertEqual(len(list_segments(self.log_dir, "heartbeat")), 2)
+
+    def test_reopens_a_segment_removed_underneath_it(self):
+        handler = RotatingLogHandler("stall_handler", self.log_dir, compression="none")
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        handler.handle(logging.makeLogRecord({"msg": "before"}))
+        os.remove(handler.baseFilename)
+        handler.handle(logging.makeLogRecord({"msg": "after"}))
+        handler.close()
+        with open(handler.baseFilename) as file:
+            self.assertEqual(file.read(), "after\n")
+
+class TestRetention(LogDirTestCase):
+    def test_limits_apply_per_script_and_keep_active_segments(self):
+        old = [self._segment("rclone", hours, 1000) for hours in (50, 40, 30, 20)]
+        active = self._segment("rclone", 0, 1000, closed=False)
+        other = self._segment("dir_cleanup", 60, 1000)
+
+        result = apply_retention(self.log_dir, max_files=2, compression="none")
+
+        remaining = sorted(os.listdir(self.log_dir))
+        self.assertEqual(result["deleted"], 2)
+        self.assertNotIn(old[0], remaining)
+        self.assertNotIn(old[1], remaining)
+        for name in old[2:] + [active, other]:
+            self.assertIn(name, remaining)
+        self.assertNotIn(old[0], read_index(self.log_dir))
+
+    def test_compresses_finished_segments_and_limits_bytes(self):
+        names = [self._segment("backup", hours, 200000) for hours in (30, 20, 10)]
+        result = apply_retention(self.log_dir, max_bytes=5000)
+        # Repetitive logs compress well, so all three fit in the byte limit once compressed
+        self.assertEqual(result["compressed"], 3)
+        self.assertEqual(result["deleted"], 0)
+        self.assertEqual(sorted(os.listdir(self.log_dir)), sorted([name + ".gz" for name in names] + ["log_index.jsonl"]))
+
+    def test_abandoned_segments_are_finished_after_grace(self):
+        abandoned = self._segment("plex_heartbeat", 48, 100, closed=False)
+        apply_retention(self.log_dir, compression="gzip", max_age=3600)
+        self.assertIn(abandoned + ".gz", os.listdir(self.log_dir))
+
+    def test_unclosed_segments_are_kept_without_age_rotation(self):
+        writing = self._segment("stall_handler", 48, 100, closed=False)
+        result = apply_retention(self.log_dir, compression="gzip", max_age=0)
+        self.assertEqual(result["compressed"], 0)
+        self.assertIn(writing, os.listdir(self.log_dir))
+
+    def test_list_segments_by_time_range(self):
+        self._segment("sync", 30, 10)
+        recent = self._segment("sync", 2, 10)
+        segments = list_segments(self.log_dir, "sync", start=time.time() - 5 * 3600)
+        self.assertEqual([segment["file"] for segment in segments], [recent])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,130 @@
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+import Log_rotation
+from Log_rotation import apply_retention, record_finished_segment
+from Log_search import parse_record, search_logs, tail
+
+BASE = datetime(2025, 3, 1, 0, 0, 0)
+
+class LogSearchTestCase(unittest.TestCase):
+    def setUp(self):
+        self.log_dir = tempfile.mkdtemp()
+        self.frame_size = Log_rotation.COMPRESSION_FRAME_SIZE
+        Log_rotation.COMPRESSION_FRAME_SIZE = 16 * 1024
+
+    def tearDown(self):
+        Log_rotation.COMPRESSION_FRAME_SIZE = self.frame_size
+        shutil.rmtree(self.log_dir)
+
+    def _write_segment(self, script, first_second, count, closed=True):
+        """One record per second from BASE + first_second, every 100th an ERROR followed by a traceback."""
+        started = BASE + timedelta(seconds=first_second)
+        path = os.path.join(self.log_dir, f"{script}_log_{started:%Y-%m-%d_%H-%M-%S}.log")
+        with open(path, "w") as file:
+            for i in range(first_second, first_second + count):
+                stamp = BASE + timedelta(seconds=i)
+                if i % 100 == 0:
+                    file.write(f"{stamp:%Y-%m-%d %H:%M:%S} - ERROR - sync of item {i} failed\n")
+                    file.write("Traceback (most recent call last):\n  OSError: disk full\n")
+                else:
+                    file.write(f"{stamp:%Y-%m-%d %H:%M:%S} - INFO - copied item {i}\n")
+        end = (BASE + timedelta(seconds=first_second + count)).timestamp()
+        os.utime(path, (end, end))
+        if closed:
+            record_finished_segment(path)
+        return path
+
+class TestSearchLogs(LogSearchTestCase):
+    def setUp(self):
+        super().setUp()
+        # Three hours of history in three segments, the first two compressed in frames, plus another script
+        for hour in range(3):
+            self._write_segment("file_transfer", hour * 3600, 3600, closed=hour < 2)
+        self._write_segment("dir_cleanup", 0, 600)
+        apply_retention(self.log_dir, max_age=10 ** 9)
+
+    def test_time_range_reads_only_overlapping_segments(self):
+        result = search_logs(
+            self.log_dir, "file_transfer",
+            start=(BASE + timedelta(seconds=3650)).isoformat(), end=(BASE + timedelta(seconds=3659)).isoformat()
+        )
+        self.assertEqual([record["line"].split(" - ")[-1] for record in result["results"]],
+                         [f"copied item {i}" for i in range(3650, 3660)])
+        self.assertEqual(result["segments_read"], 1)
+
+    def test_level_and_text_filters_return_whole_records(self):
+        result = search_logs(self.log_dir, "file_transfer", level="error", text="DISK FULL")
+        self.assertEqual(len(result["results"]), 108)
+        first = result["results"][0]
+        self.assertEqual(first["level"], "ERROR")
+        self.assertTrue(first["line"].endswith("OSError: disk full"))
+        self.assertEqual(first["file"], "file_transfer_log_2025-03-01_00-00-00.log.gz")
+
+    def test_range_spanning_compressed_and_plain_segments(self):
+        result = search_logs(self.log_dir, "file_transfer", start=(BASE + timedelta(seconds=7190)).timestamp(),
+                             end=(BASE + timedelta(seconds=7209)).timestamp())
+        self.assertEqual(len(result["results"]), 20)
+        self.assertEqual({record["file"][-3:] for record in result["results"]}, {".gz", "log"})
+
+    def test_limit_truncates(self):
+        result = search_logs(self.log_dir, limit=10)
+        self.assertEqual(len(result["results"]), 10)
+        self.assertTrue(result["truncated"])
+
+    def test_unknown_level_is_rejected(self):
+        with self.assertRaises(ValueError):
+            search_logs(self.log_dir, level="bogus")
+
+    def test_binary_search_on_plain_segment(self):
+        target = BASE + timedelta(seconds=2 * 3600 + 1234)
+        result = search_logs(self.log_dir, "file_transfer", start=target.isoformat(), limit=1)
+        self.assertEqual(result["results"][0]["time"], f"{target:%Y-%m-%d %H:%M:%S}")
+
+class TestParseRecord(unittest.TestCase):
+    def test_formats(self):
+        self.assertEqual(parse_record(b"2025-03-01 10:00:00 - WARNING - low disk\n"),
+                         (b"2025-03-01 10:00:00", "WARNING", "low disk"))
+        json_line = json.dumps({"ts": "2025-03-01T10:00:00.123+01:00", "level": "INFO", "msg": "started"}).encode()
+        self.assertEqual(parse_record(json_line), (b"2025-03-01 10:00:00", "INFO", "started"))
+        self.assertEqual(parse_record(b"2025/03/01 10:00:00 NOTICE: file.mkv: Copied (new)\n"),
+                         (b"2025-03-01 10:00:00", "NOTICE", "file.mkv: Copied (new)"))
+        self.assertIsNone(parse_record(b"  File \"x.py\", line 1\n"))
+
+class TestTail(LogSearchTestCase):
+    def test_follows_new_lines_and_rotation(self):
+        first = self._write_segment("sync", 0, 10, closed=False)
+        lines = []
+        stop = threading.Event()
+
+        def follow():
+            for line in tail(self.log_dir, "sync", lines=3, poll_interval=0.01, idle_timeout=5, stop_event=stop):
+                if line is not None:
+                    lines.append(line)
+                if len(lines) == 5:
+                    stop.set()
+
+        reader = threading.Thread(target=follow)
+        reader.start()
+        time.sleep(0.1)
+        with open(first, "a") as file:
+            file.write("2025-03-01 00:00:10 - INFO - appended\n")
+        time.sleep(0.1)
+        with open(os.path.join(self.log_dir, "sync_log_2025-03-01_00-01-00.log"), "w") as file:
+            file.write("2025-03-01 00:01:00 - INFO - after rotation\n")
+        reader.join(timeout=5)
+
+        self.assertEqual([line.split(" - ")[-1] for line in lines],
+                         ["copied item 7", "copied item 8", "copied item 9", "appended", "after rotation"])
+
+if __name__ == "__main__":
+    unittest.main()
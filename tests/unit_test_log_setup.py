@@ -0,0 +1,81 @@
+import os
+import sys
+import json
+import shutil
+import logging
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from Log_setup import RateLimitedLog, setup_logging, stop_logging
+
+class TestSetupLogging(unittest.TestCase):
+    def setUp(self):
+        self.log_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        stop_logging()
+        root = logging.getLogger()
+        for handler in root.handlers[:]:
+            root.removeHandler(handler)
+        shutil.rmtree(self.log_dir)
+
+    def test_threads_log_through_queue_to_script_file(self):
+        log_file = setup_logging("sync_test", self.log_dir, "INFO")
+        self.assertTrue(os.path.basename(log_file).startswith("sync_test_log_"))
+
+        def worker(number):
+            for i in range(500):
+                logging.info(f"worker {number} message {i}")
+            logging.debug("not written")
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stop_logging()
+
+        with open(log_file) as file:
+            lines = file.readlines()
+        self.assertEqual(len(lines), 2000)
+        self.assertIn(" - INFO - worker ", lines[0])
+
+    def test_json_lines_format(self):
+        log_file = setup_logging("json_test", self.log_dir, "DEBUG", log_format="json")
+        logging.warning("disk %s is full", "/mnt/user")
+        stop_logging()
+
+        with open(log_file) as file:
+            entry = json.loads(file.readline())
+        self.assertEqual(entry["level"], "WARNING")
+        self.assertEqual(entry["msg"], "disk /mnt/user is full")
+        self.assertIn("ts", entry)
+
+class TestRateLimitedLog(unittest.TestCase):
+    def test_messages_are_limited_per_kind_and_counted(self):
+        logger = logging.getLogger("rate_limit_test")
+        logger.setLevel(logging.DEBUG)
+        with self.assertLogs(logger, logging.DEBUG) as captured:
+            log = RateLimitedLog("Sync", interval=3600, limit=3, logger=logger)
+            for i in range(100):
+                log.event("copied", f"copied {i}")
+            log.event("failed", "failed once", logging.ERROR)
+            counts = log.summary()
+
+        self.assertEqual(counts, {"copied": 100, "failed": 1})
+        self.assertEqual(len(captured.records), 5)
+        self.assertEqual(captured.records[-1].getMessage(), "Sync: copied=100, failed=1 (97 messages suppressed)")
+
+    def test_disabled_levels_are_counted_but_not_suppressed(self):
+        logger = logging.getLogger("rate_limit_disabled_test")
+        logger.setLevel(logging.INFO)
+        log = RateLimitedLog("Sync", limit=1, logger=logger)
+        for i in range(10):
+            log.event("skipped", f"skipped {i}", logging.DEBUG)
+        self.assertEqual((log.counts["skipped"], log.suppressed), (10, 0))
+
+if __name__ == "__main__":
+    unittest.main()
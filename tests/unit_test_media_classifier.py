@@ -0,0 +1,74 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from Media_classifier import JUNK, MEDIA, PARTIAL, SIDECAR, MediaClassifier, sniff_media
+
+class TestMediaClassifier(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.cache_file = os.path.join(self.workdir, "cache.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def _write(self, name, data=b""):
+        path = os.path.join(self.workdir, name)
+        with open(path, "wb") as file:
+            file.write(data)
+        return path
+
+    def test_extension_rules(self):
+        classifier = MediaClassifier()
+        self.assertEqual(classifier.classify("/x/Show.S01E01.m4v"), MEDIA)
+        self.assertEqual(classifier.classify("/x/Show.S01E01.en.SRT"), SIDECAR)
+        self.assertEqual(classifier.classify("/x/Show.S01E01.mkv.part"), PARTIAL)
+        self.assertEqual(classifier.classify("/x/readme.txt"), JUNK)
+        self.assertEqual(classifier.counts, {MEDIA: 1, SIDECAR: 1, PARTIAL: 1, JUNK: 1})
+        self.assertEqual(classifier.sniffed, 0)
+
+    def test_configured_extensions_replace_defaults(self):
+        os.environ["CLEANUP_MEDIA_EXTENSIONS"] = "mkv, .ISO"
+        try:
+            classifier = MediaClassifier.from_env()
+        finally:
+            del os.environ["CLEANUP_MEDIA_EXTENSIONS"]
+        self.assertEqual(classifier.media_extensions, {".mkv", ".iso"})
+
+    def test_sniffs_unknown_and_ambiguous_types(self):
+        classifier = MediaClassifier()
+        transport_stream = b"".join(b"\x47" + bytes(187) for _ in range(4))
+        self.assertEqual(classifier.classify(self._write("recording.ts", transport_stream)), MEDIA)
+        self.assertEqual(classifier.classify(self._write("index.ts", b"export const x = 1;\n")), JUNK)
+        self.assertEqual(classifier.classify(self._write("video.bin", b"\x00\x00\x00\x20ftypisom")), MEDIA)
+        self.assertEqual(classifier.sniffed, 3)
+
+    def test_sniff_results_are_cached_across_runs(self):
+        path = self._write("unknown.dat", b"RIFF\x00\x00\x00\x00AVI LIST")
+        first = MediaClassifier(cache_file=self.cache_file)
+        first.load_cache()
+        self.assertEqual(first.classify(path), MEDIA)
+        first.save_cache()
+
+        second = MediaClassifier(cache_file=self.cache_file)
+        second.load_cache()
+        self.assertEqual(second.classify(path), MEDIA)
+        self.assertEqual((second.sniffed, second.cache_hits), (0, 1))
+
+        # A changed file is sniffed again
+        self._write("unknown.dat", b"plain text that is longer than before")
+        self.assertEqual(second.classify(path), JUNK)
+        self.assertEqual(second.sniffed, 1)
+
+    def test_sniff_media_signatures(self):
+        self.assertTrue(sniff_media(b"fLaC\x00\x00"))
+        self.assertTrue(sniff_media(b"ID3\x03\x00"))
+        self.assertFalse(sniff_media(b"\x89PNG\r\n\x1a\n"))
+        self.assertFalse(sniff_media(b""))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,172 @@
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+sys.path.insert(0, os.path.dirname(__file__))
+
+import Http_client
+import Service_health
+import Plex_notifications
+from mock_plex_server import MockPlexServer
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+class PlexNotificationsTestCase(unittest.TestCase):
+    server_options = {}
+
+    def setUp(self):
+        self.health_dir = tempfile.mkdtemp()
+        Service_health.configure(os.path.join(self.health_dir, "service_health.db"))
+        self.server = MockPlexServer(**self.server_options).start()
+        self.sessions_url = f"{self.server.url}/status/sessions"
+        self.listener = None
+
+    def tearDown(self):
+        if self.listener is not None:
+            self.listener.stop()
+        self.server.stop()
+        Http_client.close_sessions()
+        Service_health.registry().close()
+        shutil.rmtree(self.health_dir)
+
+    def listen(self, **options):
+        url = Plex_notifications.notifications_url(self.sessions_url, "test-token")
+        self.listener = Plex_notifications.NotificationListener(url, **options).start()
+        return self.listener
+
+    def poll(self):
+        response = Http_client.get(self.sessions_url, params={"X-Plex-Token": "test-token"}, retries=0)
+        return {item["sessionKey"] for item in response.json()["MediaContainer"].get("Metadata", [])}
+
+    def watch(self, idle_timeout, **options):
+        thread = threading.Thread(
+            target=Plex_notifications.watch_until_idle, args=(self.listener, idle_timeout, self.poll),
+            kwargs=options, daemon=True
+        )
+        thread.start()
+        return thread
+
+class TestNotificationListener(PlexNotificationsTestCase):
+    def test_notifications_url(self):
+        self.assertEqual(
+            Plex_notifications.notifications_url("https://plex.local:32400/status/sessions", "a b"),
+            "wss://plex.local:32400/:/websockets/notifications?X-Plex-Token=a+b"
+        )
+
+    def test_playback_is_detected_within_a_second(self):
+        listener = self.listen()
+        self.assertTrue(listener.connected.wait(5))
+        started = time.monotonic()
+        self.server.play(7)
+        self.assertTrue(wait_for(lambda: listener.active_sessions() == {"7": "playing"}))
+        self.assertLess(time.monotonic() - started, 1)
+        self.server.play(7, "paused")
+        self.assertTrue(wait_for(lambda: listener.active_sessions() == {"7": "paused"}))
+        self.server.play(7, "stopped")
+        self.assertTrue(wait_for(lambda: listener.active_sessions() == {}))
+        self.assertEqual(listener.events, 3)
+
+    def test_other_and_large_messages(self):
+        listener = self.listen()
+        self.assertTrue(listener.connected.wait(5))
+        self.server.push(json.dumps({"NotificationContainer": {"type": "timeline", "TimelineEntry": []}}))
+        self.server.push("not json")
+        padding = "x" * 70000
+        self.server.push(json.dumps({"NotificationContainer": {
+            "type": "playing", "padding": padding,
+            "PlaySessionStateNotification": [{"sessionKey": "1", "state": "playing"}, {"sessionKey": "2", "state": "buffering"}]
+        }}))
+        self.assertTrue(wait_for(lambda: set(listener.active_sessions()) == {"1", "2"}))
+        self.assertEqual(listener.events, 1)
+
+    def test_reconnects_after_the_stream_drops(self):
+        listener = self.listen()
+        self.assertTrue(listener.connected.wait(5))
+        self.server.drop_clients()
+        self.assertTrue(wait_for(lambda: not listener.connected.is_set()))
+        self.assertTrue(listener.connected.wait(5))
+        self.assertTrue(wait_for(lambda: self.server.connected_clients() == 1))
+        self.server.play(3)
+        self.assertTrue(wait_for(lambda: "3" in listener.active_sessions()))
+
+    def test_reconcile_replaces_missed_events(self):
+        listener = self.listen()
+        listener.handle(json.dumps({"NotificationContainer": {
+            "type": "playing", "PlaySessionStateNotification": [{"sessionKey": "1", "state": "paused"}]
+        }}))
+        listener.reconcile({"1", "2"})
+        self.assertEqual(listener.active_sessions(), {"1": "paused", "2": "playing"})
+        listener.reconcile(set())
+        self.assertEqual(listener.active_sessions(), {})
+
+class TestUnansweredPings(PlexNotificationsTestCase):
+    server_options = {"answer_pings": False}
+
+    def test_silent_stream_is_dropped(self):
+        listener = self.listen(ping_interval=0.2)
+        self.assertTrue(listener.connected.wait(5))
+        self.assertTrue(wait_for(lambda: not listener.connected.is_set(), timeout=2))
+        self.assertGreaterEqual(self.server.pings, 1)
+
+class TestWatchUntilIdle(PlexNotificationsTestCase):
+    def test_returns_soon_after_the_last_session_stops(self):
+        self.server.play(1)
+        listener = self.listen()
+        self.assertTrue(listener.connected.wait(5))
+        thread = self.watch(0.3)
+        time.sleep(0.6)
+        self.assertTrue(thread.is_alive())
+        polls = self.server.polls
+        self.server.play(1, "stopped")
+        stopped = time.monotonic()
+        thread.join(3)
+        self.assertFalse(thread.is_alive())
+        self.assertLess(time.monotonic() - stopped, 1.3)
+        # While connected, changes come from the stream instead of polls
+        self.assertEqual(self.server.polls, polls)
+
+    def test_busy_keeps_the_watch_going_and_sessions_are_reported(self):
+        listener = self.listen()
+        self.assertTrue(listener.connected.wait(5))
+        busy = threading.Event()
+        busy.set()
+        seen = []
+        thread = self.watch(0.2, poll_interval=0.1, busy=busy.is_set, on_sessions=lambda keys: seen.append(set(keys)))
+        self.server.play(4)
+        self.assertTrue(wait_for(lambda: {"4"} in seen))
+        self.server.play(4, "stopped")
+        time.sleep(0.5)
+        self.assertTrue(thread.is_alive())
+        busy.clear()
+        thread.join(3)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(seen[-1], set())
+
+class TestPollingFallback(PlexNotificationsTestCase):
+    server_options = {"websocket": False}
+
+    def test_polls_while_the_stream_is_unavailable(self):
+        self.server.play(1)
+        self.listen()
+        thread = self.watch(0.2, poll_interval=0.1)
+        time.sleep(0.5)
+        self.assertTrue(thread.is_alive())
+        self.server.play(1, "stopped")
+        thread.join(3)
+        self.assertFalse(thread.is_alive())
+        self.assertGreater(self.server.polls, 3)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,129 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+import Plex_usage
+
+# A Monday, so weeks in the tests line up with the model's weeks
+MONDAY = datetime(2024, 3, 4)
+
+def at(week, day, hour, minute=0):
+    return (MONDAY + timedelta(weeks=week, days=day, hours=hour, minutes=minute)).timestamp()
+
+class FakeClock:
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+class PlexUsageTestCase(unittest.TestCase):
+    def setUp(self):
+        self.state_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.state_dir, "plex_usage.db")
+        self.clock = FakeClock(at(0, 0, 0))
+        self.usage = Plex_usage.UsageStore(self.db_path, clock=self.clock)
+
+    def tearDown(self):
+        self.usage.close()
+        shutil.rmtree(self.state_dir)
+
+    def play(self, key, start, stop, server_up=True):
+        self.usage.observe({key}, start, server_up=lambda: server_up)
+        self.usage.observe(set(), stop)
+
+    def friday_evenings(self, weeks):
+        for week in weeks:
+            self.play(f"fri-{week}", at(week, 4, 20), at(week, 4, 22))
+
+class TestHistory(PlexUsageTestCase):
+    def test_sessions_start_and_stop(self):
+        asked = []
+
+        def server_up():
+            asked.append(True)
+            return False
+        self.assertEqual(self.usage.observe({"1", "2"}, at(0, 0, 20), server_up=server_up), {"1", "2"})
+        self.assertEqual(self.usage.observe({"1", "2"}, at(0, 0, 21), server_up=server_up), set())
+        self.usage.observe({"2"}, at(0, 0, 22))
+        self.assertEqual(len(asked), 1)
+        rows = self.usage.conn.execute("SELECT session_key, started, stopped, server_up FROM sessions ORDER BY session_key")
+        self.assertEqual(rows.fetchall(), [("1", at(0, 0, 20), at(0, 0, 22), 0), ("2", at(0, 0, 20), None, 0)])
+
+    def test_running_sessions_survive_a_restart(self):
+        self.usage.observe({"1"}, at(0, 0, 20))
+        self.usage.close()
+        self.usage = Plex_usage.UsageStore(self.db_path, clock=self.clock)
+        self.assertEqual(self.usage.observe({"1"}, at(0, 0, 21)), set())
+        self.usage.observe(set(), at(0, 0, 22))
+        self.assertEqual(self.usage.conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0], 1)
+
+    def test_sessions_left_open_by_an_earlier_run_end_when_last_seen(self):
+        self.usage.observe({"1"}, at(0, 0, 20))
+        self.usage.observe({"1"}, at(0, 0, 21))
+        self.usage.close()
+        self.clock.now = at(0, 1, 8)
+        self.usage = Plex_usage.UsageStore(self.db_path, clock=self.clock)
+        self.assertEqual(self.usage.observe({"1"}), {"1"})
+        rows = self.usage.conn.execute("SELECT started, stopped FROM sessions ORDER BY id").fetchall()
+        self.assertEqual(rows, [(at(0, 0, 20), at(0, 0, 21)), (at(0, 1, 8), None)])
+
+class TestModel(PlexUsageTestCase):
+    def test_regular_viewing_is_predicted(self):
+        self.friday_evenings(range(3))
+        before = at(3, 4, 19, 50)
+        self.assertTrue(self.usage.likely_soon(before, window=15 * 60))
+        self.assertFalse(self.usage.likely_soon(before, window=0))
+        self.assertTrue(self.usage.likely_soon(at(3, 4, 21, 45)))
+        self.assertFalse(self.usage.likely_soon(at(3, 4, 22, 30), window=15 * 60))
+        self.assertFalse(self.usage.likely_soon(at(3, 1, 20), window=15 * 60))
+
+    def test_no_prediction_without_enough_history(self):
+        self.friday_evenings([0])
+        self.assertEqual(self.usage.likely_use(at(1, 4, 20)), 0.0)
+
+    def test_occasional_viewing_is_not_enough(self):
+        self.friday_evenings([0])
+        self.play("other", at(1, 0, 12), at(1, 0, 13))
+        self.play("other", at(2, 0, 12), at(2, 0, 13))
+        self.play("other", at(3, 0, 12), at(3, 0, 13))
+        self.assertLess(self.usage.likely_use(at(4, 4, 20)), 0.5)
+        self.assertFalse(self.usage.likely_soon(at(4, 4, 20)))
+
+    def test_recent_weeks_weigh_more(self):
+        self.friday_evenings([2, 3])
+        self.play("other", at(0, 0, 12), at(0, 0, 13))
+        self.play("other", at(1, 0, 12), at(1, 0, 13))
+        self.assertGreater(self.usage.likely_use(at(4, 4, 20)), self.usage.likely_use(at(4, 0, 12)))
+        self.assertTrue(self.usage.likely_soon(at(4, 4, 20)))
+        self.assertFalse(self.usage.likely_soon(at(4, 0, 12)))
+
+class TestReport(PlexUsageTestCase):
+    def test_sessions_found_up_and_extra_hours(self):
+        self.usage.track_prediction(True, Plex_usage.PREWAKE, at(0, 4, 19, 45))
+        self.play("1", at(0, 4, 20), at(0, 4, 22), server_up=True)
+        self.usage.track_prediction(True, Plex_usage.KEEP_ON, at(0, 4, 22))
+        self.usage.track_prediction(True, Plex_usage.KEEP_ON, at(0, 4, 22, 15))
+        self.usage.track_prediction(False, now=at(0, 4, 22, 30))
+        self.play("2", at(0, 5, 20), at(0, 5, 21), server_up=False)
+        self.play("3", at(0, 6, 20), at(0, 6, 21), server_up=None)
+        report = self.usage.report(days=30, now=at(1, 0, 0))
+        self.assertEqual(
+            (report["sessions"], report["found_server_up"], report["waited_for_server"], report["unknown"]), (3, 1, 1, 1)
+        )
+        self.assertEqual(report["share_found_up"], 0.5)
+        self.assertEqual(report["prewakes"], 1)
+        self.assertEqual(report["extra_hours"], {"prewake": 0.25, "keep_on": 0.5})
+        self.assertEqual(report["extra_hours_total"], 0.75)
+
+    def test_empty_report(self):
+        report = self.usage.report(now=at(1, 0, 0))
+        self.assertEqual((report["sessions"], report["share_found_up"], report["extra_hours_total"]), (0, None, 0))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,252 @@
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+import Http_client
+import Service_health
+import Power_manager
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+class FakePower:
+    """Stands in for Power_control.wake_host/sleep_host; wake blocks until booted is set."""
+
+    def __init__(self, ready=True):
+        self.ready = ready
+        self.booted = threading.Event()
+        self.wakes = 0
+        self.sleeps = 0
+
+    def wake(self):
+        self.wakes += 1
+        self.booted.wait(5)
+        return self.ready
+
+    def sleep(self):
+        self.sleeps += 1
+        return True
+
+class LeaseHandler(BaseHTTPRequestHandler):
+    """The /api/power routes of the Flask app, over http.server."""
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _lease_id(self):
+        return urlsplit(self.path).path.rsplit("/", 1)[-1]
+
+    def do_POST(self):
+        data = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self._send(201, self.server.manager.acquire(data["job"], data.get("ttl")))
+
+    def do_GET(self):
+        wait = float(parse_qs(urlsplit(self.path).query).get("wait", ["0"])[0])
+        lease = self.server.manager.wait(self._lease_id(), wait)
+        self._send(200, lease) if lease else self._send(404, {"error": "Lease not found"})
+
+    def do_PUT(self):
+        lease = self.server.manager.renew(self._lease_id())
+        self._send(200, lease) if lease else self._send(404, {"error": "Lease not found"})
+
+    def do_DELETE(self):
+        if self.server.manager.release(self._lease_id()):
+            self._send(200, {"message": "Lease released"})
+        else:
+            self._send(404, {"error": "Lease not found"})
+
+class PowerManagerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.power = FakePower()
+        self.manager = None
+
+    def tearDown(self):
+        self.power.booted.set()
+        if self.manager is not None:
+            self.manager.close()
+
+    def start(self, **options):
+        self.manager = Power_manager.PowerManager(wake=self.power.wake, sleep=self.power.sleep, **options)
+        return self.manager
+
+class TestPowerManager(PowerManagerTestCase):
+    def test_first_lease_wakes_and_later_leases_join(self):
+        manager = self.start(hold_down=60)
+        first = manager.acquire("file_transfer")
+        second = manager.acquire("plex_heartbeat")
+        self.assertEqual((first["state"], second["state"]), ("waking", "waking"))
+        self.assertFalse(manager.wait(first["id"], 0.1)["ready"])
+        self.power.booted.set()
+        self.assertTrue(manager.wait(first["id"], 5)["ready"])
+        self.assertTrue(manager.wait(second["id"], 5)["ready"])
+        third = manager.acquire("rclone_transfer")
+        self.assertTrue(third["ready"])
+        self.assertEqual(self.power.wakes, 1)
+        self.assertEqual(manager.status()["stats"]["joined"], 2)
+
+    def test_powered_off_only_after_every_release_and_the_hold_down(self):
+        self.power.booted.set()
+        manager = self.start(hold_down=0.3)
+        transfer = manager.acquire("file_transfer")
+        plex = manager.acquire("plex_heartbeat")
+        manager.wait(transfer["id"], 5)
+        manager.release(plex["id"])
+        time.sleep(0.5)
+        self.assertEqual((manager.state, self.power.sleeps), ("on", 0))
+        manager.release(transfer["id"])
+        self.assertEqual(manager.state, "holding")
+        self.assertGreater(manager.status()["power_off_in"], 0)
+        self.assertTrue(wait_for(lambda: manager.state == "off"))
+        self.assertEqual(self.power.sleeps, 1)
+
+    def test_lease_during_the_hold_down_keeps_the_server_on(self):
+        self.power.booted.set()
+        manager = self.start(hold_down=0.3)
+        lease = manager.acquire("file_transfer")
+        manager.wait(lease["id"], 5)
+        manager.release(lease["id"])
+        again = manager.acquire("rclone_transfer")
+        self.assertTrue(again["ready"])
+        time.sleep(0.5)
+        self.assertEqual((manager.state, self.power.wakes, self.power.sleeps), ("on", 1, 0))
+
+    def test_lease_during_shutdown_wakes_the_server_again(self):
+        self.power.booted.set()
+        stopping = threading.Event()
+        self.power.sleep = lambda: stopping.wait(5)
+        manager = self.start(hold_down=0)
+        lease = manager.acquire("file_transfer")
+        manager.wait(lease["id"], 5)
+        manager.release(lease["id"])
+        self.assertTrue(wait_for(lambda: manager.state == "shutting_down"))
+        late = manager.acquire("plex_heartbeat")
+        stopping.set()
+        self.assertTrue(manager.wait(late["id"], 5)["ready"])
+        self.assertEqual(self.power.wakes, 2)
+
+    def test_unrenewed_leases_expire(self):
+        self.power.booted.set()
+        manager = self.start(hold_down=0, lease_ttl=0.3)
+        lease = manager.acquire("crashed_job")
+        manager.wait(lease["id"], 5)
+        time.sleep(0.15)
+        self.assertIsNotNone(manager.renew(lease["id"]))
+        time.sleep(0.2)
+        self.assertEqual(manager.state, "on")
+        self.assertTrue(wait_for(lambda: manager.state == "off"))
+        self.assertIsNone(manager.renew(lease["id"]))
+        self.assertEqual(manager.status()["stats"]["expired"], 1)
+
+    def test_invalid_ttl_is_refused(self):
+        manager = self.start()
+        for ttl in ("soon", -5, "inf"):
+            with self.assertRaises(ValueError):
+                manager.acquire("file_transfer", ttl)
+        self.assertEqual(manager.leases, {})
+
+    def test_failed_wake_is_reported(self):
+        self.power.ready = False
+        self.power.booted.set()
+        manager = self.start()
+        lease = manager.wait(manager.acquire("file_transfer")["id"], 5)
+        self.assertEqual((lease["state"], lease["ready"]), ("off", False))
+        self.assertEqual(lease["error"], "Server did not come up")
+
+class TestPowerLease(PowerManagerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.health_dir = tempfile.mkdtemp()
+        Service_health.configure(os.path.join(self.health_dir, "service_health.db"))
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), LeaseHandler)
+        self.server.daemon_threads = True
+        self.server.manager = self.start(hold_down=0.2)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        super().tearDown()
+        Http_client.close_sessions()
+        Service_health.registry().close()
+        shutil.rmtree(self.health_dir)
+
+    def test_overlapping_jobs_share_one_boot(self):
+        results = {}
+
+        def job(name, seconds):
+            with Power_manager.power_lease(name, manager_url=self.url) as ready:
+                results[name] = ready
+                time.sleep(seconds)
+        threads = [threading.Thread(target=job, args=(name, seconds)) for name, seconds in (("a", 0.2), ("b", 0.6))]
+        for thread in threads:
+            thread.start()
+        self.assertTrue(wait_for(lambda: len(self.manager.leases) == 2))
+        self.power.booted.set()
+        threads[0].join(5)
+        self.assertEqual((self.manager.state, self.power.sleeps), ("on", 0))
+        threads[1].join(5)
+        self.assertEqual(results, {"a": True, "b": True})
+        self.assertTrue(wait_for(lambda: self.power.sleeps == 1))
+        self.assertEqual(self.power.wakes, 1)
+
+    def test_lease_is_renewed_while_the_job_runs(self):
+        self.power.booted.set()
+        with Power_manager.power_lease("long_job", manager_url=self.url, ttl=0.3) as ready:
+            self.assertTrue(ready)
+            time.sleep(0.8)
+            self.assertEqual(len(self.manager.leases), 1)
+        self.assertEqual(self.manager.status()["stats"]["expired"], 0)
+
+    def test_lost_lease_is_taken_again(self):
+        self.power.booted.set()
+        with Power_manager.power_lease("long_job", manager_url=self.url, ttl=0.3):
+            lost = next(iter(self.manager.leases))
+            self.manager.release(lost)
+            self.assertTrue(wait_for(lambda: len(self.manager.leases) == 1))
+            self.assertNotIn(lost, self.manager.leases)
+            self.assertEqual(self.manager.state, "on")
+        self.assertEqual(self.manager.leases, {})
+
+    def test_unreachable_manager_wakes_directly_and_leaves_the_server_on(self):
+        with mock.patch("Power_control.wake_host", return_value=True) as wake, \
+                mock.patch("Power_control.sleep_host") as sleep:
+            with Power_manager.power_lease("file_transfer", manager_url="http://127.0.0.1:1") as ready:
+                self.assertTrue(ready)
+            wake.assert_called_once()
+            sleep.assert_not_called()
+
+    def test_without_a_manager_the_job_powers_the_server_itself(self):
+        with mock.patch("Power_control.wake_host", return_value=True) as wake, \
+                mock.patch("Power_control.sleep_host") as sleep:
+            with Power_manager.power_lease("file_transfer", manager_url=""):
+                wake.assert_called_once()
+                sleep.assert_not_called()
+            sleep.assert_called_once()
+
+if __name__ == "__main__":
+    unittest.main()
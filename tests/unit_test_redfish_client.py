@@ -0,0 +1,111 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+sys.path.insert(0, os.path.dirname(__file__))
+
+import Http_client
+import Service_health
+import Redfish_client
+from mock_redfish_server import MockRedfishServer
+
+class RedfishClientTestCase(unittest.TestCase):
+    server_options = {}
+
+    def setUp(self):
+        self.health_dir = tempfile.mkdtemp()
+        Service_health.configure(os.path.join(self.health_dir, "service_health.db"))
+        self.server = MockRedfishServer(**self.server_options).start()
+        self.client = Redfish_client.RedfishClient(self.server.url, "root", "calvin", retries=0)
+
+    def tearDown(self):
+        self.client.logout()
+        self.server.stop()
+        Http_client.close_sessions()
+        Service_health.registry().close()
+        shutil.rmtree(self.health_dir)
+
+class TestSession(RedfishClientTestCase):
+    server_options = {"basic_auth_delay": 0.2}
+
+    def test_one_login_for_many_calls(self):
+        started = time.monotonic()
+        for _ in range(10):
+            self.assertEqual(self.client.power_state(max_age=0), "Off")
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual((self.server.logins, self.server.basic_auths), (1, 0))
+
+    def test_expired_session_logs_in_again(self):
+        self.client.power_state(max_age=0)
+        self.server.expire_sessions()
+        self.assertEqual(self.client.power_state(max_age=0), "Off")
+        self.assertEqual(self.server.logins, 2)
+
+    def test_logout_deletes_the_session(self):
+        self.client.power_state()
+        self.client.logout()
+        self.assertEqual((self.server.logouts, self.server.tokens), (1, {}))
+
+    def test_login_is_not_retried_once_sent(self):
+        self.server.lost_login_replies = 1
+        client = Redfish_client.RedfishClient(self.server.url, "root", "calvin", retries=3, backoff=0.01)
+        with self.assertRaises(Redfish_client.requests.HTTPError):
+            client.power_state()
+        self.assertEqual(self.server.logins, 1)
+
+    def test_wrong_password(self):
+        client = Redfish_client.RedfishClient(self.server.url, "root", "wrong", retries=0)
+        with self.assertRaises(Redfish_client.requests.HTTPError):
+            client.power_state()
+
+class TestBasicAuthFallback(RedfishClientTestCase):
+    server_options = {"sessions_supported": False}
+
+    def test_basic_auth_without_session_service(self):
+        self.assertEqual(self.client.power_state(), "Off")
+        self.assertTrue(self.client.basic_auth)
+        self.assertEqual(self.server.basic_auths, 1)
+
+class TestPower(RedfishClientTestCase):
+    server_options = {"boot_delay": 0.2, "shutdown_delay": 0.2}
+
+    def test_state_is_cached(self):
+        for _ in range(5):
+            self.client.power_state()
+        self.assertEqual(self.server.requests.count(("GET", Redfish_client.SYSTEM_PATH)), 1)
+
+    def test_power_on_checks_the_state_first(self):
+        self.assertTrue(self.client.power_on())
+        self.assertEqual(self.client.power_state(), "PoweringOn")
+        self.assertFalse(self.client.power_on())
+        time.sleep(0.3)
+        self.assertEqual(self.client.power_state(max_age=0), "On")
+        self.assertFalse(self.client.power_on())
+        self.assertEqual(self.server.resets, ["On"])
+
+    def test_graceful_shutdown(self):
+        self.server.reset("On")
+        time.sleep(0.3)
+        self.assertEqual(self.client.power_off(graceful_timeout=5, poll_interval=0.05), "graceful")
+        self.assertEqual(self.server.resets, ["GracefulShutdown"])
+        self.assertEqual(self.client.power_off(), "off")
+
+class TestForcedShutdown(RedfishClientTestCase):
+    server_options = {"power": "On", "graceful_works": False}
+
+    def test_forced_off_when_graceful_shutdown_hangs(self):
+        self.assertEqual(self.client.power_off(graceful_timeout=0.3, poll_interval=0.05), "forced")
+        self.assertEqual(self.server.resets, ["GracefulShutdown", "ForceOff"])
+        self.assertEqual(self.client.power_state(max_age=0), "Off")
+
+    def test_forced_off_without_graceful_shutdown(self):
+        self.server.reset_types = ["On", "ForceOff"]
+        self.assertEqual(self.client.power_off(), "forced")
+        self.assertEqual(self.server.resets, ["ForceOff"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,130 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from Service_health import CLOSED, HALF_OPEN, OPEN, ServiceHealth, ServiceUnavailable, service_key
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+def http_error(status):
+    return requests.HTTPError(response=mock.Mock(status_code=status))
+
+class TestServiceHealth(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.temp_dir, "service_health.db")
+        self.clock = Clock()
+        self.health = self.open()
+
+    def tearDown(self):
+        self.health.close()
+        shutil.rmtree(self.temp_dir)
+
+    def open(self, **options):
+        return ServiceHealth(self.db_path, failure_threshold=3, cooldown=60, max_cooldown=300, refresh=0,
+                             clock=self.clock, **options)
+
+    def fail(self, name="idrac", count=1):
+        for _ in range(count):
+            with self.assertRaises(requests.ConnectionError):
+                self.health.call(name, mock.Mock(side_effect=requests.ConnectionError("refused")))
+
+    def test_circuit_opens_after_failures_in_a_row(self):
+        self.fail(count=2)
+        self.assertEqual(self.health.status("idrac")["state"], CLOSED)
+        self.fail()
+        self.assertEqual(self.health.status("idrac")["state"], OPEN)
+        func = mock.Mock()
+        with self.assertRaises(ServiceUnavailable) as raised:
+            self.health.call("idrac", func)
+        func.assert_not_called()
+        self.assertEqual(raised.exception.retry_at, 1060)
+
+    def test_success_resets_failure_count(self):
+        self.fail(count=2)
+        self.health.call("idrac", lambda: "ok")
+        self.fail(count=2)
+        self.assertEqual(self.health.status("idrac")["state"], CLOSED)
+
+    def test_half_open_probe_restores_service(self):
+        self.fail(count=3)
+        self.clock.now += 60
+        self.assertTrue(self.health.allow("idrac"))
+        self.assertEqual(self.health.status("idrac")["state"], HALF_OPEN)
+        # Only one probe at a time
+        self.assertFalse(self.health.allow("idrac"))
+        self.health.record_success("idrac", 12.0)
+        status = self.health.status("idrac")
+        self.assertEqual((status["state"], status["failures"], status["open_count"]), (CLOSED, 0, 0))
+
+    def test_failed_probe_reopens_with_longer_cooldown(self):
+        self.fail(count=3)
+        self.clock.now += 60
+        self.fail()
+        status = self.health.status("idrac")
+        self.assertEqual((status["state"], status["open_count"]), (OPEN, 2))
+        self.clock.now += 60
+        self.assertFalse(self.health.allow("idrac"))
+        self.clock.now += 60
+        self.assertTrue(self.health.allow("idrac"))
+
+    def test_client_errors_do_not_count_as_failures(self):
+        for _ in range(5):
+            with self.assertRaises(requests.HTTPError):
+                self.health.call("radarr", mock.Mock(side_effect=http_error(404)))
+        self.assertEqual(self.health.status("radarr")["failures"], 0)
+        for _ in range(3):
+            with self.assertRaises(requests.HTTPError):
+                self.health.call("radarr", mock.Mock(side_effect=http_error(503)))
+        self.assertEqual(self.health.status("radarr")["state"], OPEN)
+
+    def test_state_is_shared_between_instances(self):
+        other = self.open()
+        try:
+            self.fail(count=3)
+            self.assertFalse(other.allow("idrac"))
+            with self.assertRaises(ServiceUnavailable):
+                other.call("idrac", lambda: None)
+        finally:
+            other.close()
+
+    def test_successes_are_batched_and_flushed(self):
+        health = self.open()
+        health.refresh = 60
+        try:
+            for _ in range(10):
+                health.record_success("plex", 20.0)
+            self.assertEqual(self.health.status("plex")["successes_total"], 1)
+        finally:
+            health.close()
+        status = self.health.status("plex")
+        self.assertEqual(status["successes_total"], 10)
+        self.assertAlmostEqual(status["latency_ms"], 20.0)
+
+    def test_cached_health(self):
+        self.assertIsNone(self.health.is_available("plex"))
+        self.health.record_success("plex", 5.0)
+        self.assertTrue(self.health.is_available("plex", max_age=30))
+        self.clock.now += 60
+        self.assertIsNone(self.health.is_available("plex", max_age=30))
+        self.fail("plex", count=3)
+        self.assertFalse(self.health.is_available("plex", max_age=30))
+
+    def test_service_key(self):
+        self.assertEqual(service_key("http://Radarr:7878/api/v3/queue?page=2"), "http://radarr:7878")
+        self.assertEqual(service_key("https://idrac.local/redfish/v1"), "https://idrac.local")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,208 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+sys.path.insert(0, os.path.dirname(__file__))
+
+import Service_health
+import Stall_handler
+from mock_arr_server import MockArrServer, make_queue
+from Stall_tracker import StallTracker
+
+class StallHandlerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.retry_backoff = Stall_handler.RETRY_BACKOFF
+        Stall_handler.RETRY_BACKOFF = 0
+        self.health_dir = tempfile.mkdtemp()
+        Service_health.configure(os.path.join(self.health_dir, "service_health.db"))
+
+    def tearDown(self):
+        Stall_handler.RETRY_BACKOFF = self.retry_backoff
+        Stall_handler.close_sessions()
+        Service_health.registry().close()
+        shutil.rmtree(self.health_dir)
+
+class TestProcessQueue(StallHandlerTestCase):
+    def test_removes_blocklists_and_searches_stalled_items(self):
+        with MockArrServer(make_queue(6, stalled_every=2)) as server:
+            stats = Stall_handler.process_queue(server.url, "test-key", is_movie=True)
+        self.assertEqual((stats["stalled"], stats["removed"], stats["searched"]), (3, 3, 3))
+        self.assertEqual(sorted(server.blocklisted), [2, 4, 6])
+        self.assertEqual(server.commands, [{"name": "MoviesSearch", "movieIds": [10002, 10004, 10006]}])
+        # One queue page, one bulk delete and one search command
+        self.assertEqual(stats["requests"], 3)
+
+    def test_unmatched_items_are_removed_without_a_search(self):
+        queue = make_queue(3)
+        del queue[1]["movieId"]
+        with MockArrServer(queue) as server:
+            stats = Stall_handler.process_queue(server.url, "test-key", is_movie=True)
+        self.assertEqual((stats["removed"], stats["searched"]), (3, 2))
+        self.assertEqual(server.commands, [{"name": "MoviesSearch", "movieIds": [10001, 10003]}])
+
+    def test_falls_back_to_concurrent_item_calls_without_bulk_endpoint(self):
+        with MockArrServer(make_queue(20), latency=0.02, bulk=False) as server:
+            stats = Stall_handler.process_queue(server.url, "test-key", is_movie=False)
+        self.assertEqual(stats["removed"], 20)
+        self.assertGreater(server.max_active, 1)
+        self.assertLessEqual(server.max_active, Stall_handler.ITEM_CONCURRENCY)
+        self.assertEqual(server.commands, [{"name": "EpisodeSearch", "episodeIds": list(range(10001, 10021))}])
+        deletes = [path for method, path, query, body in server.requests if method == "DELETE"]
+        self.assertEqual(deletes.count("/api/v3/queue/bulk"), 1)
+        self.assertEqual(len(deletes), 21)
+
+    def test_failed_calls_are_retried(self):
+        with MockArrServer(make_queue(2)) as server:
+            server.fail[("GET", "/api/v3/queue")] = 2
+            server.fail[("DELETE", "/api/v3/queue/bulk")] = 1
+            stats = Stall_handler.process_queue(server.url, "test-key")
+        self.assertEqual(stats["removed"], 2)
+        # Two retried queue fetches and one retried delete on top of 1 fetch + 1 delete + 1 search
+        self.assertEqual(stats["requests"], 6)
+
+    def test_random_server_errors_are_retried(self):
+        with MockArrServer(make_queue(300, stalled_every=3), error_rate=0.05, seed=1, bulk=False) as server:
+            stats = Stall_handler.process_queue(server.url, "test-key")
+        self.assertGreater(server.errors, 0)
+        self.assertEqual((stats["stalled"], stats["removed"]), (100, 100))
+        self.assertEqual(stats["requests"], len(server.requests))
+
+    def test_service_marked_down_is_not_called(self):
+        with MockArrServer(make_queue(3)) as server:
+            health = Service_health.registry()
+            for _ in range(health.failure_threshold):
+                health.record_failure(Service_health.service_key(server.url), "down")
+            stats = Stall_handler.process_queue(server.url, "test-key")
+        self.assertEqual((stats["stalled"], stats["requests"]), (0, 0))
+        self.assertEqual(server.requests, [])
+
+    def test_failed_bulk_removal_is_not_searched(self):
+        with MockArrServer(make_queue(3)) as server:
+            server.fail[("DELETE", "/api/v3/queue/bulk")] = Stall_handler.MAX_RETRIES + 1
+            stats = Stall_handler.process_queue(server.url, "test-key")
+        self.assertEqual((stats["stalled"], stats["removed"], stats["searched"]), (3, 0, 0))
+        self.assertEqual(server.commands, [])
+
+    def test_batch_sizes(self):
+        delete_batch, search_batch = Stall_handler.DELETE_BATCH_SIZE, Stall_handler.SEARCH_BATCH_SIZE
+        Stall_handler.DELETE_BATCH_SIZE, Stall_handler.SEARCH_BATCH_SIZE = 50, 30
+        try:
+            with MockArrServer(make_queue(120)) as server:
+                stats = Stall_handler.process_queue(server.url, "test-key")
+        finally:
+            Stall_handler.DELETE_BATCH_SIZE, Stall_handler.SEARCH_BATCH_SIZE = delete_batch, search_batch
+        self.assertEqual(stats["searched"], 120)
+        bulk_sizes = [len(body["ids"]) for method, path, query, body in server.requests if method == "DELETE"]
+        self.assertEqual(bulk_sizes, [50, 50, 20])
+        self.assertEqual([len(command["movieIds"]) for command in server.commands], [30, 30, 30, 30])
+
+    def test_each_movie_is_searched_once(self):
+        queue = make_queue(4)
+        for item in queue:
+            item["movieId"] = 7
+        with MockArrServer(queue) as server:
+            stats = Stall_handler.process_queue(server.url, "test-key")
+        self.assertEqual((stats["removed"], stats["searched"]), (4, 1))
+        self.assertEqual(server.commands, [{"name": "MoviesSearch", "movieIds": [7]}])
+
+    def test_legacy_list_response(self):
+        with MockArrServer(make_queue(5, stalled_every=5), paged=False) as server:
+            items = Stall_handler.fetch_stalled_items(server.url, "test-key")
+        self.assertEqual([item["id"] for item in items], [5])
+
+    def test_unreachable_service_returns_no_items(self):
+        with MockArrServer() as server:
+            url = server.url
+        self.assertEqual(Stall_handler.fetch_stalled_items(url, "test-key"), [])
+
+class TestPagedQueue(StallHandlerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.page_size = Stall_handler.QUEUE_PAGE_SIZE
+        self.status_filter = Stall_handler.QUEUE_STATUS_FILTER
+        Stall_handler.QUEUE_PAGE_SIZE = 100
+
+    def tearDown(self):
+        Stall_handler.QUEUE_PAGE_SIZE = self.page_size
+        Stall_handler.QUEUE_STATUS_FILTER = self.status_filter
+        super().tearDown()
+
+    def test_pages_through_whole_queue(self):
+        with MockArrServer(make_queue(2500, stalled_every=10)) as server:
+            items = Stall_handler.fetch_stalled_items(server.url, "test-key")
+        self.assertEqual(len(items), 250)
+        self.assertEqual(len({item["id"] for item in items}), 250)
+        pages = [query["page"] for method, path, query, body in server.requests]
+        self.assertEqual(pages, [str(page) for page in range(1, 26)])
+
+    def test_first_page_is_yielded_before_the_rest_is_fetched(self):
+        with MockArrServer(make_queue(1000)) as server:
+            items = Stall_handler.iter_stalled_items(server.url, "test-key")
+            next(items)
+            self.assertEqual(len(server.requests), 1)
+            items.close()
+
+    def test_server_side_status_filter(self):
+        Stall_handler.QUEUE_STATUS_FILTER = "stalled"
+        with MockArrServer(make_queue(2000, stalled_every=100)) as server:
+            items = Stall_handler.fetch_stalled_items(server.url, "test-key")
+        self.assertEqual(len(items), 20)
+        self.assertEqual(len(server.requests), 1)
+        self.assertEqual(server.requests[0][2]["status"], "stalled")
+
+    def test_process_queue_finds_items_shifted_by_removals(self):
+        # Removing stalled items moves later records onto pages that were already read
+        with MockArrServer(make_queue(600, stalled_every=3)) as server:
+            stats = Stall_handler.process_queue(server.url, "test-key")
+        self.assertEqual(stats["stalled"], 200)
+        self.assertEqual(stats["removed"], 200)
+        self.assertEqual(len(server.blocklisted), 200)
+        self.assertFalse([item for item in server.queue if item["status"] == "Stalled"])
+
+class TestWatch(StallHandlerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.temp_dir = tempfile.mkdtemp()
+        self.tracker = StallTracker(os.path.join(self.temp_dir, "stall_tracker.db"))
+
+    def tearDown(self):
+        self.tracker.close()
+        shutil.rmtree(self.temp_dir)
+        super().tearDown()
+
+    def test_only_items_without_progress_for_the_window_are_removed(self):
+        with MockArrServer(make_queue(4, stalled_every=2)) as server:
+            first = Stall_handler.poll_service(self.tracker, "Radarr", server.url, "test-key", True, window=600, now=0)
+            self.assertEqual((first["new"], first["stalled"], first["due"]), (4, 2, 0))
+            self.assertEqual(server.blocklisted, [])
+
+            # Item 2 starts moving again, item 4 does not
+            server.queue[1]["sizeleft"] = 100000
+            second = Stall_handler.poll_service(self.tracker, "Radarr", server.url, "test-key", True, window=600, now=600)
+            self.assertEqual((second["changed"], second["unchanged"], second["due"], second["removed"]), (1, 3, 1, 1))
+            self.assertEqual(server.blocklisted, [4])
+            self.assertEqual(server.commands, [{"name": "MoviesSearch", "movieIds": [10004]}])
+
+            third = Stall_handler.poll_service(self.tracker, "Radarr", server.url, "test-key", True, window=600, now=900)
+            self.assertEqual((third["queued"], third["gone"], third["due"]), (3, 0, 0))
+
+    def test_failed_poll_records_nothing(self):
+        with MockArrServer(make_queue(2)) as server:
+            Stall_handler.poll_service(self.tracker, "Radarr", server.url, "test-key", True, window=600, now=0)
+            server.fail[("GET", "/api/v3/queue")] = Stall_handler.MAX_RETRIES + 1
+            self.assertIsNone(Stall_handler.poll_service(self.tracker, "Radarr", server.url, "test-key", True, window=600, now=60))
+        self.assertEqual(len(self.tracker.stalled("Radarr")), 2)
+
+    def test_watch_polls_each_service(self):
+        with MockArrServer(make_queue(2)) as radarr, MockArrServer(make_queue(3, movies=False)) as sonarr:
+            services = [("Radarr", radarr.url, "test-key", True), ("Sonarr", sonarr.url, "test-key", False)]
+            Stall_handler.watch(services, self.tracker, interval=0, window=0, polls=2)
+        self.assertEqual(sorted(radarr.blocklisted), [1, 2])
+        self.assertEqual(sorted(sonarr.blocklisted), [1, 2, 3])
+        self.assertEqual(sonarr.commands, [{"name": "EpisodeSearch", "episodeIds": [10001, 10002, 10003]}])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from Stall_tracker import StallTracker
+
+def record(item_id, status="Downloading", sizeleft=500, size=1000):
+    return {"id": item_id, "title": f"Item {item_id}", "status": status, "size": size, "sizeleft": sizeleft,
+            "movieId": 100 + item_id}
+
+class TestStallTracker(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.temp_dir, "stall_tracker.db")
+        self.tracker = StallTracker(self.db_path)
+
+    def tearDown(self):
+        self.tracker.close()
+        shutil.rmtree(self.temp_dir)
+
+    def test_only_differences_are_counted(self):
+        self.assertEqual(self.tracker.update("Radarr", [record(1), record(2)], now=0),
+                         {"new": 2, "changed": 0, "unchanged": 0, "gone": 0})
+        self.assertEqual(self.tracker.update("Radarr", [record(1), record(2, sizeleft=400)], now=60),
+                         {"new": 0, "changed": 1, "unchanged": 1, "gone": 0})
+        self.assertEqual(self.tracker.update("Radarr", [record(2, sizeleft=400)], now=120),
+                         {"new": 0, "changed": 0, "unchanged": 1, "gone": 1})
+
+    def test_due_after_window_without_progress(self):
+        self.tracker.update("Radarr", [record(1, "Stalled"), record(2, "Stalled"), record(3)], now=0)
+        self.assertEqual(self.tracker.due("Radarr", 600, now=300), [])
+        # Item 2 made progress, item 3 is not stalled
+        self.tracker.update("Radarr", [record(1, "Stalled"), record(2, "Stalled", sizeleft=100), record(3)], now=300)
+        due = self.tracker.due("Radarr", 600, now=600)
+        self.assertEqual([(item["id"], item["title"], item["movieId"]) for item in due], [(1, "Item 1", 101)])
+        self.assertEqual(len(self.tracker.stalled("Radarr")), 2)
+
+    def test_stalled_since_resets_when_item_recovers(self):
+        self.tracker.update("Sonarr", [record(1, "Stalled")], now=0)
+        self.tracker.update("Sonarr", [record(1)], now=60)
+        self.assertEqual(self.tracker.stalled("Sonarr"), [])
+        self.tracker.update("Sonarr", [record(1, "Stalled")], now=120)
+        self.assertEqual(self.tracker.stalled("Sonarr")[0]["stalled_since"], 120)
+
+    def test_state_persists(self):
+        self.tracker.update("Radarr", [record(1, "Stalled")], now=0)
+        self.tracker.update("Sonarr", [record(1)], now=0)
+        self.tracker.close()
+        self.tracker = StallTracker(self.db_path)
+        self.assertEqual([item["id"] for item in self.tracker.due("Radarr", 600, now=900)], [1])
+        self.assertEqual(self.tracker.update("Radarr", [record(1, "Stalled")], now=900)["unchanged"], 1)
+
+    def test_forget(self):
+        self.tracker.update("Radarr", [record(1, "Stalled"), record(2, "Stalled")], now=0)
+        self.tracker.forget("Radarr", [1])
+        self.assertEqual([item["id"] for item in self.tracker.due("Radarr", 60, now=120)], [2])
+
+if __name__ == "__main__":
+    unittest.main()